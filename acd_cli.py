@@ -11,9 +11,11 @@ import re
 import appdirs
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from configparser import ConfigParser
+from contextlib import ExitStack
 from functools import partial
-from multiprocessing import Event
+from threading import Event
 
 from pkgutil import walk_packages
 from pkg_resources import iter_entry_points
@@ -22,9 +24,10 @@ import acdcli
 from acdcli.api import client
 from acdcli.api.common import RequestError, is_valid_id
 from acdcli.cache import format, db
+from acdcli.cache.sync import iso_to_db_date
 from acdcli.utils import hashing, progress
 from acdcli.utils.conf import get_conf
-from acdcli.utils.threading import QueuedLoader
+from acdcli.utils.threading import QueuedLoader, POLICIES
 from acdcli.utils.time import *
 
 # load local plugin modules (default ones, for developers)
@@ -70,6 +73,9 @@ for path in paths:
 def_conf = ConfigParser()
 def_conf['download'] = dict(keep_corrupt=False, keep_incomplete=True)
 def_conf['upload'] = dict(timeout_wait=10)
+def_conf['transfer'] = dict(max_connections=QueuedLoader.MAX_NUM_WORKERS, order='largest',
+                            large_file_size=QueuedLoader.LARGE_FILE_SIZE,
+                            retry_delay=QueuedLoader.RETRY_DELAY, queue_size=1000)
 conf = None
 
 # consts
@@ -128,7 +134,8 @@ class CacheConsts(object):
     MAX_AGE = 30
 
 
-def sync_node_list(full=False, to_file=None, from_file=None) -> 'Union[int, None]':
+def sync_node_list(full=False, to_file=None, from_file=None, stats: dict = None) \
+        -> 'Union[int, None]':
     global cache
     cp_ = cache.KeyValueStorage.get(CacheConsts.CHECKPOINT_KEY) if not full else None
     lst = cache.KeyValueStorage.get(CacheConsts.LAST_SYNC_KEY)
@@ -140,43 +147,47 @@ def sync_node_list(full=False, to_file=None, from_file=None) -> 'Union[int, None
               % (wt / 60, wt % 60))
         time.sleep(wt)
 
-    print('Getting changes', end='', flush=True)
+    if to_file:
+        print('Getting changes', end='', flush=True)
+        try:
+            acd_client.get_changes(checkpoint=cp_, include_purged=bool(cp_), silent=False,
+                                   file=to_file).close()
+        except RequestError as e:
+            print(e)
+            logger.critical('Sync failed.')
+            return ERROR_RETVAL
+        return
 
+    # closes the changes file and ends the bulk insertion
+    bulk = ExitStack()
     if from_file:
-        f = open(from_file, 'rb')
+        changesets = acd_client._iter_changes_lines(bulk.enter_context(open(from_file, 'rb')))
+        msg = 'Inserting nodes'
     else:
-        f = acd_client.get_changes(checkpoint=cp_, include_purged=bool(cp_), silent=False,
-                                   file=to_file if to_file else None)
-
-        if to_file:
-            f.close()
-            return
+        changesets = acd_client.iter_changes(checkpoint=cp_, include_purged=bool(cp_))
+        msg = 'Getting and inserting changes'
+    print(msg, end='', flush=True)
 
+    first = True
     try:
-        first = True
-
-        for changeset in acd_client._iter_changes_lines(f):
-            if to_file:
-                if first:
-                    out = open(to_file, 'wb')
-                out.write(b'%s\n' % str(changeset))
-                continue
-
+        for changeset in changesets:
             if changeset.reset or (full and first):
                 cache.drop_all()
                 cache.init()
+                bulk.enter_context(cache.bulk_insert())
                 full = True
             else:
                 cache.remove_purged(changeset.purged_nodes)
 
-            if first:
-                print('Inserting nodes', end='', flush=True)
-
             if len(changeset.nodes) > 0:
                 cache.insert_nodes(changeset.nodes, partial=not full)
+            if stats is not None:
+                stats['nodes'] += len(changeset.nodes)
+                stats['purged'] += len(changeset.purged_nodes)
             cache.KeyValueStorage.update({CacheConsts.LAST_SYNC_KEY: time.time()})
 
-            if len(changeset.nodes) > 0 or len(changeset.purged_nodes) > 0:
+            # streamed pages may be split into several change sets; only the last has a checkpoint
+            if changeset.checkpoint:
                 cache.KeyValueStorage.update({CacheConsts.CHECKPOINT_KEY: changeset.checkpoint})
 
             print('.', end='', flush=True)
@@ -190,31 +201,37 @@ def sync_node_list(full=False, to_file=None, from_file=None) -> 'Union[int, None
             logger.critical('Sync failed.')
         return ERROR_RETVAL
     finally:
-        if not first:
-            print()
-        if to_file:
-            out.close()
+        changesets.close()
+        bulk.close()
+        print()
 
 
 def old_sync() -> 'Union[int, None]':
     global cache
     cache.drop_all()
     cache = db.NodeCache(CACHE_PATH)
+    batch_size = acd_client._conf.getint('changes', 'batch_size')
+    batch = []
     try:
-        folders = acd_client.get_folder_list()
-        folders.extend(acd_client.get_trashed_folders())
-        files = acd_client.get_file_list()
-        files.extend(acd_client.get_trashed_files())
+        # the listings are fetched concurrently and their pages inserted as they arrive
+        with cache.bulk_insert():
+            for page in acd_client.iter_node_pages('kind:FOLDER', 'status:TRASH AND kind:FOLDER',
+                                                   'kind:FILE', 'status:TRASH AND kind:FILE'):
+                batch.extend(page)
+                if len(batch) >= batch_size:
+                    cache.insert_nodes(batch, partial=False)
+                    batch = []
+            cache.insert_nodes(batch, partial=False)
     except RequestError as e:
         logger.error(e)
         logger.critical('Sync failed.')
         return ERROR_RETVAL
 
-    cache.insert_nodes(files + folders, partial=False)
     cache.KeyValueStorage['sync_date'] = time.time()
 
 
-def partial_sync(path: str, recursive: bool) -> 'Union[int|None]':
+def partial_sync(path: str, recursive: bool, max_connections=1,
+                 skip_unchanged=False) -> 'Union[int|None]':
     path = '/' + '/'.join(list(filter(bool, path.split('/'))))
     n = cache.resolve(path, trash=False)
     fid = None
@@ -240,41 +257,94 @@ def partial_sync(path: str, recursive: bool) -> 'Union[int|None]':
         fid = folder_chain[-1]['id']
 
     try:
-        children = acd_client.list_children(fid)
         if recursive:
-            recursive_insert(children)
+            recursive_insert(fid, max_connections, skip_unchanged)
         else:
-            cache.insert_nodes(children)
+            for page in acd_client.iter_children(fid):
+                cache.insert_nodes(page)
     except RequestError as e:
         logger.error("Sync failed: %s" % e)
         return ERROR_RETVAL
 
 
-def recursive_insert(nodes: 'List[dict]'):
-    cache.insert_nodes(nodes)
-    for n in nodes:
-        if n['kind'] == 'FOLDER':
-            recursive_insert(acd_client.list_children(n['id']))
+def recursive_insert(folder_id: str, max_connections: int, skip_unchanged: bool):
+    """Crawls the subtree of a folder breadth-first, listing the children of up to
+    *max_connections* folders concurrently, and inserts the listed nodes in batches.
+
+    :param skip_unchanged: do not descend into folders whose modification date
+       matches the cached one
+    :raises: RequestError"""
+
+    batch_size = acd_client._conf.getint('changes', 'batch_size')
+    batch = []
+    visited = {folder_id}
+    listing = {}
+    """map future -> folder node, inserted only once its listing succeeded, so that an
+    interrupted crawl does not record the folder's modification date"""
 
+    with ThreadPoolExecutor(max_workers=max(1, max_connections)) as executor:
+        futures = {executor.submit(acd_client.list_children, folder_id)}
+        try:
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    children = future.result()
+                    if future in listing:
+                        batch.append(listing.pop(future))
+                    folders = [n for n in children if n['kind'] == 'FOLDER'
+                               and n['status'] != 'PENDING' and n['id'] not in visited]
+                    if skip_unchanged:
+                        # must be compared before the listed folders are inserted
+                        dates = cache.get_modified_dates([f['id'] for f in folders])
+                        folders = [f for f in folders
+                                   if dates.get(f['id']) != iso_to_db_date(f['modifiedDate'])]
+                    visited.update(f['id'] for f in folders)
+                    for f in folders:
+                        listing[executor.submit(acd_client.list_children, f['id'])] = f
+                    futures |= set(listing)
+                    crawled = set(f['id'] for f in folders)
+                    batch.extend(n for n in children if n['id'] not in crawled)
+                if len(batch) >= batch_size:
+                    cache.insert_nodes(batch)
+                    batch = []
+        except:
+            for future in futures:
+                future.cancel()
+            raise
+        else:
+            cache.insert_nodes(batch)
 
-def autosync(interval: int, stop: Event = None):
+
+def autosync(interval: int, stop: Event = None, stats: dict = None):
     """Periodically syncs the node cache each *interval* seconds.
 
-    :param stop: Event that may be triggered to end syncing."""
+    :param stop: Event that may be triggered to end syncing.
+    :param stats: dict that is kept updated with the sync interval, the number of (failed) syncs,
+       the number of applied and purged nodes and the duration of the last and of all syncs"""
 
     if not interval:
         return
 
     interval = max(MIN_SYNC_INTERVAL, interval)
-    while True:
-        if stop.is_set():
-            break
+    if stats is None:
+        stats = {}
+    stats.update(interval=interval, syncs=0, failed=0, nodes=0, purged=0,
+                 last_duration=0.0, total_duration=0.0)
+    while not stop.is_set():
+        start = time.time()
         try:
-            sync_node_list(full=False)
+            ret = sync_node_list(full=False, stats=stats)
         except:
             import traceback
             logger.error(traceback.format_exc())
-        time.sleep(interval)
+            ret = ERROR_RETVAL
+        duration = time.time() - start
+        stats['syncs'] += 1
+        stats['failed'] += 1 if ret else 0
+        stats['last_duration'] = duration
+        stats['total_duration'] += duration
+        logger.info('Sync took %.1fs. Statistics: %s' % (duration, stats))
+        stop.wait(interval)
 
 
 #
@@ -415,16 +485,32 @@ def download_complete(node: 'Node', path: str, hash_: str, rsf: bool):
 #
 
 
+def queued_loader(workers=1, print_progress=True, max_retries=0) -> QueuedLoader:
+    """Creates a QueuedLoader that schedules jobs as set in the transfer section
+    of the settings."""
+
+    order = conf.get('transfer', 'order')
+    if order not in POLICIES:
+        logger.warning('Unknown transfer order "%s".' % order)
+    return QueuedLoader(workers, print_progress, max_retries,
+                        max_workers=conf.getint('transfer', 'max_connections'),
+                        policy=POLICIES.get(order, POLICIES['largest']),
+                        large_file_size=conf.getint('transfer', 'large_file_size'),
+                        retry_delay=conf.getint('transfer', 'retry_delay'),
+                        max_queued=conf.getint('transfer', 'queue_size'))
+
+
 def create_upload_jobs(dirs: list, path: str, parent_id: str, overwr: bool, force: bool,
-                       dedup: bool, rsf: bool, exclude: list, exclude_paths: list, jobs: list) \
-        -> int:
+                       dedup: bool, rsf: bool, exclude: list, exclude_paths: list,
+                       add_job: 'Callable') -> int:
     """Creates upload job if passed path is a file, delegates directory traversal otherwise.
     Detects soft links that link to an already queued directory.
 
     :param dirs: list of directories' inodes traversed so far
     :param rsf: remove source files
     :param exclude: list of file exclusion patterns
-    :param exclude_paths: list of paths for file or directory exclusion"""
+    :param exclude_paths: list of paths for file or directory exclusion
+    :param add_job: function that queues a job, e.g. :meth:`QueuedLoader.add_job`"""
 
     if os.path.realpath(path) in [os.path.realpath(p) for p in exclude_paths]:
         logger.info('Skipping upload of path "%s".' % path)
@@ -441,7 +527,7 @@ def create_upload_jobs(dirs: list, path: str, parent_id: str, overwr: bool, forc
             return DUPLICATE_DIR
         dirs.append(ino)
         return traverse_ul_dir(dirs, path, parent_id, overwr, force, dedup,
-                               rsf, exclude, exclude_paths, jobs)
+                               rsf, exclude, exclude_paths, add_job)
     elif os.path.isfile(path):
         short_nm = os.path.basename(path)
         for reg in exclude:
@@ -451,7 +537,7 @@ def create_upload_jobs(dirs: list, path: str, parent_id: str, overwr: bool, forc
 
         prog = progress.FileProgress(os.path.getsize(path))
         fo = partial(upload_file, path, parent_id, overwr, force, dedup, rsf, pg_handler=prog)
-        jobs.append(fo)
+        add_job(fo)
         return 0
 
     else:
@@ -460,7 +546,8 @@ def create_upload_jobs(dirs: list, path: str, parent_id: str, overwr: bool, forc
 
 
 def traverse_ul_dir(dirs: list, directory: str, parent_id: str, overwr: bool, force: bool,
-                    dedup: bool, rsf: bool, exclude: list, exclude_paths: list, jobs: list) -> int:
+                    dedup: bool, rsf: bool, exclude: list, exclude_paths: list,
+                    add_job: 'Callable') -> int:
     """Duplicates local directory structure."""
 
     if parent_id is None:
@@ -503,7 +590,7 @@ def traverse_ul_dir(dirs: list, directory: str, parent_id: str, overwr: bool, fo
     for entry in entries:
         full_path = os.path.join(real_path, entry)
         ret_val |= create_upload_jobs(dirs, full_path, curr_node.id,
-                                      overwr, force, dedup, rsf, exclude, exclude_paths, jobs)
+                                      overwr, force, dedup, rsf, exclude, exclude_paths, add_job)
 
     return ret_val
 
@@ -512,9 +599,11 @@ def traverse_ul_dir(dirs: list, directory: str, parent_id: str, overwr: bool, fo
 def upload_file(path: str, parent_id: str, overwr: bool, force: bool, dedup: bool, rsf: bool,
                 pg_handler: progress.FileProgress = None) -> RetryRetVal:
     short_nm = os.path.basename(path)
+    local_hash = None
 
     if dedup and cache.file_size_exists(os.path.getsize(path)):
-        nodes = cache.find_by_md5(hashing.hash_file(path))
+        local_hash = hashing.hash_file(path)
+        nodes = cache.find_by_md5(local_hash)
         nodes = [n for n in cache.path_format(nodes)]
         if len(nodes) > 0:
             logger.info('Skipping upload of duplicate file "%s". Location of duplicates: %s'
@@ -547,9 +636,10 @@ def upload_file(path: str, parent_id: str, overwr: bool, force: bool, dedup: boo
         logger.info('Uploading %s' % path)
         hasher = hashing.IncrementalHasher()
         local_size = os.path.getsize(path)
+        # do not hash twice if the file was already hashed for deduplication
+        callbacks = [pg_handler.update] if local_hash else [hasher.update, pg_handler.update]
         try:
-            r = acd_client.upload_file(path, parent_id,
-                                       read_callbacks=[hasher.update, pg_handler.update],
+            r = acd_client.upload_file(path, parent_id, read_callbacks=callbacks,
                                        deduplication=dedup)
         except RequestError as e:
             if e.status_code == 409:  # might happen if cache is outdated
@@ -566,17 +656,18 @@ def upload_file(path: str, parent_id: str, overwr: bool, force: bool, dedup: boo
                 # colliding node ID is returned in error message -> could be used to continue
                 return CACHE_ASYNC
             elif e.status_code == 504 or e.status_code == 408:  # proxy timeout / request timeout
-                return upload_timeout(parent_id, path, hasher.get_result(), local_size, rsf)
+                return upload_timeout(parent_id, path, local_hash or hasher.get_result(),
+                                      local_size, rsf)
             else:
                 logger.error('Uploading "%s" to "%s" [%s] failed. Error message: %s.'
                              % (short_nm, cache.get_node(parent_id).simple_name, parent_id, e))
                 return UL_DL_FAILED
         else:
-            return upload_complete(r, path, hasher.get_result(), local_size, rsf)
+            return upload_complete(r, path, local_hash or hasher.get_result(), local_size, rsf)
 
     # else: file exists
 
-    rmod = datetime_to_timestamp(conflicting_node.modified)
+    rmod = conflicting_node.mtime
     rmod = datetime.utcfromtimestamp(rmod)
     lmod = datetime.utcfromtimestamp(os.path.getmtime(path))
     lcre = datetime.utcfromtimestamp(os.path.getctime(path))
@@ -663,9 +754,9 @@ def upload_stream(stream, file_name, parent_id, overwr=False, dedup=False,
 
 
 def create_dl_jobs(node_id: str, local_path: str, preserve_mtime: bool, rsf: bool,
-                   exclude: 'List[re._pattern_type]', jobs: list) -> int:
-    """Appends download partials for folder/file node pointed to by *node_id*
-    to the **jobs** list."""
+                   exclude: 'List[re._pattern_type]', add_job: 'Callable') -> int:
+    """Queues download partials for folder/file node pointed to by *node_id*
+    using **add_job**."""
 
     local_path = local_path if local_path else ''
 
@@ -674,7 +765,7 @@ def create_dl_jobs(node_id: str, local_path: str, preserve_mtime: bool, rsf: boo
         return 0
 
     if node.is_folder:
-        return traverse_dl_folder(node, local_path, preserve_mtime, rsf, exclude, jobs)
+        return traverse_dl_folder(node, local_path, preserve_mtime, rsf, exclude, add_job)
 
     loc_name = node.name
 
@@ -693,13 +784,13 @@ def create_dl_jobs(node_id: str, local_path: str, preserve_mtime: bool, rsf: boo
 
     prog = progress.FileProgress(node.size)
     fo = partial(download_file, node_id, local_path, preserve_mtime, rsf, pg_handler=prog)
-    jobs.append(fo)
+    add_job(fo)
 
     return 0
 
 
 def traverse_dl_folder(node: 'Node', local_path: str, preserve_mtime: bool, rsf: bool,
-                       exclude: 'List[re._pattern_type', jobs: list) -> int:
+                       exclude: 'List[re._pattern_type', add_job: 'Callable') -> int:
     """Duplicates remote folder structure."""
 
     if not local_path:
@@ -721,9 +812,9 @@ def traverse_dl_folder(node: 'Node', local_path: str, preserve_mtime: bool, rsf:
     folders, files = sorted(folders), sorted(files)
 
     for file in files:
-        ret_val |= create_dl_jobs(file.id, curr_path, preserve_mtime, rsf, exclude, jobs)
+        ret_val |= create_dl_jobs(file.id, curr_path, preserve_mtime, rsf, exclude, add_job)
     for folder in folders:
-        ret_val |= traverse_dl_folder(folder, curr_path, preserve_mtime, rsf, exclude, jobs)
+        ret_val |= traverse_dl_folder(folder, curr_path, preserve_mtime, rsf, exclude, add_job)
     return ret_val
 
 
@@ -744,7 +835,7 @@ def download_file(node_id: str, local_path: str, preserve_mtime: bool, rsf: bool
         return UL_DL_FAILED
     else:
         if preserve_mtime:
-            mtime = datetime_to_timestamp(node.modified)
+            mtime = node.mtime
             os.utime(os.path.join(local_path, name), (mtime, mtime))
 
         return download_complete(node, os.path.join(local_path, name), hasher.get_result(), rsf)
@@ -799,7 +890,7 @@ def old_sync_action(args: argparse.Namespace):
 
 def partial_sync_action(args: argparse.Namespace):
     print('Syncing...')
-    r = partial_sync(args.path, args.recursive)
+    r = partial_sync(args.path, args.recursive, args.max_connections, args.skip_unchanged)
     if not r:
         print('Done.')
     return r
@@ -882,23 +973,23 @@ def upload_action(args: argparse.Namespace) -> int:
         return INVALID_ARG_RETVAL
 
     excl_re = regex_helper(args)
+    ql = queued_loader(args.max_connections, args.print_progress, max_retries=args.max_retries)
+
+    def produce() -> int:
+        ret_val = 0
+        for path in args.path:
+            if not os.path.exists(path):
+                logger.error('Path "%s" does not exist.' % path)
+                ret_val |= INVALID_ARG_RETVAL
+                continue
 
-    jobs = []
-    ret_val = 0
-    for path in args.path:
-        if not os.path.exists(path):
-            logger.error('Path "%s" does not exist.' % path)
-            ret_val |= INVALID_ARG_RETVAL
-            continue
-
-        ret_val |= create_upload_jobs([], path, args.parent, args.overwrite, args.force,
-                                      args.deduplicate, args.remove_source_files,
-                                      excl_re, args.exclude_path, jobs)
-
-    ql = QueuedLoader(args.max_connections, args.print_progress, max_retries=args.max_retries)
-    ql.add_jobs(jobs)
+            ret_val |= create_upload_jobs([], path, args.parent, args.overwrite, args.force,
+                                          args.deduplicate, args.remove_source_files,
+                                          excl_re, args.exclude_path, ql.add_job)
+        return ret_val
 
-    return ret_val | ql.start()
+    # transfers start while the directories are traversed
+    return ql.start(produce)
 
 
 @no_autores_trash_action
@@ -908,7 +999,7 @@ def upload_stream_action(args: argparse.Namespace) -> int:
         return INVALID_ARG_RETVAL
 
     prog = progress.FileProgress(0)
-    ql = QueuedLoader(print_progress=args.print_progress, max_retries=0)
+    ql = queued_loader(print_progress=args.print_progress, max_retries=0)
     job = partial(upload_stream,
                   sys.stdin.buffer, args.name, args.parent, args.overwrite, args.deduplicate,
                   pg_handler=prog)
@@ -923,7 +1014,7 @@ def overwrite_action(args: argparse.Namespace) -> int:
         return INVALID_ARG_RETVAL
 
     prog = progress.FileProgress(os.path.getsize(args.file))
-    ql = QueuedLoader(print_progress=args.print_progress, max_retries=args.max_retries)
+    ql = queued_loader(print_progress=args.print_progress, max_retries=args.max_retries)
     job = partial(overwrite, args.node, args.file, pg_handler=prog)
     ql.add_jobs([job])
 
@@ -932,16 +1023,10 @@ def overwrite_action(args: argparse.Namespace) -> int:
 
 def download_action(args: argparse.Namespace) -> int:
     excl_re = regex_helper(args)
+    ql = queued_loader(args.max_connections, args.print_progress, args.max_retries)
 
-    jobs = []
-    ret_val = 0
-    ret_val |= create_dl_jobs(args.node, args.path, args.times, args.remove_source_files,
-                              excl_re, jobs)
-
-    ql = QueuedLoader(args.max_connections, args.print_progress, args.max_retries)
-    ql.add_jobs(jobs)
-
-    return ret_val | ql.start()
+    return ql.start(partial(create_dl_jobs, args.node, args.path, args.times,
+                            args.remove_source_files, excl_re, ql.add_job))
 
 
 def cat_action(args: argparse.Namespace) -> int:
@@ -1060,13 +1145,15 @@ def resolve_action(args: argparse.Namespace) -> int:
 
 @offline_action
 def find_action(args: argparse.Namespace):
-    nodes = cache.find_by_name(args.name)
-
-    if not nodes:
-        return INVALID_ARG_RETVAL
+    nodes = cache.find_by_name(args.name, args.limit)
 
+    found = False
     for line in cache.long_id_format(nodes):
         print(line)
+        found = True
+
+    if not found:
+        return INVALID_ARG_RETVAL
 
 
 @offline_action
@@ -1086,7 +1173,7 @@ def find_regex_action(args: argparse.Namespace) -> int:
     except re.error as e:
         logger.critical('Invalid regular expression specified.')
         return INVALID_ARG_RETVAL
-    nodes = cache.find_by_regex(args.regex)
+    nodes = cache.find_by_regex(args.regex, args.limit)
     for node in cache.long_id_format(nodes):
         print(node)
     return 0
@@ -1152,7 +1239,7 @@ def metadata_action(args: argparse.Namespace) -> int:
 
 
 def mount_action(args: argparse.Namespace):
-    asp = partial(autosync, args.interval, stop=Event())
+    asp = partial(autosync, args.interval, stop=Event(), stats={})
 
     import acdcli.acd_fuse
     acdcli.acd_fuse.mount(args.path, dict(acd_client=acd_client, cache=cache,
@@ -1393,6 +1480,12 @@ def get_parser() -> tuple:
     psync_sp = subparsers.add_parser('psync', help='[+] only refresh the node cache for the '
                                                    'specified folder [does not include trash]')
     psync_sp.add_argument('--recursive', '-r', action='store_true')
+    psync_sp.add_argument('--max-connections', '-x', action='store', type=int, default=4,
+                          help='set the number of folders listed concurrently '
+                               'in recursive mode [default: 4]')
+    psync_sp.add_argument('--skip-unchanged', '-u', action='store_true',
+                          help='do not descend into folders whose modification date '
+                               'has not changed since the last sync')
     psync_sp.add_argument('path')
     psync_sp.set_defaults(func=partial_sync_action)
 
@@ -1420,6 +1513,7 @@ def get_parser() -> tuple:
 
     find_sp = subparsers.add_parser('find', aliases=['f'], help=
     'find nodes by name [offline operation] [case insensitive]')
+    find_sp.add_argument('--limit', '-l', type=int, help='maximum number of results')
     find_sp.add_argument('name')
     find_sp.set_defaults(func=find_action)
 
@@ -1431,6 +1525,7 @@ def get_parser() -> tuple:
     find_regex_sp = subparsers.add_parser('find-regex', aliases=['fr'],
                                           help='find nodes by regular expression '
                                                '[offline operation] [case insensitive]\n\n')
+    find_regex_sp.add_argument('--limit', '-l', type=int, help='maximum number of results')
     find_regex_sp.add_argument('regex')
     find_regex_sp.set_defaults(func=find_regex_action)
 
@@ -1438,7 +1533,8 @@ def get_parser() -> tuple:
     re_dummy_sp = dummy_p.add_parser('', add_help=False)
     re_dummy_sp.add_argument('--max-connections', '-x', action='store', type=int, default=1,
                              help='set the maximum concurrent connections [default: 1, '
-                                  'maximum: %i' % QueuedLoader.MAX_NUM_WORKERS + ']')
+                                  'maximum: max_connections setting, %i by default]'
+                                  % QueuedLoader.MAX_NUM_WORKERS)
     max_ret.attach(re_dummy_sp)
     re_dummy_sp.add_argument('--exclude-ending', '-xe', action='append', dest='exclude_fe',
                              default=[], help='exclude files whose endings match the given string,'
@@ -1678,7 +1774,7 @@ def main():
 
     if args.no_wait:
         from acdcli.api.backoff_req import BackOffRequest
-        BackOffRequest._wait = lambda x: None
+        BackOffRequest._wait = lambda *args: None
 
     autoresolve_attrs = ['child', 'parent', 'node']
     resolve_remote_path_args(args, autoresolve_attrs,
@@ -1689,6 +1785,8 @@ def main():
         logger.debug(args)
 
         ret = args.func(args)
+        if acd_client:
+            logger.info('Connection statistics: %s' % acd_client.BOReq.connection_stats())
         if not ret:
             sys.exit(ret)
 
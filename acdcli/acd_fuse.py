@@ -2,16 +2,17 @@
 
 import configparser
 import errno
+import io
 import logging
 import os
 import stat
 import sys
+import tempfile
 
-from collections import deque, defaultdict
-from multiprocessing import Process
-from queue import Queue, Full as QueueFull
-from threading import Thread, Lock, Event
-from time import time, sleep
+from collections import deque, defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock, Condition, Event, Timer
+from time import time
 
 import ctypes.util
 ctypes.util.__find_library = ctypes.util.find_library
@@ -28,6 +29,7 @@ ctypes.util.find_library = find_library
 
 from fuse import FUSE, FuseOSError as FuseError, Operations
 from acdcli.api.common import RequestError
+from acdcli.utils.blockcache import BlockCache
 from acdcli.utils.conf import get_conf
 from acdcli.utils.time import *
 
@@ -46,8 +48,12 @@ _SETTINGS_FILENAME = 'fuse.ini'
 
 _def_conf = configparser.ConfigParser()
 _def_conf['fs'] = dict(block_size=512)
-_def_conf['read'] = dict(open_chunk_limit=10, timeout=5)
-_def_conf['write'] = dict(buffer_size = 32, timeout=30)
+_def_conf['read'] = dict(open_chunk_limit=10, timeout=5, block_size=2 * 1024 ** 2,
+                         readahead_max_blocks=16, readahead_threads=4, block_cache_size=0,
+                         seek_back_size=1024 ** 2, skip_ahead_size=4 * 1024 ** 2,
+                         min_range_size=1024 ** 2, max_range_size=64 * 1024 ** 2)
+_def_conf['write'] = dict(buffer_size = 32, timeout=30, small_file_size=1024 ** 2,
+                          write_back=False, upload_threads=2, create_threads=4)
 
 
 class FuseOSError(FuseError):
@@ -84,18 +90,88 @@ class FuseOSError(FuseError):
 class ReadProxy(object):
     """Dict of stream chunks for consecutive read access of files."""
 
-    def __init__(self, acd_client, open_chunk_limit, timeout):
+    def __init__(self, acd_client, open_chunk_limit, timeout, block_size=2 * 1024 ** 2,
+                 readahead_max_blocks=16, readahead_threads=4, block_cache=None,
+                 seek_back=0, skip_ahead=0, min_range=1024 ** 2, max_range=64 * 1024 ** 2):
+        """:param block_size: size of the blocks that are prefetched and cached
+        :param readahead_max_blocks: maximum number of blocks prefetched per file, 0 disables
+           the read-ahead
+        :param readahead_threads: number of threads fetching blocks for all files
+        :param block_cache: on-disk cache of blocks
+        :type block_cache: acdcli.utils.blockcache.BlockCache
+        :param seek_back: number of recently read bytes kept per chunk for backward seeks
+        :param skip_ahead: maximum number of bytes skipped on a chunk for forward seeks
+        :param min_range: size of the byte range requested for a random read
+        :param max_range: maximum size of the byte range requested for sequential reads"""
+
         self.acd_client = acd_client
         self.lock = Lock()
-        self.files = defaultdict(lambda: ReadProxy.ReadFile(open_chunk_limit, timeout))
+        executor = None
+        if readahead_max_blocks > 0:
+            executor = ThreadPoolExecutor(max_workers=max(1, readahead_threads))
+        self.blocks = ReadProxy.BlockSource(acd_client, timeout, block_size, readahead_max_blocks,
+                                            executor, block_cache)
+        self.files = defaultdict(lambda: ReadProxy.ReadFile(open_chunk_limit, timeout,
+                                                            self.blocks, seek_back, skip_ahead,
+                                                            min_range, max(min_range, max_range)))
+
+    class BlockSource(object):
+        """Fetches blocks of files from the block cache or, failing that, the network.
+        Shared by all files."""
+
+        __slots__ = ('acd_client', 'timeout', 'block_size', 'max_blocks', 'executor', 'cache',
+                     'stats', 'stats_lock')
+
+        def __init__(self, acd_client, timeout, block_size, max_blocks, executor, cache):
+            self.acd_client = acd_client
+            self.timeout = timeout
+            self.block_size = block_size
+            self.max_blocks = max_blocks
+            """maximum read-ahead window"""
+            self.executor = executor
+            """executor for the read-ahead, ``None`` if the read-ahead is disabled"""
+            self.cache = cache
+            """:type: acdcli.utils.blockcache.BlockCache"""
+            self.stats = dict(requests=0, requested=0, consumed=0)
+            """number of ranged requests, bytes requested from and bytes read by the kernel"""
+            self.stats_lock = Lock()
+
+        def account(self, requested=0, consumed=0):
+            """Adds to the read statistics of the mount."""
+            with self.stats_lock:
+                if requested:
+                    self.stats['requests'] += 1
+                    self.stats['requested'] += requested
+                self.stats['consumed'] += consumed
+
+        def fetch(self, id_, md5, index, total) -> bytes:
+            """:raises: RequestError"""
+            if self.cache:
+                data = self.cache.get(id_, md5, index)
+                if data is not None:
+                    return data
+            offset = index * self.block_size
+            length = min(self.block_size, total - offset)
+            self.account(requested=length)
+            data = bytes(self.acd_client.download_chunk(id_, offset, length, timeout=self.timeout))
+            if self.cache:
+                self.cache.put(id_, md5, index, data)
+            return data
 
     class StreamChunk(object):
         """StreamChunk represents a file node chunk as a streamed ranged HTTP response
-        which may or may not be partially read."""
+        which may or may not be partially read. The most recently read bytes are kept in a ring
+        buffer, so that reads slightly behind the stream position do not require a new request;
+        reads slightly ahead of it are served by reading and discarding the bytes in between."""
+
+        __slots__ = ('offset', 'r', 'end', 'ring', 'seek_back', 'skip_ahead')
 
-        __slots__ = ('offset', 'r', 'end')
+        SKIP_PIECE = 64 * 1024
+
+        def __init__(self, acd_client, id_, offset, length, seek_back=0, skip_ahead=0, **kwargs):
+            """:param seek_back: number of recently read bytes kept for backward seeks
+            :param skip_ahead: maximum number of bytes skipped for forward seeks"""
 
-        def __init__(self, acd_client, id_, offset, length, **kwargs):
             self.offset = offset
             """the first byte position (fpos) available in the chunk"""
 
@@ -105,20 +181,23 @@ class ReadProxy(object):
             self.end = offset + int(self.r.headers['content-length']) - 1
             """the last byte position (fpos) contained in the chunk"""
 
+            self.ring = bytearray()
+            """the bytes preceding :attr:`offset`"""
+            self.seek_back = seek_back
+            self.skip_ahead = skip_ahead
+
         def has_byte_range(self, offset, length) -> bool:
-            """Tests whether chunk begins at **offset** and has at least **length** bytes remaining.
-            """
+            """Tests whether the range from **offset** with **length** bytes can be read from
+            the chunk, i.e. it begins at the current offset, within the ring buffer or at most
+            :attr:`skip_ahead` bytes ahead, and does not exceed the chunk's end."""
             logger.debug('s: %d-%d; r: %d-%d'
                          % (self.offset, self.end, offset, offset + length - 1))
-            if offset == self.offset and offset + length - 1 <= self.end:
-                return True
-            return False
-
-        def get(self, length) -> bytes:
-            """Gets *length* bytes beginning at current offset.
+            if offset + length - 1 > self.end:
+                return False
+            return -len(self.ring) <= offset - self.offset <= self.skip_ahead
 
-            :param length: the number of bytes to get
-            :raises: Exception if less than *length* bytes were received \
+        def _read(self, length) -> bytes:
+            """:raises: Exception if less than *length* bytes were received \
              but end of chunk was not reached"""
 
             b = next(self.r.iter_content(length))
@@ -127,26 +206,178 @@ class ReadProxy(object):
             if len(b) < length and self.offset <= self.end:
                 logger.warning('Chunk ended unexpectedly.')
                 raise Exception
+
+            if self.seek_back:
+                self.ring.extend(b[-self.seek_back:])
+                if len(self.ring) > self.seek_back:
+                    del self.ring[:-self.seek_back]
             return b
 
+        def get(self, offset, length) -> bytes:
+            """Gets *length* bytes beginning at *offset*, which must satisfy
+            :meth:`has_byte_range`.
+
+            :param length: the number of bytes to get
+            :raises: Exception if less than *length* bytes were received \
+             but end of chunk was not reached"""
+
+            while offset > self.offset:
+                self._read(min(offset - self.offset, self.SKIP_PIECE))
+
+            back = self.offset - offset
+            if not back:
+                return self._read(length)
+            head = bytes(self.ring[len(self.ring) - back:][:length])
+            if len(head) == length:
+                return head
+            return head + self._read(length - len(head))
+
         def close(self):
             """Closes connection on the stream."""
             self.r.close()
 
     class ReadFile(object):
         """Represents a file opened for reading.
-        Encapsulates at most :attr:`MAX_CHUNKS_PER_FILE` open chunks."""
+        Encapsulates at most :attr:`MAX_CHUNKS_PER_FILE` open chunks.
+
+        If the file is read sequentially, the blocks following the read position are prefetched
+        on the read-ahead threads. The read-ahead window starts at one block once two reads in a
+        row were (roughly) sequential, doubles each time the reader enters the next block,
+        up to the maximum, and is halved on random access. Blocks covered by an open chunk
+        that the reader is streaming from are not prefetched. If the block cache is enabled,
+        reads that are not served by prefetched blocks fetch whole blocks, too.
+
+        Otherwise, reads are served by StreamChunks. A new chunk requests a small range on
+        random access; the range doubles each time a sequential read exhausts a chunk."""
 
-        __slots__ = ('chunks', 'access', 'lock', 'timeout')
+        __slots__ = ('chunks', 'access', 'lock', 'timeout', 'seek_back', 'skip_ahead',
+                     'min_range', 'max_range', 'range_size', 'stream_offset',
+                     'source', 'blocks', 'window', 'streak', 'next_offset', 'block')
 
-        def __init__(self, open_chunk_limit, timeout):
+        SEQUENTIAL_READS = 2
+        """number of consecutive sequential reads that start the read-ahead"""
+
+        def __init__(self, open_chunk_limit, timeout, source, seek_back=0, skip_ahead=0,
+                     min_range=1024 ** 2, max_range=64 * 1024 ** 2):
             self.chunks = deque(maxlen=open_chunk_limit)
             self.access = time()
             self.lock = Lock()
             self.timeout = timeout
+            self.seek_back = seek_back
+            self.skip_ahead = skip_ahead
+
+            self.min_range = min_range
+            self.max_range = max_range
+            self.range_size = min_range
+            """length of the byte range requested for the next StreamChunk"""
+            self.stream_offset = -1
+            """the offset following the last read served by a StreamChunk"""
+
+            self.source = source
+            """:type: ReadProxy.BlockSource"""
+            self.blocks = OrderedDict()
+            """map block index -> future of the block's bytes"""
+            self.window = 0
+            """number of blocks to prefetch ahead of the read position"""
+            self.streak = 0
+            """number of consecutive sequential reads"""
+            self.next_offset = 0
+            """the offset a sequential read is expected at"""
+            self.block = -1
+            """index of the block the previous read ended in"""
+
+        def _adapt_readahead(self, id_, md5, offset, length, total):
+            """Adapts the read-ahead window to the access pattern, drops blocks outside of it
+            and schedules the blocks not yet fetched. Must be called holding the lock."""
+
+            src = self.source
+            bs = src.block_size
+            if abs(offset - self.next_offset) <= bs:
+                self.streak += 1
+            else:
+                self.streak = 0
+                self.window //= 2
+            self.next_offset = offset + length
+
+            block = self.next_offset // bs
+            ahead = 0
+            if self.streak >= self.SEQUENTIAL_READS:
+                if not self.window:
+                    self.window = 1
+                elif block > self.block:
+                    self.window = min(self.window * 2, src.max_blocks)
+                ahead = self.window
+            self.block = block
+
+            # the bytes an open chunk is about to serve are not prefetched
+            start = block
+            for c in self.chunks:
+                if c.offset - len(c.ring) <= self.next_offset <= c.end:
+                    start = max(start, (c.end + 1) // bs)
+
+            first = offset // bs
+            last = min(start + ahead, (total - 1) // bs + 1)
+            for i in list(self.blocks):
+                if not first <= i < last:
+                    self.blocks.pop(i).cancel()
+            for i in range(start, last):
+                if i not in self.blocks:
+                    self.blocks[i] = src.executor.submit(src.fetch, id_, md5, i, total)
+
+        def _get_prefetched(self, offset, length) -> 'Union[bytes, None]':
+            """Gets a byte range from prefetched blocks.
+
+            :returns: ``None`` if the range is not fully covered by fetched or scheduled blocks"""
+
+            bs = self.source.block_size
+            first, last = offset // bs, (offset + length - 1) // bs
+            with self.lock:
+                futures = [self.blocks.get(i) for i in range(first, last + 1)]
+            if None in futures:
+                return
+
+            try:
+                parts = [f.result() for f in futures]
+            except Exception as e:
+                logger.info('Prefetching failed: %s' % e)
+                with self.lock:
+                    for i in range(first, last + 1):
+                        self.blocks.pop(i, None)
+                return
 
-        def get(self, acd_client, id_, offset, length, total) -> bytes:
-            """Gets a byte range from existing StreamChunks"""
+            start = offset - first * bs
+            if len(parts) == 1:
+                return bytes(parts[0][start:start + length])
+            return b''.join(parts)[start:start + length]
+
+        def _get_blocks(self, id_, md5, offset, length, total) -> bytes:
+            """Gets a byte range by fetching the blocks it spans.
+
+            :raises: FuseOSError"""
+
+            bs = self.source.block_size
+            first, last = offset // bs, (offset + length - 1) // bs
+            try:
+                parts = [self.source.fetch(id_, md5, i, total) for i in range(first, last + 1)]
+            except RequestError as e:
+                FuseOSError.convert(e)
+            start = offset - first * bs
+            return b''.join(parts)[start:start + length]
+
+        def get(self, acd_client, id_, md5, offset, length, total) -> bytes:
+            """Gets a byte range from prefetched blocks, the block cache or existing
+            StreamChunks"""
+
+            if self.source.executor:
+                with self.lock:
+                    self._adapt_readahead(id_, md5, offset, length, total)
+                bytes_ = self._get_prefetched(offset, length)
+                if bytes_ is not None:
+                    return bytes_
+
+            # read whole blocks so that they are cached
+            if self.source.cache and md5:
+                return self._get_blocks(id_, md5, offset, length, total)
 
             with self.lock:
                 i = len(self.chunks) - 1
@@ -154,29 +385,42 @@ class ReadProxy(object):
                     c = self.chunks[i]
                     if c.has_byte_range(offset, length):
                         try:
-                            bytes_ = c.get(length)
+                            bytes_ = c.get(offset, length)
                         except:
                             self.chunks.remove(c)
                         else:
+                            self.stream_offset = offset + length
                             return bytes_
                     i -= 1
 
             try:
                 with self.lock:
-                    chunk = ReadProxy.StreamChunk(acd_client, id_, offset,
-                                                  acd_client._conf.getint('transfer',
-                                                                          'dl_chunk_size'),
+                    # a read continuing the previous one has exhausted its chunk
+                    if offset == self.stream_offset:
+                        self.range_size = min(self.range_size * 2, self.max_range)
+                    else:
+                        self.range_size = self.min_range
+                    size = max(length, self.range_size)
+                    if self.source.executor:
+                        # end on a block boundary, where the read-ahead takes over
+                        bs = self.source.block_size
+                        size = min(-(-(offset + size) // bs) * bs, total) - offset
+                    chunk = ReadProxy.StreamChunk(acd_client, id_, offset, size,
+                                                  self.seek_back, self.skip_ahead,
                                                   timeout=self.timeout)
+                    self.source.account(requested=chunk.end - offset + 1)
                     if len(self.chunks) == self.chunks.maxlen:
                         self.chunks[0].close()
 
                     self.chunks.append(chunk)
-                    return chunk.get(length)
+                    bytes_ = chunk.get(offset, length)
+                    self.stream_offset = offset + length
+                    return bytes_
             except RequestError as e:
                 FuseOSError.convert(e)
 
         def clear(self):
-            """Closes chunks and clears chunk deque."""
+            """Closes chunks and clears chunk deque, cancels the read-ahead."""
             with self.lock:
                 for chunk in self.chunks:
                     try:
@@ -184,11 +428,26 @@ class ReadProxy(object):
                     except:
                         pass
                 self.chunks.clear()
-
-    def get(self, id_, offset, length, total):
+                for future in self.blocks.values():
+                    future.cancel()
+                self.blocks.clear()
+                self.window = self.streak = 0
+                self.next_offset = 0
+                self.block = -1
+                self.range_size = self.min_range
+                self.stream_offset = -1
+
+    def get(self, id_, md5, offset, length, total):
         with self.lock:
             f = self.files[id_]
-        return f.get(self.acd_client, id_, offset, length, total)
+        bytes_ = f.get(self.acd_client, id_, md5, offset, length, total)
+        self.blocks.account(consumed=len(bytes_))
+        return bytes_
+
+    def info(self) -> dict:
+        """:returns: number of ranged requests, bytes requested from ACD and bytes read"""
+        with self.blocks.stats_lock:
+            return dict(self.blocks.stats)
 
     def invalidate(self):
         pass
@@ -201,145 +460,617 @@ class ReadProxy(object):
 
 
 class WriteProxy(object):
-    """Collection of WriteStreams for consecutive file write operations."""
+    """Collection of WriteStreams for consecutive file write operations.
+    The content of a file is buffered in memory until it exceeds the small file size; files
+    that are closed before are uploaded in a single request on flush or release. Larger files
+    are streamed while they are being written.
+
+    Files created through the mount are kept as :class:`PendingFile` until they are uploaded
+    along with their name, so that creating a file takes a single request. Small new files are
+    uploaded by the create threads once they are released. If their upload fails, they are kept
+    and retried with an increasing delay; a last attempt is made on shutdown. Uploads rejected
+    by the server, e.g. due to a name conflict, are not retried."""
+
+    RETRY_DELAY = 5
+    MAX_RETRY_DELAY = 300
+
+    def __init__(self, acd_client, cache, buffer_size, timeout, small_file_size=0,
+                 create_threads=1):
+        """:param buffer_size: maximum number of written blocks buffered for the upload
+        :param small_file_size: maximum size of the files uploaded in a single request
+        :param create_threads: maximum number of simultaneous uploads of new small files"""
 
-    def __init__(self, acd_client, cache, buffer_size, timeout):
         self.acd_client = acd_client
         self.cache = cache
+        self.small_file_size = small_file_size
         self.files = defaultdict(lambda: WriteProxy.WriteStream(buffer_size, timeout))
+        self.pending = {}
+        """map path -> PendingFile"""
+        self.failed = {}
+        """map WriteStream -> Timer of the retry of the new small files whose upload failed"""
+        self.halted = False
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, create_threads))
+
+    class PendingFile(object):
+        """A file that is not created remotely yet. Provides the node attributes used by
+        :class:`ACDFuse`."""
+
+        __slots__ = ('path', 'name', 'parent_id', 'id', 'stream', 'ctime', 'mtime', 'created')
+
+        is_file = True
+        is_folder = False
+        md5 = None
+
+        def __init__(self, path, parent_id, stream):
+            self.path = path
+            self.name = os.path.basename(path)
+            self.parent_id = parent_id
+            self.id = None
+            """the node ID, set once the file was created"""
+            self.stream = stream
+            """:type: WriteProxy.WriteStream"""
+            self.ctime = self.mtime = time()
+            self.created = Event()
+            """set once the upload has succeeded or finally failed"""
+
+        @property
+        def size(self) -> int:
+            return self.stream.offset
+
+        def read(self, offset, length) -> bytes:
+            """:raises: FuseOSError if the content is being streamed"""
+            if self.stream.started:
+                raise FuseOSError(errno.EBUSY)
+            return self.stream.content()[offset:offset + length]
 
     class WriteStream(object):
-        """A WriteStream is a binary file-like object that is backed by a Queue.
-        It will remember its current offset."""
+        """A WriteStream is a binary file-like object that is backed by a bounded buffer
+        of written blocks. It will remember its current offset.
+        Writers, the reading upload and waiters for flushes or the upload's completion
+        are woken by a condition variable."""
 
-        __slots__ = ('q', 'offset', 'error', 'closed', 'done', 'timeout')
+        __slots__ = ('buf', 'buffer_size', 'offset', 'error', 'closed', 'done', 'started',
+                     'synced', 'node', 'cond', 'timeout')
 
         def __init__(self, buffer_size, timeout):
-            self.q = Queue(maxsize=buffer_size)
-            """a queue that buffers written blocks"""
+            self.buf = deque()
+            """written blocks not read yet"""
+            self.buffer_size = buffer_size
+            """maximum number of buffered blocks while the upload runs"""
             self.offset = 0
             """the beginning fpos"""
             self.error = False
             """whether the read or write failed"""
             self.closed = False
-            self.done = Event()
-            """done event is triggered when file is successfully read and transferred"""
+            self.done = False
+            """whether the file was successfully read and transferred"""
+            self.started = False
+            """whether the content is being streamed"""
+            self.synced = False
+            """whether the buffered content of a small file was uploaded"""
+            self.node = None
+            """the node or pending file written to"""
+            self.cond = Condition()
             self.timeout = timeout
 
         def write(self, data: bytes):
-            """Writes data into queue.
+            """Writes data into the buffer. Waits for the buffer to be read if it is full.
 
             :raises: FuseOSError on timeout"""
 
-            if self.error:
-                raise FuseOSError(errno.EREMOTEIO)
-            try:
-                self.q.put(data, timeout=self.timeout)
-            except QueueFull:
-                logger.error('Write timeout.')
-                raise FuseOSError(errno.ETIMEDOUT)
-            self.offset += len(data)
+            with self.cond:
+                if not self.cond.wait_for(lambda: self.error or not self.started
+                                          or len(self.buf) < self.buffer_size, self.timeout):
+                    logger.error('Write timeout.')
+                    raise FuseOSError(errno.ETIMEDOUT)
+                if self.error:
+                    raise FuseOSError(errno.EREMOTEIO)
+                self.buf.append(data)
+                self.offset += len(data)
+                self.synced = False
+                self.cond.notify_all()
 
         def read(self, ln=0) -> bytes:
-            """Returns as much byte data from queue as possible.
-            Returns empty bytestring (EOF) if queue is empty and file was closed.
+            """Returns as much byte data from the buffer as possible, waiting for data if
+            the buffer is empty. Returns empty bytestring (EOF) if buffer is empty and file
+            was closed.
 
             :raises: IOError"""
 
-            if self.error:
-                raise IOError(errno.EIO, errno.errorcode[errno.EIO])
+            with self.cond:
+                self.cond.wait_for(lambda: self.error or self.buf or self.closed)
+                if self.error:
+                    raise IOError(errno.EIO, errno.errorcode[errno.EIO])
+                b = b''.join(self.buf)
+                self.buf.clear()
+                self.cond.notify_all()
+            return b
 
-            if self.closed and self.q.empty():
-                return b''
+        def content(self) -> bytes:
+            """:returns: the buffered content of a file that is not streamed"""
+            with self.cond:
+                return b''.join(self.buf)
 
-            b = [self.q.get()]
-            self.q.task_done()
-            while not self.q.empty():
-                b.append(self.q.get())
-                self.q.task_done()
+        def fail(self):
+            with self.cond:
+                self.error = True
+                self.cond.notify_all()
 
-            return b''.join(b)
+        def finish(self):
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
 
         def flush(self):
-            """Waits until the queue is emptied.
+            """Waits until the buffer is emptied.
 
             :raises: FuseOSError"""
 
-            while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.error or not self.buf)
                 if self.error:
                     raise FuseOSError(errno.EREMOTEIO)
-                if self.q.empty():
-                    return
-                sleep(1)
 
         def close(self):
             """Sets the closed flag to signal 'EOF' to the read function.
-            Then, waits until :attr:`done` event is triggered.
+            Then, waits until the transfer is done.
 
             :raises: FuseOSError"""
 
-            self.closed = True
-            # prevent read deadlock
-            self.q.put(b'')
-
-            # wait until read is complete
-            while True:
+            with self.cond:
+                self.closed = True
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: self.error or self.done)
                 if self.error:
                     raise FuseOSError(errno.EREMOTEIO)
-                if self.done.wait(1):
-                    return
 
-    def write_n_sync(self, stream: WriteStream, node_id: str):
-        """Try to overwrite file with id ``node_id`` with content from ``stream``.
-        Triggers the :attr:`WriteStream.done` event on success.
+    def _send(self, stream, node):
+        """Uploads a stream as new file or as content of an existing node.
+
+        :raises: RequestError, IOError"""
+
+        if isinstance(node, WriteProxy.PendingFile):
+            r = self.acd_client.upload_stream(stream, node.name, node.parent_id)
+            node.id = r['id']
+        else:
+            r = self.acd_client.overwrite_stream(stream, node.id)
+        self.cache.insert_node(r)
+
+    def _settle(self, node):
+        """Stops tracking a new file once its upload has finished."""
+        if isinstance(node, WriteProxy.PendingFile):
+            with self.lock:
+                if self.pending.get(node.path) is node:
+                    del self.pending[node.path]
+            node.created.set()
+
+    def write_n_sync(self, stream: WriteStream, node):
+        """Try to upload the content from ``stream`` to ``node``.
+        Finishes the stream on success.
 
         :param stream: a file-like object"""
 
         try:
-            r = self.acd_client.overwrite_stream(stream, node_id)
+            self._send(stream, node)
         except (RequestError, IOError) as e:
-            stream.error = True
-            logger.error('Error writing node "%s". %s' % (node_id, str(e)))
+            stream.fail()
+            logger.error('Error writing node "%s". %s' % (node.id or node.path, str(e)))
         else:
-            self.cache.insert_node(r)
-            stream.done.set()
+            stream.finish()
+        finally:
+            self._settle(node)
+
+    def create(self, path, parent_id, fh) -> PendingFile:
+        """Creates a pending file written to by handle *fh*."""
 
-    def write(self, node_id, fh, offset, bytes_):
-        """Gets WriteStream from defaultdict. Creates overwrite thread if offset is 0,
-        tries to continue otherwise.
+        f = self.files[fh]
+        f.node = WriteProxy.PendingFile(path, parent_id, f)
+        with self.lock:
+            self.pending[path] = f.node
+        return f.node
+
+    def write(self, node, fh, offset, bytes_):
+        """Gets WriteStream from defaultdict. Starts the upload thread once the written
+        content exceeds the small file size, tries to continue otherwise.
 
         :raises: FuseOSError: wrong offset or writing failed"""
 
         f = self.files[fh]
 
         if f.offset == offset:
+            f.node = node
             f.write(bytes_)
         else:
-            f.error = True  # necessary?
+            f.fail()  # necessary?
             logger.error('Wrong offset for writing to fh %s.' % fh)
             raise FuseOSError(errno.ESPIPE)
 
-        if offset == 0:
-            t = Thread(target=self.write_n_sync, args=(f, node_id))
+        if not f.started and f.offset > self.small_file_size:
+            f.started = True
+            t = Thread(target=self.write_n_sync, args=(f, node))
             t.daemon = True
             t.start()
 
+    def _upload_small(self, f: WriteStream):
+        """Uploads the buffered content of a small file in one request.
+
+        :raises: FuseOSError"""
+
+        if f.error:
+            raise FuseOSError(errno.EREMOTEIO)
+        if f.synced:
+            return
+        try:
+            self._send(io.BufferedReader(io.BytesIO(f.content())), f.node)
+        except RequestError as e:
+            f.fail()
+            FuseOSError.convert(e)
+        else:
+            f.synced = True
+
+    RETRY_CODES = (RequestError.codes.UNAUTHORIZED, RequestError.codes.REQUEST_TIMEOUT,
+                   RequestError.codes.TOO_MANY_REQUESTS)
+    """client error codes that do not finally fail the creation of a file"""
+
+    def _is_final(self, f: WriteStream, e: Exception) -> bool:
+        """Whether a failed creation of a new file is not to be retried, i.e. if the file
+        was created but could not be cached or the request was rejected, e.g. by a name
+        conflict."""
+
+        if f.node.id is not None:
+            return True
+        return isinstance(e, RequestError) and 400 <= e.status_code < 500 \
+            and e.status_code not in self.RETRY_CODES
+
+    def _create_small(self, f: WriteStream, tries=0):
+        """Creates a new small file along with its buffered content.
+        If the upload fails, it is retried after a delay that doubles with each try."""
+
+        try:
+            self._send(io.BufferedReader(io.BytesIO(f.content())), f.node)
+        except Exception as e:
+            if self._is_final(f, e):
+                logger.error('Creating file "%s" failed. %s' % (f.node.path, str(e)))
+                f.fail()
+                self._settle(f.node)
+                return
+            delay = min(self.RETRY_DELAY * 2 ** tries, self.MAX_RETRY_DELAY)
+            logger.error('Creating file "%s" failed, retrying in %d seconds. %s'
+                         % (f.node.path, delay, str(e)))
+            with self.lock:
+                t = Timer(delay, self._retry, args=(f, tries + 1))
+                t.daemon = True
+                self.failed[f] = t
+                if not self.halted:
+                    t.start()
+            return
+        f.synced = True
+        self._settle(f.node)
+
+    def _retry(self, f: WriteStream, tries: int):
+        with self.lock:
+            # left for the last attempt on shutdown
+            if self.halted:
+                return
+            del self.failed[f]
+            self.executor.submit(self._create_small, f, tries)
+
+    def _is_pending(self, f: WriteStream) -> bool:
+        return isinstance(f.node, WriteProxy.PendingFile) and f.node.id is None
+
     def flush(self, fh):
         f = self.files.get(fh)
         if f:
-            f.flush()
+            if f.started:
+                f.flush()
+            elif not self._is_pending(f):
+                self._upload_small(f)
 
     def release(self, fh):
         """:raises: FuseOSError"""
         f = self.files.get(fh)
         if f:
             try:
-                f.close()
+                if f.started:
+                    f.close()
+                elif self._is_pending(f):
+                    self.executor.submit(self._create_small, f)
+                else:
+                    self._upload_small(f)
             except:
                 raise
             finally:
                 del self.files[fh]
 
+    def wait_created(self, path, timeout):
+        """Waits until a pending file at *path* is created.
+
+        :raises: FuseOSError on timeout"""
+
+        node = self.pending.get(path)
+        if node and not node.created.wait(timeout):
+            raise FuseOSError(errno.EBUSY)
+
+    def pending_children(self, path) -> 'List[PendingFile]':
+        with self.lock:
+            return [n for n in self.pending.values() if os.path.dirname(n.path) == path]
+
+    def shutdown(self):
+        """Waits for the queued uploads to finish and makes a last attempt to create the new
+        files whose upload failed."""
+
+        with self.lock:
+            self.halted = True
+            for t in self.failed.values():
+                t.cancel()
+        self.executor.shutdown(wait=True)
+
+        for f in list(self.failed):
+            try:
+                self._send(io.BufferedReader(io.BytesIO(f.content())), f.node)
+            except Exception as e:
+                logger.error('Creating file "%s" failed, its content is lost. %s'
+                             % (f.node.path, str(e)))
+            self._settle(f.node)
+        self.failed.clear()
+
+
+class WriteBackProxy(object):
+    """Stages files written to in local files and uploads them in the background.
+    Unlike the :class:`WriteProxy`, it supports writes at random offsets and truncation to
+    any length.
+
+    A file is staged on the first modification; if the node has content, the content is
+    downloaded into the staging file first. Once the last handle that the file was opened for
+    writing with is released, the staged file is uploaded by one of the upload threads.
+    Modifications made while an upload is queued are included in that upload; if the file
+    is modified while it is being uploaded, it is uploaded again afterwards. Staged files are
+    named after the node ID and persist across mounts until they are uploaded."""
+
+    def __init__(self, acd_client, cache, path, upload_threads, upload_callback=None):
+        """:param path: directory the staged files are stored in, created if necessary
+        :param upload_threads: maximum number of simultaneous uploads
+        :param upload_callback: function called with the node ID once a staged file was
+           uploaded and the node was updated in the cache, before the staged file is removed"""
+
+        self.acd_client = acd_client
+        self.cache = cache
+        self.path = path
+        self.upload_callback = upload_callback
+        self.lock = Lock()
+        self.files = {}
+        """map node id -> StagedFile"""
+        self.handles = {}
+        """map fh -> node id of the handles opened for writing"""
+        self.executor = ThreadPoolExecutor(max_workers=max(1, upload_threads))
+
+        os.makedirs(path, exist_ok=True)
+
+    def resume(self):
+        """Queues the uploads of the files staged by a previous mount. Must be called once
+        the file system is initialized, as the upload threads do not survive FUSE's fork."""
+
+        for name in os.listdir(self.path):
+            fn = os.path.join(self.path, name)
+            # left over by an interrupted download
+            if name.startswith('.tmp'):
+                os.remove(fn)
+                continue
+            logger.info('Uploading staged file of node "%s" left over by the previous mount.'
+                        % name)
+            f = WriteBackProxy.StagedFile(fn)
+            f.fd = os.open(fn, os.O_RDWR)
+            f.size = os.fstat(f.fd).st_size
+            f.version = 1
+            with self.lock:
+                self.files[name] = f
+                self._schedule(name, f)
+
+    class StagedFile(object):
+        """A local file holding the content of a node that is not uploaded yet."""
+
+        __slots__ = ('path', 'lock', 'fd', 'size', 'version', 'scheduled')
+
+        def __init__(self, path):
+            self.path = path
+            self.lock = Lock()
+            self.fd = None
+            """descriptor of the staging file, ``None`` until the node's content is staged"""
+            self.size = 0
+            self.version = 0
+            """number of modifications"""
+            self.scheduled = False
+            """whether an upload is queued or running"""
+
+    def _stage(self, node, f, length):
+        """Copies the first *length* bytes of the node's content into the staging file.
+
+        :raises: FuseOSError"""
+
+        size = node.size if length is None else min(node.size, length)
+        if not size:
+            open(f.path, 'wb').close()
+        else:
+            fd, tmp = tempfile.mkstemp(prefix='.tmp', dir=self.path)
+            try:
+                with os.fdopen(fd, 'wb') as fo:
+                    self.acd_client.chunked_download(node.id, fo, length=size)
+                os.replace(tmp, f.path)
+            except RequestError as e:
+                FuseOSError.convert(e)
+            finally:
+                # unless it was moved into place
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        f.fd = os.open(f.path, os.O_RDWR)
+        f.size = size
+
+    def _get(self, node, length=None) -> StagedFile:
+        """Gets a node's staged file, staging the node's content if necessary.
+        The caller must hold the returned file's lock and check that it is still current.
+
+        :param length: the length the content is about to be truncated to
+        :raises: FuseOSError"""
+
+        with self.lock:
+            f = self.files.get(node.id)
+            if not f:
+                f = self.files[node.id] = WriteBackProxy.StagedFile(os.path.join(self.path,
+                                                                                 node.id))
+        try:
+            with f.lock:
+                if f.fd is None and self.files.get(node.id) is f:
+                    self._stage(node, f, length)
+        except:
+            with self.lock:
+                if self.files.get(node.id) is f:
+                    del self.files[node.id]
+            raise
+        return f
+
+    def _modify(self, node, func, length=None):
+        """Calls *func* with the node's staged file while holding the file's lock."""
+
+        while True:
+            f = self._get(node, length)
+            with f.lock:
+                # the file may have been uploaded and removed in the meantime
+                if self.files.get(node.id) is not f:
+                    continue
+                func(f)
+                f.version += 1
+                return f
+
+    def _schedule(self, node_id, f):
+        """Queues an upload unless one is queued or running already.
+        Must be called holding the lock."""
+
+        if f.scheduled:
+            return
+        f.scheduled = True
+        try:
+            self.executor.submit(self._upload, node_id, f)
+        except RuntimeError:
+            # executor was shut down
+            f.scheduled = False
+
+    def _remove(self, node_id, f):
+        """Removes a staged file. Must be called holding the lock."""
+
+        with f.lock:
+            if self.files.get(node_id) is f:
+                del self.files[node_id]
+            if f.fd is not None:
+                os.close(f.fd)
+                f.fd = None
+            try:
+                os.remove(f.path)
+            except OSError:
+                pass
+
+    def _is_open(self, node_id) -> bool:
+        return node_id in self.handles.values()
+
+    def _upload(self, node_id, f):
+        version = f.version
+        uploaded = False
+        try:
+            with open(f.path, 'rb') as stream:
+                r = self.acd_client.overwrite_stream(stream, node_id)
+            self.cache.insert_node(r)
+            if self.upload_callback:
+                self.upload_callback(node_id)
+            uploaded = True
+        except (RequestError, OSError) as e:
+            logger.error('Uploading staged file of node "%s" failed, it will be uploaded on the '
+                         'next release or mount. %s' % (node_id, str(e)))
+        finally:
+            # also on unexpected errors, so that the file is uploaded on the next release
+            with self.lock:
+                f.scheduled = False
+                if uploaded and self.files.get(node_id) is f and not self._is_open(node_id):
+                    if f.version != version:
+                        self._schedule(node_id, f)
+                    else:
+                        self._remove(node_id, f)
+
+    def open(self, node_id, fh):
+        """Registers a handle a file was opened for writing with."""
+        with self.lock:
+            self.handles[fh] = node_id
+
+    def write(self, node, fh, offset, bytes_):
+        """:raises: FuseOSError"""
+
+        def write(f):
+            os.pwrite(f.fd, bytes_, offset)
+            f.size = max(f.size, offset + len(bytes_))
+
+        with self.lock:
+            self.handles.setdefault(fh, node.id)
+        self._modify(node, write)
+
+    def truncate(self, node, length):
+        """Truncates a node's staged file. The upload is queued unless the file is opened for
+        writing; files opened with ``O_TRUNC`` are truncated through their handle, see
+        :meth:`ACDFuse.open`.
+
+        :raises: FuseOSError"""
+
+        def truncate(f):
+            os.ftruncate(f.fd, length)
+            f.size = length
+
+        f = self._modify(node, truncate, length)
+        with self.lock:
+            if not self._is_open(node.id):
+                self._schedule(node.id, f)
+
+    def read(self, node_id, offset, length) -> 'Union[bytes, None]':
+        """:returns: the byte range of a staged file or ``None`` if the file is not staged"""
+
+        f = self.files.get(node_id)
+        if not f:
+            return
+        with f.lock:
+            if f.fd is None:
+                return
+            return os.pread(f.fd, length, offset)
+
+    def size(self, node_id) -> 'Union[int, None]':
+        """:returns: the size of a staged file or ``None`` if the file is not staged"""
+
+        f = self.files.get(node_id)
+        if f and f.fd is not None:
+            return f.size
+
+    def flush(self, fh):
+        pass
+
+    def release(self, fh):
+        """Queues the upload of the file once it is no longer opened for writing."""
+
+        with self.lock:
+            node_id = self.handles.pop(fh, None)
+            if node_id is None or self._is_open(node_id):
+                return
+            f = self.files.get(node_id)
+            if f:
+                self._schedule(node_id, f)
+
+    def discard(self, node_id):
+        """Drops the staged content of a node, e.g. when it is trashed."""
+
+        with self.lock:
+            f = self.files.get(node_id)
+            if f:
+                self._remove(node_id, f)
+
+    def shutdown(self):
+        """Waits for the queued uploads to finish."""
+        self.executor.shutdown(wait=True)
+
 
 class LoggingMixIn(object):
     """Modified fusepy LoggingMixIn that does not log read or written bytes
@@ -374,7 +1105,8 @@ class ACDFuse(LoggingMixIn, Operations):
     See `<http://fuse.sourceforge.net/doxygen/structfuse__operations.html>`_."""
 
     def __init__(self, **kwargs):
-        """Calculates ACD usage and starts autosync process.
+        """Calculates ACD usage. The autosync thread is started when the file system is
+        initialized.
 
         :param kwargs: cache (NodeCache), acd_client (ACDClient), autosync (partial)"""
 
@@ -384,12 +1116,38 @@ class ACDFuse(LoggingMixIn, Operations):
         conf = kwargs['conf']
         self.conf = conf
 
+        block_cache = None
+        if conf.getint('read', 'block_cache_size') > 0:
+            block_cache = BlockCache(os.path.join(self.acd_client.cache_path, 'blocks'),
+                                     conf.getint('read', 'block_cache_size'))
         self.rp = ReadProxy(self.acd_client,
-                            conf.getint('read', 'open_chunk_limit'), conf.getint('read', 'timeout'))
+                            conf.getint('read', 'open_chunk_limit'), conf.getint('read', 'timeout'),
+                            conf.getint('read', 'block_size'),
+                            conf.getint('read', 'readahead_max_blocks'),
+                            conf.getint('read', 'readahead_threads'), block_cache,
+                            conf.getint('read', 'seek_back_size'),
+                            conf.getint('read', 'skip_ahead_size'),
+                            conf.getint('read', 'min_range_size'),
+                            conf.getint('read', 'max_range_size'))
         """collection of files opened for reading"""
-        self.wp = WriteProxy(self.acd_client, self.cache,
-                             conf.getint('write', 'buffer_size'), conf.getint('write', 'timeout'))
+        self.fh = 1
+        """file handle counter\n\n :type: int"""
+        self.handles = {}
+        """map fh->node\n\n :type: dict"""
+        self.fh_lock = Lock()
+        """lock for fh counter increment and handle dict writes"""
+        if conf.getboolean('write', 'write_back'):
+            self.wp = WriteBackProxy(self.acd_client, self.cache,
+                                     os.path.join(self.acd_client.cache_path, 'staging'),
+                                     conf.getint('write', 'upload_threads'),
+                                     self._refresh_handles)
+        else:
+            self.wp = WriteProxy(self.acd_client, self.cache, conf.getint('write', 'buffer_size'),
+                                 conf.getint('write', 'timeout'),
+                                 conf.getint('write', 'small_file_size'),
+                                 conf.getint('write', 'create_threads'))
         """collection of files opened for writing"""
+        self.write_back = isinstance(self.wp, WriteBackProxy)
         try:
             total, _ = self.acd_client.fs_sizes()
         except RequestError:
@@ -401,36 +1159,65 @@ class ACDFuse(LoggingMixIn, Operations):
         """total disk space"""
         self.free = 0 if not total else total - self.cache.calculate_usage()
         """manually calculated available disk space"""
-        self.fh = 1
-        """file handle counter\n\n :type: int"""
-        self.handles = {}
-        """map fh->node\n\n :type: dict"""
-        self.fh_lock = Lock()
-        """lock for fh counter increment and handle dict writes"""
         self.nlinks = kwargs.get('nlinks', False)
         """whether to calculate the number of hardlinks for folders"""
 
+        self.autosync = autosync
+        """sync loop that keeps the node cache, including its path cache, up to date"""
         self.destroyed = autosync.keywords['stop']
-        """:type: multiprocessing.Event"""
-
-        p = Process(target=autosync)
-        p.start()
+        """:type: threading.Event"""
+        self.sync_stats = autosync.keywords.get('stats', {})
+        """sync interval, number of (failed) syncs, applied and purged nodes and sync duration"""
+
+    def init(self, path):
+        # threads started before FUSE daemonized do not survive the fork, but their Thread
+        # objects still appear to be alive
+        self.acd_client.handler.start_refresher(force=True)
+        # syncing in-process lets changes invalidate only the affected path cache entries
+        Thread(target=self.autosync, name='autosync', daemon=True).start()
+        if self.write_back:
+            self.wp.resume()
 
     def destroy(self, path):
         self.destroyed.set()
+        self.acd_client.handler.stop_refresher()
+        if self.sync_stats:
+            logger.info('Sync statistics: %s' % self.sync_stats)
+        self.wp.shutdown()
+        logger.info('Read statistics: %s' % self.rp.info())
+        if self.rp.blocks.cache:
+            logger.info('Block cache statistics: %s' % self.rp.blocks.cache.info())
+        logger.info('Path cache statistics: %s' % self.cache.path_cache_info())
+
+    def _refresh_handles(self, node_id):
+        """Replaces the node of the handles opened for a node with its current version,
+        e.g. once its staged content was uploaded."""
+
+        node = self.cache.get_node(node_id)
+        if not node:
+            return
+        with self.fh_lock:
+            for fh, n in self.handles.items():
+                if n.id == node_id:
+                    self.handles[fh] = node
 
-    def readdir(self, path, fh) -> 'List[str]':
-        """Lists the path's contents.
+    def readdir(self, path, fh) -> 'List[Union[str, Tuple[str, dict, int]]]':
+        """Lists the path's contents along with their attributes.
 
         :raises: FuseOSError if path is not a node or path is not a folder"""
 
-        node = self.cache.resolve(path)
+        node, children = self.cache.resolve_children(path)
         if not node:
             raise FuseOSError(errno.ENOENT)
         if not node.type == 'folder':
             raise FuseOSError(errno.ENOTDIR)
 
-        return [_ for _ in ['.', '..'] + [c for c in self.cache.childrens_names(node.id)]]
+        entries = [(c.name, self._attrs(c, nlinks=False), 0) for c in children]
+        if not self.write_back:
+            names = set(c.name for c in children)
+            entries.extend((n.name, self._attrs(n, nlinks=False), 0)
+                           for n in self.wp.pending_children(path) if n.name not in names)
+        return ['.', '..'] + entries
 
     def getattr(self, path, fh=None) -> dict:
         """Creates a stat-like attribute dict, see :manpage:`stat(2)`.
@@ -440,23 +1227,33 @@ class ACDFuse(LoggingMixIn, Operations):
             node = self.handles[fh]
         else:
             node = self.cache.resolve(path)
+            if not node and not self.write_back:
+                node = self.wp.pending.get(path)
         if not node:
             raise FuseOSError(errno.ENOENT)
 
+        return self._attrs(node, self.nlinks and node.id is not None)
+
+    def _attrs(self, node, nlinks: bool) -> dict:
         times = dict(st_atime=time(),
-                     st_mtime=node.modified.timestamp(),
-                     st_ctime=node.created.timestamp())
+                     st_mtime=node.mtime,
+                     st_ctime=node.ctime)
 
         if node.is_folder:
             return dict(st_mode=stat.S_IFDIR | 0o0777,
-                        st_nlink=self.cache.num_children(node.id) if self.nlinks else 1,
+                        st_nlink=self.cache.num_children(node.id) if nlinks else 1,
                         **times)
         elif node.is_file:
+            size = node.size
+            if self.write_back:
+                staged = self.wp.size(node.id)
+                if staged is not None:
+                    size = staged
             return dict(st_mode=stat.S_IFREG | 0o0666,
-                        st_nlink=self.cache.num_parents(node.id) if self.nlinks else 1,
-                        st_size=node.size,
+                        st_nlink=self.cache.num_parents(node.id) if nlinks else 1,
+                        st_size=size,
                         st_blksize=self.conf.getint('fs', 'block_size'),
-                        st_blocks=(node.size+511)//512,
+                        st_blocks=(size+511)//512,
                         **times)
 
     def read(self, path, length, offset, fh) -> bytes:
@@ -469,13 +1266,24 @@ class ACDFuse(LoggingMixIn, Operations):
         if not node:
             raise FuseOSError(errno.ENOENT)
 
+        if node.id is None:
+            return node.read(offset, length)
+
+        if self.write_back:
+            bytes_ = self.wp.read(node.id, offset, length)
+            if bytes_ is not None:
+                return bytes_
+            if fh:
+                # the handle's node is refreshed before the staged file is removed
+                node = self.handles[fh]
+
         if node.size <= offset:
             return b''
 
         if node.size < offset + length:
             length = node.size - offset
 
-        return self.rp.get(node.id, offset, length, node.size)
+        return self.rp.get(node.id, node.md5, offset, length, node.size)
 
     def statfs(self, path) -> dict:
         """Gets some filesystem statistics as specified in :manpage:`stat(2)`."""
@@ -507,8 +1315,14 @@ class ACDFuse(LoggingMixIn, Operations):
         else:
             self.cache.insert_node(r)
 
+    def _wait_created(self, path):
+        """Waits for the upload of a file at *path* created through the mount."""
+        if not self.write_back:
+            self.wp.wait_created(path, self.conf.getint('write', 'timeout'))
+
     def _trash(self, path):
         logger.debug('trash %s' % path)
+        self._wait_created(path)
         node = self.cache.resolve(path, False)
 
         if not node:  # or not parent:
@@ -523,6 +1337,8 @@ class ACDFuse(LoggingMixIn, Operations):
             FuseOSError.convert(e)
         else:
             self.cache.insert_node(r)
+            if self.write_back:
+                self.wp.discard(node.id)
 
     def rmdir(self, path):
         """Moves a directory into ACD trash."""
@@ -533,7 +1349,8 @@ class ACDFuse(LoggingMixIn, Operations):
         self._trash(path)
 
     def create(self, path, mode) -> int:
-        """Creates an empty file at ``path``.
+        """Creates an empty file at ``path``. Unless in write-back mode, the file is created
+        remotely along with its content once it is released or exceeds the small file size.
 
         :param mode: not used
         :returns int: file handle"""
@@ -544,17 +1361,24 @@ class ACDFuse(LoggingMixIn, Operations):
         if not p:
             raise FuseOSError(errno.ENOTDIR)
 
-        try:
-            r = self.acd_client.create_file(name, p.id)
-            self.cache.insert_node(r)
-            node = self.cache.get_node(r['id'])
-        except RequestError as e:
-            FuseOSError.convert(e)
-
         with self.fh_lock:
             self.fh += 1
-            self.handles[self.fh] = node
-        return self.fh
+            fh = self.fh
+
+        if not self.write_back:
+            node = self.wp.create(path, p.id, fh)
+        else:
+            try:
+                r = self.acd_client.create_file(name, p.id)
+                self.cache.insert_node(r)
+                node = self.cache.get_node(r['id'])
+            except RequestError as e:
+                FuseOSError.convert(e)
+            self.wp.open(node.id, fh)
+
+        with self.fh_lock:
+            self.handles[fh] = node
+        return fh
 
     def rename(self, old, new):
         """Renames ``old`` into ``new`` (may also involve a move).
@@ -567,6 +1391,7 @@ class ACDFuse(LoggingMixIn, Operations):
         if old == new:
             return
 
+        self._wait_created(old)
         node = self.cache.resolve(old, False)
         if not node:
             raise FuseOSError(errno.ENOENT)
@@ -613,24 +1438,34 @@ class ACDFuse(LoggingMixIn, Operations):
         :param flags: flags defined as in :manpage:`open(2)`
         :returns: file handle"""
 
-        if (flags & os.O_APPEND) == os.O_APPEND:
+        if (flags & os.O_APPEND) == os.O_APPEND and not self.write_back:
             raise FuseOSError(errno.EFAULT)
 
+        self._wait_created(path)
         node = self.cache.resolve(path, False)
         if not node:
             raise FuseOSError(errno.ENOENT)
+        if self.rp.blocks.cache:
+            # discard blocks of content that has since been overwritten
+            self.rp.blocks.cache.invalidate(node.id, node.md5)
         with self.fh_lock:
             self.fh += 1
             self.handles[self.fh] = node
-        return self.fh
+            fh = self.fh
+        if self.write_back and flags & (os.O_WRONLY | os.O_RDWR):
+            self.wp.open(node.id, fh)
+            # with atomic_o_trunc, the kernel does not truncate the file before opening it,
+            # which would upload the empty file
+            if flags & os.O_TRUNC:
+                self.wp.truncate(node, 0)
+        return fh
 
     def write(self, path, data, offset, fh) -> int:
         """Invokes :attr:`wp`'s write function.
 
         :returns: number of bytes written"""
 
-        node_id = self.handles[fh].id
-        self.wp.write(node_id, fh, offset, data)
+        self.wp.write(self.handles[fh], fh, offset, data)
         return len(data)
 
     def flush(self, path, fh):
@@ -639,18 +1474,25 @@ class ACDFuse(LoggingMixIn, Operations):
 
     def truncate(self, path, length, fh=None):
         """Pseudo-truncates a file, i.e. clears content if ``length``==0 or does nothing
-        if ``length`` is equal to current file size.
+        if ``length`` is equal to current file size. Truncation to any length is supported
+        in write-back mode.
 
         :raises FuseOSError: if pseudo-truncation to length is not supported"""
 
         if fh:
             node = self.handles[fh]
         else:
+            self._wait_created(path)
             node = self.cache.resolve(path)
         if not node:
             raise FuseOSError(errno.ENOENT)
 
-        if length == 0:
+        if node.id is None:
+            if node.size != length:
+                raise FuseOSError(errno.ENOSYS)
+        elif self.write_back:
+            self.wp.truncate(node, length)
+        elif length == 0:
             try:
                 r = self.acd_client.clear_file(node.id)
             except RequestError as e:
@@ -709,17 +1551,19 @@ def mount(path: str, args: dict, **kwargs) -> 'Union[int, None]':
         logger.critical('Mountpoint does not exist or already used.')
         return 1
 
+    args['conf'] = get_conf(args['settings_path'], _SETTINGS_FILENAME, _def_conf)
+
     opts = dict(auto_cache=True, sync_read=True)
     if sys.platform.startswith('linux'):
         opts['big_writes'] = True
+        if args['conf'].getboolean('write', 'write_back'):
+            opts['atomic_o_trunc'] = True
 
     if sys.platform != 'darwin' or kwargs['volname'] is None:
         del kwargs['volname']
 
     kwargs.update(opts)
 
-    args['conf'] = get_conf(args['settings_path'], _SETTINGS_FILENAME, _def_conf)
-
     FUSE(ACDFuse(**args), path, subtype=ACDFuse.__name__, **kwargs)
 
 
@@ -2,14 +2,118 @@ import time
 from time import sleep
 import random
 import logging
+import re
 from threading import Lock, local
+from weakref import WeakSet
 
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
 from .common import *
 
 logger = logging.getLogger(__name__)
 
+_NODE_ID_RE = re.compile(r'/(?:nodes|trash)/([a-zA-Z0-9_-]{22})(?:[/?]|$)')
+
+THROTTLE_CODES = [429, 503]
+"""status codes that indicate too many requests"""
+
+
+class _Backoff(object):
+    """Exponential back-off state"""
+    __slots__ = ('retries', 'next_req')
+
+    def __init__(self):
+        self.retries = 0
+        self.next_req = 0.
+
+    def failed(self):
+        """Sets the minimal time for the next request.
+        Back-off time is in a range of seconds, depending on number of failed previous tries (r):
+        [0,2^r], maximum interval [0,256]"""
+        self.retries += 1
+        self.next_req = time.time() + random.random() * 2 ** min(self.retries, 8)
+
+
+class _Endpoint(object):
+    """Back-off state of a class of requests, e.g. all requests to the metadata endpoint.
+    Requests concerning a specific node back off independently of other requests.
+    If the endpoint responds with :const:`THROTTLE_CODES`, requests are limited to a rate that
+    is halved on each throttling response and increased additively on success
+    (i.e. by about one request per second each second)."""
+
+    def __init__(self, name: str, max_rate: float, throttled_rate: float, min_rate: float):
+        """:param max_rate: maximal number of requests per second, 0 for no limit
+        :param throttled_rate: initial rate after throttling if *max_rate* is unlimited
+        :param min_rate: minimal number of requests per second"""
+        self.name = name
+        self.max_rate = max_rate
+        self.throttled_rate = throttled_rate
+        self.min_rate = min_rate
+
+        self.rate = max_rate if max_rate else None
+        """current rate limit, None if unlimited"""
+        self.tokens = 1.
+        self.last_refill = time.time()
+        self.throttled = 0
+        """number of throttling responses"""
+
+        self.backoff = _Backoff()
+        self.nodes = {}
+        """map of node ID to :class:`_Backoff` of failed requests for that node"""
+        self.lock = Lock()
+
+    def get_backoff(self, node_id: str) -> _Backoff:
+        if not node_id:
+            return self.backoff
+        with self.lock:
+            return self.nodes.get(node_id) or _Backoff()
+
+    def reserve(self) -> float:
+        """Takes a token from the bucket.
+
+        :returns: the time to wait until the token is available [seconds]"""
+        with self.lock:
+            if not self.rate:
+                return 0
+            now = time.time()
+            self.tokens = min(max(1., self.rate),
+                              self.tokens + (now - self.last_refill) * self.rate) - 1
+            self.last_refill = now
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def succeeded(self, node_id: str):
+        with self.lock:
+            if node_id:
+                self.nodes.pop(node_id, None)
+            else:
+                self.backoff.retries = 0
+                self.backoff.next_req = 0.
+            if self.rate:
+                self.rate += 1 / self.rate
+                if self.max_rate and self.rate >= self.max_rate:
+                    self.rate = self.max_rate
+                elif not self.max_rate and self.rate >= 2 * self.throttled_rate:
+                    self.rate = None
+
+    def failed(self, node_id: str, throttled=False):
+        with self.lock:
+            (self.nodes.setdefault(node_id, _Backoff()) if node_id else self.backoff).failed()
+            if throttled:
+                self.throttled += 1
+                if self.rate:
+                    self.rate = max(self.min_rate, self.rate / 2)
+                else:
+                    self.rate = self.throttled_rate
+                    self.tokens = 0.
+                    self.last_refill = time.time()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(rate=self.rate, throttled=self.throttled, retries=self.backoff.retries,
+                        wait=max(0., self.backoff.next_req - time.time()),
+                        failed_nodes={id: b.retries for id, b in self.nodes.items()})
+
 
 class BackOffRequest(object):
     """Wrapper for requests that implements timed back-off algorithm
@@ -17,53 +121,117 @@ class BackOffRequest(object):
     Caution: this catches all connection errors and may stall for a long time.
     It is necessary to init this module before use."""
 
-    def __init__(self, auth_callback: 'requests.auth.AuthBase', timeout: 'Tuple[int, int]', proxies: dict={}):
+    def __init__(self, auth_callback: 'requests.auth.AuthBase', timeout: 'Tuple[int, int]', proxies: dict={},
+                 pool_sizes: dict=None, thread_sessions=False, endpoints: dict=None,
+                 rates: dict=None):
         """:arg auth_callback: callable object that attaches auth info to a request
            :arg timeout: tuple of connection timeout and idle timeout \
                          (http://docs.python-requests.org/en/latest/user/advanced/#timeouts)
            :arg proxies: dict of protocol to proxy, \
                          see http://docs.python-requests.org/en/master/user/advanced/#proxies
+           :arg pool_sizes: dict of URL prefix to the number of connections kept alive \
+                            for requests to URLs starting with the prefix
+           :arg thread_sessions: use a separate session, i.e. separate connection pools, \
+                                 per thread
+           :arg endpoints: dict of URL prefix to the name of the endpoint class; \
+                           each class backs off independently
+           :arg rates: dict of max_rate, throttled_rate and min_rate, see :class:`_Endpoint`
         """
 
         self.auth_callback = auth_callback
         self.timeout = timeout if requests.__version__ >= '2.4.0' else timeout[1]
         self.proxies = proxies
+        self.pool_sizes = pool_sizes if pool_sizes else {}
+        self.thread_sessions = thread_sessions
 
-        self.__session = requests.session()
+        self.__sessions = WeakSet()
+        self.__session = self._create_session()
         self.__thr_local = local()
         self.__lock = Lock()
-        self.__retries = 0
-        self.__next_req = time.time()
+
+        endpoints = endpoints if endpoints else {}
+        rates = rates if rates else {}
+        self.__endpoints = [(prefix, _Endpoint(name, **rates))
+                            for prefix, name in endpoints.items()]
+        self.__other = _Endpoint('other', **rates)
 
         random.seed()
 
-    def _succeeded(self):
-        with self.__lock:
-            self.__retries = 0
-        self.__calc_next()
+    def _create_session(self) -> requests.Session:
+        session = requests.session()
+        for prefix, size in self.pool_sizes.items():
+            session.mount(prefix, HTTPAdapter(pool_maxsize=size))
+        self.__sessions.add(session)
+        return session
 
-    def _failed(self):
-        with self.__lock:
-            self.__retries += 1
-        self.__calc_next()
+    @property
+    def _session(self) -> requests.Session:
+        if not self.thread_sessions:
+            return self.__session
+        session = getattr(self.__thr_local, 'session', None)
+        if not session:
+            with self.__lock:
+                session = self._create_session()
+            self.__thr_local.session = session
+        return session
 
-    def __calc_next(self):
-        """Calculates minimal acceptable time for next request.
-        Back-off time is in a range of seconds, depending on number of failed previous tries (r):
-        [0,2^r], maximum interval [0,256]"""
-        with self.__lock:
-            duration = random.random() * 2 ** min(self.__retries, 8)
-            self.__next_req = time.time() + duration
+    def connection_stats(self) -> dict:
+        """Gets the number of connections established and requests sent per URL prefix
+        that has a connection pool of its own. Requests on kept-alive connections are
+        the difference of both numbers. Sessions of finished threads are not included.
 
-    def _wait(self):
+        :returns: dict of prefix to dict with 'connections' and 'requests' keys"""
+        stats = {}
         with self.__lock:
-            duration = self.__next_req - time.time()
+            sessions = list(self.__sessions)
+        for session in sessions:
+            for prefix, adapter in list(session.adapters.items()):
+                if prefix not in self.pool_sizes:
+                    continue
+                s = stats.setdefault(prefix, dict(connections=0, requests=0))
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool:
+                        s['connections'] += pool.num_connections
+                        s['requests'] += pool.num_requests
+        return stats
+
+    def _endpoint(self, url: str) -> '_Endpoint':
+        for prefix, endpoint in self.__endpoints:
+            if url.startswith(prefix):
+                return endpoint
+        return self.__other
+
+    @staticmethod
+    def _node_id(url: str) -> 'Union[str, None]':
+        m = _NODE_ID_RE.search(url)
+        return m.group(1) if m else None
+
+    def backoff_stats(self) -> dict:
+        """Gets the back-off state per endpoint class.
+
+        :returns: dict of endpoint class name to dict of the current rate limit [requests/s]
+                  (None if unlimited), the number of throttling responses, the number of
+                  consecutive failures and remaining waiting time of requests that do not
+                  concern a specific node, and the number of consecutive failures per node"""
+        endpoints = [e for _, e in self.__endpoints] + [self.__other]
+        return {e.name: e.stats() for e in endpoints}
+
+    def _wait(self, endpoint: _Endpoint, backoff: _Backoff):
+        """Waits for the back-off time of the request and for the endpoint's rate limit."""
+        duration = backoff.next_req - time.time()
         if duration > 5:
             logger.warning('Waiting %fs because of error(s).' % duration)
-        logger.debug('Retry %i, waiting %fs' % (self.__retries, duration))
+        logger.debug('Retry %i, waiting %fs' % (backoff.retries, duration))
         if duration > 0:
             sleep(duration)
 
+        duration = endpoint.reserve()
+        if duration > 0:
+            logger.debug('Rate limit of %s requests, waiting %fs' % (endpoint.name, duration))
+            sleep(duration)
+
     @catch_conn_exception
     def _request(self, type_: str, url: str, acc_codes: 'List[int]', **kwargs) -> requests.Response:
         """Performs a HTTP request
@@ -72,7 +240,9 @@ class BackOffRequest(object):
         :param acc_codes: list of HTTP status codes that indicate a successful request
         :param kwargs: may include additional header: dict and timeout: int"""
 
-        self._wait()
+        endpoint = self._endpoint(url)
+        node_id = self._node_id(url)
+        self._wait(endpoint, endpoint.get_backoff(node_id))
 
         headers = {}
         if 'headers' in kwargs:
@@ -99,7 +269,7 @@ class BackOffRequest(object):
         exc = False
         try:
             try:
-                r = self.__session.request(type_, url, auth=self.auth_callback,
+                r = self._session.request(type_, url, auth=self.auth_callback,
                                            proxies=self.proxies, headers=headers, timeout=timeout,
                                            **kwargs)
             except RequestException as e:
@@ -107,7 +277,7 @@ class BackOffRequest(object):
                 raise
         except:
             exc = True
-            self._failed()
+            endpoint.failed(node_id)
             raise
         finally:
             if r and 'x-amzn-RequestId' in r.headers:
@@ -116,7 +286,10 @@ class BackOffRequest(object):
                 else:
                     logger.debug('x-amzn-RequestId: %s' % r.headers['x-amzn-RequestId'])
 
-        self._succeeded() if r.status_code in acc_codes else self._failed()
+        if r.status_code in acc_codes:
+            endpoint.succeeded(node_id)
+        else:
+            endpoint.failed(node_id, r.status_code in THROTTLE_CODES)
         return r
 
     # HTTP verbs
@@ -136,11 +309,10 @@ class BackOffRequest(object):
     def delete(self, url, acc_codes=OK_CODES, **kwargs) -> requests.Response:
         return self._request('DELETE', url, acc_codes, **kwargs)
 
-    def paginated_get(self, url: str, params: dict = None) -> 'List[dict]':
-        """Gets node list in segments of 200."""
-        if params is None:
-            params = {}
-        node_list = []
+    def iter_pages(self, url: str, params: dict = None) -> 'Generator[List[dict]]':
+        """Generates the node list in pages of (at most) 200 nodes as they are retrieved."""
+        params = dict(params) if params else {}
+        total = 0
 
         while True:
             r = self.get(url, params=params)
@@ -148,13 +320,19 @@ class BackOffRequest(object):
                 logger.error("Error getting node list.")
                 raise RequestError(r.status_code, r.text)
             ret = r.json()
-            node_list.extend(ret['data'])
+            total += len(ret['data'])
+            yield ret['data']
             if 'nextToken' in ret.keys():
                 params['startToken'] = ret['nextToken']
             else:
-                if ret['count'] != len(node_list):
+                if ret['count'] != total:
                     logger.warning(
-                        'Expected %i items in page, received %i.' % (ret['count'], len(node_list)))
+                        'Expected %i items in page, received %i.' % (ret['count'], total))
                 break
 
+    def paginated_get(self, url: str, params: dict = None) -> 'List[dict]':
+        """Gets node list in segments of 200."""
+        node_list = []
+        for page in self.iter_pages(url, params):
+            node_list.extend(page)
         return node_list
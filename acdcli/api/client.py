@@ -25,7 +25,12 @@ _SETTINGS_FILENAME = 'acd_client.ini'
 _def_conf = configparser.ConfigParser()
 _def_conf['endpoints'] = dict(filename='endpoint_data', validity_duration=259200)
 _def_conf['transfer'] = dict(fs_chunk_size=128 * 1024, dl_chunk_size=500 * 1024 ** 2,
-                             chunk_retries=1, connection_timeout=30, idle_timeout=60)
+                             chunk_retries=1, connection_timeout=30, idle_timeout=60,
+                             dl_segments=1, dl_min_segment_size=64 * 1024 ** 2, ul_buffers=16)
+_def_conf['changes'] = dict(batch_size=10000, queue_size=4, page_queue_size=64)
+_def_conf['connections'] = dict(metadata_pool_size=10, content_pool_size=10,
+                                thread_sessions=False)
+_def_conf['backoff'] = dict(max_rate=0, throttled_rate=16, min_rate=0.5)
 _def_conf['proxies'] = dict()
 
 
@@ -49,7 +54,16 @@ class ACDClient(AccountMixin, ContentMixin, MetadataMixin, TrashMixin):
                             self._conf.getint('transfer', 'idle_timeout'))
         proxies = dict(self._conf['proxies'])
 
-        self.BOReq = BackOffRequest(self.handler, requests_timeout, proxies)
+        pool_sizes = {self.metadata_url: self._conf.getint('connections', 'metadata_pool_size'),
+                      self.content_url: self._conf.getint('connections', 'content_pool_size')}
+
+        endpoints = {self.metadata_url: 'metadata', self.content_url: 'content'}
+        rates = {key: self._conf.getfloat('backoff', key)
+                 for key in ['max_rate', 'throttled_rate', 'min_rate']}
+
+        self.BOReq = BackOffRequest(self.handler, requests_timeout, proxies, pool_sizes,
+                                    self._conf.getboolean('connections', 'thread_sessions'),
+                                    endpoints, rates)
 
     @property
     def _endpoint_data_path(self):
@@ -5,6 +5,10 @@ import io
 import mimetypes
 from collections import OrderedDict
 import logging
+import queue
+import time
+from bisect import bisect_right
+from threading import Thread, Condition
 from urllib.parse import quote_plus
 from requests import Response
 from requests_toolbelt import MultipartEncoder
@@ -13,34 +17,150 @@ from .common import *
 
 PARTIAL_SUFFIX = '.__incomplete'
 """suffix (file ending) for incomplete files"""
+JOURNAL_SUFFIX = '.__journal'
+"""suffix (file ending) for the range journals of incomplete files"""
 
 logger = logging.getLogger(__name__)
 
 
-class _TeeBufferedReader(object):
-    """Proxy buffered reader object that allows callbacks on read operations."""
+class _PipelinedReader(object):
+    """Read-only file proxy that reads a file ahead on a separate thread into a bounded queue
+    of buffers. The read callbacks (e.g. hashing and progress) are called on the reader thread,
+    so the sending thread only has to take ready chunks off the queue.
+    The :attr:`len` attribute is the number of bytes left to read."""
 
-    def __init__(self, file: io.BufferedReader, callbacks: list = None):
-        self._file = file
-        self._callbacks = callbacks
+    def __init__(self, path: str, chunk_size: int, buffers: int, callbacks: list = None):
+        self.len = os.path.getsize(path)
+        self._q = queue.Queue(maxsize=buffers)
+        self._buffer = b''
+        self._closed = False
 
-    def __getattr__(self, item):
+        t = Thread(target=self._fill, args=(path, chunk_size, callbacks or []),
+                   name='reader-' + os.path.basename(path))
+        t.daemon = True
+        t.start()
+
+    def _put(self, item) -> bool:
+        while not self._closed:
+            try:
+                self._q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fill(self, path: str, chunk_size: int, callbacks: list):
         try:
-            return object.__getattr__(item)
-        except AttributeError:
-            return getattr(self._file, item)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    for callback in callbacks:
+                        callback(chunk)
+                    if not self._put(chunk):
+                        return
+        except Exception as e:
+            # hand over any error, e.g. of a callback, so that read does not block
+            self._put(e)
+        else:
+            self._put(b'')
+
+    def read(self, ln=-1) -> bytes:
+        """:raises: OSError if reading the file failed or the exception raised by a callback"""
+        chunks = [self._buffer]
+        size = len(self._buffer)
+        while (ln < 0 or size < ln) and self.len > size:
+            chunk = self._q.get()
+            if isinstance(chunk, BaseException):
+                raise chunk
+            if not chunk:
+                logger.warning('File ended prematurely, %i bytes missing.' % (self.len - size))
+                self.len = size
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+
+        b = b''.join(chunks)
+        if ln >= 0:
+            b, self._buffer = b[:ln], b[ln:]
+        else:
+            self._buffer = b''
+        self.len -= len(b)
+        return b
 
-    def read(self, ln=-1):
-        #ln = ln if ln in (0, -1) else FS_RW_CHUNK_SZ
-        chunk = self._file.read(ln)
-        for callback in self._callbacks or []:
-            callback(chunk)
-        return chunk
+    def close(self):
+        """Stops the reader thread."""
+        self._closed = True
 
 
-def _tee_open(path: str, **kwargs) -> _TeeBufferedReader:
-    f = open(path, 'rb')
-    return _TeeBufferedReader(f, **kwargs)
+class _RangeMap(object):
+    """Sorted list of disjoint, completely downloaded byte ranges [start, end) of a file
+    that may be persisted as a journal."""
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, ranges: list = None):
+        self.starts = []
+        self.ends = []
+        for start, end in ranges or []:
+            self.add(start, end)
+
+    def add(self, start: int, end: int):
+        """Adds a range, merging it with overlapping or adjacent ranges."""
+        if start >= end:
+            return
+        lo = bisect_right(self.starts, start) - 1
+        if lo >= 0 and self.ends[lo] >= start:
+            start = self.starts[lo]
+        else:
+            lo += 1
+        hi = bisect_right(self.starts, end) - 1
+        if hi >= lo:
+            end = max(end, self.ends[hi])
+        self.starts[lo:hi + 1] = [start]
+        self.ends[lo:hi + 1] = [end]
+
+    def end_of(self, pos: int) -> int:
+        """:returns: end of the range containing *pos* or *pos* if it is not contained"""
+        i = bisect_right(self.starts, pos) - 1
+        if i >= 0 and self.ends[i] > pos:
+            return self.ends[i]
+        return pos
+
+    def gaps(self, length: int) -> 'List[Tuple[int, int]]':
+        """:returns: list of missing ranges up to *length*"""
+        gaps = []
+        pos = 0
+        for start, end in zip(self.starts, self.ends):
+            if start > pos:
+                gaps.append((pos, min(start, length)))
+            pos = max(pos, end)
+        if pos < length:
+            gaps.append((pos, length))
+        return [g for g in gaps if g[0] < g[1]]
+
+    def size(self) -> int:
+        return sum(e - s for s, e in zip(self.starts, self.ends))
+
+    @classmethod
+    def load(cls, path: str, node_id: str, length: int) -> 'Union[_RangeMap, None]':
+        """Loads a journal file. Returns None if the journal does not exist, is invalid
+        or does not belong to the given node and length."""
+        try:
+            with open(path) as f:
+                j = json.load(f)
+            if j['id'] != node_id or j['length'] != length:
+                logger.info('Journal "%s" does not match node "%s".' % (path, node_id))
+                return
+            return cls(j['ranges'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+
+    def save(self, path: str, node_id: str, length: int):
+        """Atomically writes the journal file."""
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'id': node_id, 'length': length,
+                       'ranges': list(zip(self.starts, self.ends))}, f)
+        os.replace(tmp, path)
 
 
 def _get_mimetype(file_name: str = '') -> str:
@@ -113,6 +233,10 @@ class ContentMixin(object):
 
         return r.json()
 
+    def _pipelined_open(self, file_name: str, read_callbacks: list = None) -> _PipelinedReader:
+        return _PipelinedReader(file_name, self._conf.getint('transfer', 'fs_chunk_size'),
+                                self._conf.getint('transfer', 'ul_buffers'), read_callbacks)
+
     def upload_file(self, file_name: str, parent: str = None,
                     read_callbacks=None, deduplication=False) -> dict:
         params = {'suppress': 'deduplication'}
@@ -124,15 +248,18 @@ class ContentMixin(object):
         if parent:
             metadata['parents'] = [parent]
         mime_type = _get_mimetype(basename)
-        f = _tee_open(file_name, callbacks=read_callbacks)
+        f = self._pipelined_open(file_name, read_callbacks)
 
         m = MultipartEncoder(fields=OrderedDict([('metadata', json.dumps(metadata)),
                                                  ('content', ('filename', f, mime_type))]))
 
         ok_codes = [http.CREATED]
-        r = self.BOReq.post(self.content_url + 'nodes', params=params, data=m,
-                            acc_codes=ok_codes, stream=True,
-                            headers={'Content-Type': m.content_type})
+        try:
+            r = self.BOReq.post(self.content_url + 'nodes', params=params, data=m,
+                                acc_codes=ok_codes, stream=True,
+                                headers={'Content-Type': m.content_type})
+        finally:
+            f.close()
 
         if r.status_code not in ok_codes:
             raise RequestError(r.status_code, r.text)
@@ -196,13 +323,16 @@ class ContentMixin(object):
 
         basename = os.path.basename(file_name)
         mime_type = _get_mimetype(basename)
-        f = _tee_open(file_name, callbacks=read_callbacks)
+        f = self._pipelined_open(file_name, read_callbacks)
 
         # basename is ignored
         m = MultipartEncoder(fields={('content', (quote_plus(basename), f, mime_type))})
 
-        r = self.BOReq.put(self.content_url + 'nodes/' + node_id + '/content', params=params,
-                           data=m, stream=True, headers={'Content-Type': m.content_type})
+        try:
+            r = self.BOReq.put(self.content_url + 'nodes/' + node_id + '/content', params=params,
+                               data=m, stream=True, headers={'Content-Type': m.content_type})
+        finally:
+            f.close()
 
         if r.status_code not in OK_CODES:
             raise RequestError(r.status_code, r.text)
@@ -232,7 +362,8 @@ class ContentMixin(object):
 
     def download_file(self, node_id: str, basename: str, dirname: str = None, **kwargs):
         """Deals with download preparation, download with :func:`chunked_download` and finish.
-        Calls callbacks while fast forwarding through incomplete file (if existent).
+        Resumes using the range journal of an incomplete file or, if there is none,
+        the incomplete file's prefix.
         Will not check for existing file prior to download and overwrite existing file on finish.
 
         :param dirname: a valid local directory name, or cwd if None
@@ -240,7 +371,9 @@ class ContentMixin(object):
         :param kwargs: \
          - length: the total length of the file
          - write_callbacks (list[function]): passed on to :func:`chunked_download`
-         - resume (bool=True): whether to resume if partial file exists"""
+         - resume (bool=True): whether to resume if partial file exists
+         - segments (int): maximum number of concurrent byte ranges, \
+           defaults to the *dl_segments* setting"""
 
         chunk_sz = self._conf.getint('transfer', 'fs_chunk_size')
 
@@ -248,36 +381,48 @@ class ContentMixin(object):
         if dirname:
             dl_path = os.path.join(dirname, basename)
         part_path = dl_path + PARTIAL_SUFFIX
-        offset = 0
+        journal_path = dl_path + JOURNAL_SUFFIX
 
         length = kwargs.get('length', 0)
-        resume = kwargs.get('resume', True)
-        if resume and os.path.isfile(part_path):
+        resume = kwargs.get('resume', True) and os.path.isfile(part_path)
+        segments = kwargs.get('segments', self._conf.getint('transfer', 'dl_segments'))
+        segments = min(segments,
+                       length // self._conf.getint('transfer', 'dl_min_segment_size'))
+
+        completed = None
+        trunc_pos = 0
+        if resume:
+            completed = _RangeMap.load(journal_path, node_id, length)
+            if not completed:
+                # incomplete file of a sequential download
+                trunc_pos = max(os.path.getsize(part_path) - 1 - chunk_sz, 0)
+                completed = _RangeMap([(0, min(trunc_pos, length))])
+                logger.debug('Resuming "%s" at %i.' % (part_path, trunc_pos))
+        elif os.path.isfile(journal_path):
+            os.remove(journal_path)
+
+        if length > 0 and (segments > 1 or completed):
+            self._segmented_download(node_id, part_path, length, max(segments, 1),
+                                     kwargs.get('write_callbacks'), completed)
+            pos = length
+        elif resume:
+            # file of unknown length, continue appending to its prefix
             with open(part_path, 'ab') as f:
-                part_size = os.path.getsize(part_path)
-                trunc_pos = part_size - 1 - chunk_sz
-                trunc_pos = trunc_pos if trunc_pos >= 0 else 0
-
-                if part_size != trunc_pos:
-                    f.truncate(trunc_pos)
-                    logger.debug('Truncated "%s" at %i, '
-                                 'original size %i.' % (part_path, trunc_pos, part_size))
-
+                f.truncate(trunc_pos)
             write_callbacks = kwargs.get('write_callbacks')
             if write_callbacks:
                 with open(part_path, 'rb') as f:
                     for chunk in iter(lambda: f.read(chunk_sz), b''):
                         for rcb in write_callbacks:
                             rcb(chunk)
-
-            f = open(part_path, 'ab')
+            with open(part_path, 'ab') as f:
+                self.chunked_download(node_id, f, offset=trunc_pos, **kwargs)
+                pos = f.tell()
         else:
-            f = open(part_path, 'wb')
-        offset = f.tell()
+            with open(part_path, 'wb') as f:
+                self.chunked_download(node_id, f, **kwargs)
+                pos = f.tell()
 
-        self.chunked_download(node_id, f, offset=offset, **kwargs)
-        pos = f.tell()
-        f.close()
         if length > 0 and pos < length:
             raise RequestError(RequestError.CODE.INCOMPLETE_RESULT, '[acd_api] download incomplete. '
                                'Expected %i, got %i.' % (length, pos))
@@ -286,6 +431,131 @@ class ContentMixin(object):
             logger.info('Deleting existing file "%s".' % dl_path)
             os.remove(dl_path)
         os.rename(part_path, dl_path)
+        if os.path.isfile(journal_path):
+            os.remove(journal_path)
+
+    def _segmented_download(self, node_id: str, path: str, length: int, segments: int,
+                            write_callbacks: list = None, completed: _RangeMap = None):
+        """Downloads the missing ranges of a file concurrently into a preallocated file
+        using at most *segments* connections. The write callbacks are called in file order
+        by reading back the written ranges, so incremental hashing is not affected
+        and the hash of already completed ranges is computed while the missing ones download.
+        Completed ranges are recorded in a journal file next to the incomplete file.
+
+        :param path: the incomplete file to write to
+        :param length: the total length of the file
+        :param completed: ranges of *path* that are already complete
+        :raises: RequestError"""
+
+        journal_path = path[:-len(PARTIAL_SUFFIX)] + JOURNAL_SUFFIX
+        completed = completed if completed else _RangeMap()
+        gaps = completed.gaps(length)
+
+        piece_sz = max(-(-sum(e - s for s, e in gaps) // segments), 1)
+        pieces = [(start, min(start + piece_sz, end))
+                  for s, end in gaps for start in range(s, end, piece_sz)]
+        pieces.reverse()
+        workers = min(segments, len(pieces))
+        finished = []
+        errors = []
+        cond = Condition()
+        last_save = [time.time()]
+
+        with open(path, 'ab') as f:
+            f.truncate(length)
+        completed.save(journal_path, node_id, length)
+        sync_fd = os.open(path, os.O_RDWR)
+
+        def save_journal():
+            """Persists the journal after the written data is on disk. Call with lock held."""
+            try:
+                os.fsync(sync_fd)
+                completed.save(journal_path, node_id, length)
+            except OSError as e:
+                logger.warning('Could not write journal "%s". %s' % (journal_path, e))
+            last_save[0] = time.time()
+
+        def fetch():
+            try:
+                while True:
+                    with cond:
+                        if errors or not pieces:
+                            return
+                        start, end = pieces.pop()
+                    pos = [start]
+
+                    def advance(chunk):
+                        with cond:
+                            if errors:
+                                raise RequestError(RequestError.CODE.FAILED_SUBREQUEST,
+                                                   '[acd_api] sibling range failed.')
+                            completed.add(pos[0], pos[0] + len(chunk))
+                            pos[0] += len(chunk)
+                            if time.time() - last_save[0] > 1:
+                                save_journal()
+                            cond.notify_all()
+
+                    with open(path, 'r+b') as f:
+                        f.seek(start)
+                        self.chunked_download(node_id, f, offset=start, length=end,
+                                              write_callbacks=[advance])
+                    if pos[0] < end:
+                        raise RequestError(RequestError.CODE.INCOMPLETE_RESULT,
+                                           '[acd_api] range %i-%i incomplete.' % (start, end - 1))
+            except (RequestError, OSError) as e:
+                with cond:
+                    errors.append(e)
+            finally:
+                with cond:
+                    finished.append(True)
+                    cond.notify_all()
+
+        logger.debug('Downloading %i missing range(s) of node "%s" using %i connection(s).'
+                     % (len(pieces), node_id, workers))
+        threads = [Thread(target=fetch, name='%s-range-%i' % (node_id, i))
+                   for i in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        chunk_sz = self._conf.getint('transfer', 'fs_chunk_size')
+        try:
+            with open(path, 'rb', buffering=0) as f:
+                pos = 0
+                while pos < length:
+                    with cond:
+                        avail = completed.end_of(pos)
+                        while avail <= pos and not errors and len(finished) < workers:
+                            cond.wait()
+                            avail = completed.end_of(pos)
+                    if avail <= pos:
+                        break
+                    if not write_callbacks:
+                        pos = avail
+                        continue
+                    f.seek(pos)
+                    while pos < avail:
+                        chunk = f.read(min(chunk_sz, avail - pos))
+                        for wcb in write_callbacks:
+                            wcb(chunk)
+                        pos += len(chunk)
+        except:
+            with cond:
+                errors.append(None)
+            raise
+        finally:
+            for t in threads:
+                t.join()
+            with cond:
+                save_journal()
+            os.close(sync_fd)
+
+        if errors:
+            raise errors[0]
+        if pos < length:
+            raise RequestError(RequestError.CODE.INCOMPLETE_RESULT,
+                               '[acd_api] download incomplete. Missing %i byte(s).'
+                               % (length - completed.size()))
 
     @catch_conn_exception
     def chunked_download(self, node_id: str, file: io.BufferedWriter, **kwargs):
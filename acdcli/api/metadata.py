@@ -1,10 +1,15 @@
 """Node metadata operations"""
 
+import codecs
 import json
 import logging
 import http.client
+import queue
+import re
 import tempfile
 from collections import namedtuple
+from functools import partial
+from threading import Thread, Event
 
 from .common import *
 
@@ -12,6 +17,110 @@ logger = logging.getLogger(__name__)
 
 ChangeSet = namedtuple('Changes', ['nodes', 'purged_nodes', 'checkpoint', 'reset'])
 
+_WS = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+
+_PAGE_END = object()
+"""event that marks the end of a changes page"""
+
+
+def _put(q: queue.Queue, stop: Event, item) -> bool:
+    """Puts *item* into the bounded queue *q* unless the consumer has set *stop*.
+
+    :returns: whether the item was put"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class _ChangesStreamParser(object):
+    """Incremental parser for the changes response. Each line of the response is a JSON object
+    (page); the members of a page are generated as (key, value) events as soon as they are read,
+    with the elements of the "nodes" array generated one by one as ('node', node) events.
+    Thus, a page never has to be held in memory entirely."""
+
+    def __init__(self, chunks):
+        """:param chunks: iterable of bytes, e.g. :meth:`requests.Response.iter_content`"""
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Appends the next chunk to the buffer, dropping the consumed part.
+
+        :returns: whether the buffer could be extended"""
+        if self._eof:
+            return False
+        try:
+            text = self._decoder.decode(next(self._chunks))
+        except StopIteration:
+            self._eof = True
+            text = self._decoder.decode(b'', final=True)
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Skips whitespace and returns the next character or an empty string at the end."""
+        while True:
+            self._pos = _WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if not c or c not in chars:
+            raise ValueError('Expected one of "%s" at "%s".' % (chars, self._buf[self._pos:][:32]))
+        self._pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # a number at the end of the buffer may be truncated
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self) -> 'Generator[tuple]':
+        while self._peek():
+            self._expect('{')
+            if self._peek() == '}':
+                self._pos += 1
+            else:
+                while True:
+                    key = self._value()
+                    self._expect(':')
+                    if key == 'nodes':
+                        self._expect('[')
+                        if self._peek() == ']':
+                            self._pos += 1
+                        else:
+                            while True:
+                                yield 'node', self._value()
+                                if self._expect(',]') == ']':
+                                    break
+                    else:
+                        yield key, self._value()
+                    if self._expect(',}') == '}':
+                        break
+            yield _PAGE_END, None
+
 
 class MetadataMixin(object):
     def get_node_list(self, **params) -> list:
@@ -33,22 +142,54 @@ class MetadataMixin(object):
     def get_trashed_files(self) -> list:
         return self.get_node_list(filters='status:TRASH AND kind:FILE')
 
+    def iter_node_pages(self, *filters) -> 'Generator[List[dict]]':
+        """Lists the nodes matching each of the *filters* concurrently, one thread per filter.
+        Pages are generated as they arrive, in no particular order; at most
+        ``page_queue_size`` pages are read ahead of the consumer.
+
+        :param filters: filter strings, e.g. 'kind:FOLDER'
+        :raises: RequestError
+        """
+
+        q = queue.Queue(maxsize=self._conf.getint('changes', 'page_queue_size'))
+        stop = Event()
+        put = partial(_put, q, stop)
+
+        def produce(filter_: str):
+            try:
+                for page in self.BOReq.iter_pages(self.metadata_url + 'nodes',
+                                                  {'filters': filter_}):
+                    if not put(page):
+                        return
+            except Exception as e:
+                put(e)
+            else:
+                put(None)
+
+        for filter_ in filters:
+            t = Thread(target=produce, args=(filter_,), name='list')
+            t.daemon = True
+            t.start()
+
+        try:
+            running = len(filters)
+            while running:
+                item = q.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+
     def get_changes(self, checkpoint='', include_purged=False, silent=True, file=None):
         """Writes changes into a (temporary) file. See
         `<https://developer.amazon.com/public/apis/experience/cloud-drive/content/changes>`_.
         """
 
-        logger.info('Getting changes with checkpoint "%s".' % checkpoint)
-
-        body = {}
-        if checkpoint:
-            body['checkpoint'] = checkpoint
-        if include_purged:
-            body['includePurged'] = 'true'
-        r = self.BOReq.post(self.metadata_url + 'changes', data=json.dumps(body), stream=True)
-        if r.status_code not in OK_CODES:
-            r.close()
-            raise RequestError(r.status_code, r.text)
+        r = self._request_changes(checkpoint, include_purged)
 
         if file:
             tmp = open(file, 'w+b')
@@ -73,6 +214,153 @@ class MetadataMixin(object):
             tmp.seek(0)
             return tmp
 
+    def _request_changes(self, checkpoint: str, include_purged: bool) -> requests.Response:
+        logger.info('Getting changes with checkpoint "%s".' % checkpoint)
+
+        body = {}
+        if checkpoint:
+            body['checkpoint'] = checkpoint
+        if include_purged:
+            body['includePurged'] = 'true'
+        r = self.BOReq.post(self.metadata_url + 'changes', data=json.dumps(body), stream=True)
+        if r.status_code not in OK_CODES:
+            r.close()
+            raise RequestError(r.status_code, r.text)
+        return r
+
+    def iter_changes(self, checkpoint='', include_purged=False) -> 'Generator[ChangeSet]':
+        """Streams changes as ChangeSets of at most ``batch_size`` nodes each. The response is
+        parsed on a separate thread that stays up to ``queue_size`` ChangeSets ahead of the
+        consumer, so that downloading and processing the changes overlap.
+
+        Only the last ChangeSet of a page carries the page's checkpoint (the preceding ones have
+        a checkpoint of ``None``) and only the first one may have the reset flag set.
+
+        :raises: RequestError
+        """
+
+        r = self._request_changes(checkpoint, include_purged)
+        q = queue.Queue(maxsize=self._conf.getint('changes', 'queue_size'))
+        stop = Event()
+        put = partial(_put, q, stop)
+
+        def produce():
+            try:
+                chunks = r.iter_content(chunk_size=self._conf.getint('transfer', 'fs_chunk_size'))
+                for changeset in self._iter_changes_stream(
+                        chunks, self._conf.getint('changes', 'batch_size')):
+                    if not put(changeset):
+                        return
+            except (http.client.IncompleteRead, requests.exceptions.ChunkedEncodingError,
+                    ReadTimeoutError, ConnectionError) as e:
+                logger.info(str(e))
+                put(RequestError(RequestError.CODE.INCOMPLETE_RESULT,
+                                 '[acd_api] reading changes terminated prematurely.'))
+            except Exception as e:
+                put(e)
+            else:
+                put(None)
+            finally:
+                r.close()
+
+        t = Thread(target=produce, name='changes')
+        t.daemon = True
+        t.start()
+
+        try:
+            while True:
+                item = q.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    @staticmethod
+    def _iter_changes_stream(chunks, batch_size: int) -> 'Generator[ChangeSet]':
+        """Generates ChangeSets of at most *batch_size* nodes from a stream of changes pages.
+
+        If a page lists nodes before its reset flag, they are spooled to a temporary file
+        until the flag is known.
+
+        :param chunks: iterable of bytes
+        :raises: RequestError
+        """
+
+        end = False
+        pages = 0
+        nodes, purged_nodes = [], []
+        checkpoint, reset, first, spool = None, None, True, None
+
+        def batch(checkpoint=None) -> ChangeSet:
+            nonlocal nodes, purged_nodes, first
+            changeset = ChangeSet(nodes, purged_nodes, checkpoint, bool(reset) and first)
+            nodes, purged_nodes, first = [], [], False
+            return changeset
+
+        def add(node) -> bool:
+            """:returns: whether the current batch is full"""
+            if node['status'] == 'PURGED':
+                purged_nodes.append(node['id'])
+            else:
+                nodes.append(node)
+            return len(nodes) + len(purged_nodes) >= batch_size
+
+        def unspool() -> 'Generator[ChangeSet]':
+            nonlocal spool
+            if not spool:
+                return
+            spool.seek(0)
+            for line in spool:
+                if add(json.loads(line)):
+                    yield batch()
+            spool.close()
+            spool = None
+
+        try:
+            for key, value in _ChangesStreamParser(chunks):
+                if key == 'node':
+                    if reset is None:
+                        if not spool:
+                            spool = tempfile.TemporaryFile('w+')
+                        spool.write(json.dumps(value) + '\n')
+                    elif add(value):
+                        yield batch()
+                elif key == 'reset':
+                    reset = value
+                    if reset:
+                        logger.info('Found "reset" tag in changes.')
+                    yield from unspool()
+                elif key == 'statusCode':
+                    # could this actually happen?
+                    if value not in OK_CODES:
+                        raise RequestError(RequestError.CODE.FAILED_SUBREQUEST,
+                                           '[acd_api] Partial failure in change request.')
+                elif key == 'checkpoint':
+                    checkpoint = value
+                    logger.debug('Checkpoint: %s' % checkpoint)
+                elif key == 'end':
+                    end = bool(value)
+                elif key is _PAGE_END:
+                    if not end:
+                        pages += 1
+                        reset = reset or False
+                        yield from unspool()
+                        yield batch(checkpoint)
+                    checkpoint, reset, first = None, None, True
+        except ValueError:
+            raise RequestError(RequestError.CODE.INCOMPLETE_RESULT,
+                               '[acd_api] Invalid JSON in change set, page %i.' % pages)
+        finally:
+            if spool:
+                spool.close()
+
+        logger.info('%i page(s) in changes.' % pages)
+        if not end:
+            logger.warning('End of change request not reached.')
+
     @staticmethod
     def _iter_changes_lines(f) -> 'Generator[ChangeSet]':
         """Generates a ChangeSet per line in passed file
@@ -185,6 +473,10 @@ class MetadataMixin(object):
         l = self.BOReq.paginated_get(self.metadata_url + 'nodes/' + node_id + '/children')
         return l
 
+    def iter_children(self, node_id: str) -> 'Generator[List[dict]]':
+        """Generates the children of a folder page by page."""
+        return self.BOReq.iter_pages(self.metadata_url + 'nodes/' + node_id + '/children')
+
     def list_child_folders(self, node_id: str) -> list:
         l = self.BOReq.paginated_get(self.metadata_url + 'nodes/' + node_id + '/children',
                                      params={'filters': 'kind:FOLDER'})
@@ -7,14 +7,48 @@ import webbrowser
 import datetime
 import random
 import string
+import weakref
+from collections import namedtuple
 from requests.auth import AuthBase
 from urllib.parse import urlparse, parse_qs
-from threading import Lock
+from threading import Event, Lock, Thread
 
 logger = logging.getLogger(__name__)
 
 TOKEN_INFO_URL = 'https://api.amazon.com/auth/o2/tokeninfo'
 
+REFRESH_MARGIN = 60
+"""seconds before the expiration time at which the refresher renews the token"""
+WATCH_INTERVAL = 30
+"""maximum interval in seconds between checks of the oauth file for external updates"""
+RETRY_INTERVAL = 10
+"""interval in seconds between refresh attempts of the refresher after a failure"""
+
+_Token = namedtuple('_Token', ['header', 'exp_time'])
+"""immutable snapshot of the current authorization header"""
+
+
+def _refresh_loop(ref: weakref.ref, stop: Event):
+    """Proactively refreshes the token of the referenced handler until it is stopped
+    or garbage collected."""
+    while True:
+        handler = ref()
+        if handler is None:
+            return
+        delay = handler._refresh_delay()
+        del handler
+        if stop.wait(delay):
+            return
+        handler = ref()
+        if handler is None:
+            return
+        try:
+            handler._proactive_refresh()
+        except Exception as e:
+            logger.warning('Proactive token refresh failed: %s' % e)
+            handler._retry_time = time.time() + RETRY_INTERVAL
+        del handler
+
 
 def create_handler(path: str):
     from .common import RequestError
@@ -45,11 +79,82 @@ class OAuthHandler(AuthBase):
         self.init_time = time.time()
         self.lock = Lock()
 
+        self._token = _Token(None, 0.0)
+        self._mtime = None
+        self._retry_time = 0.0
+        self._stop = Event()
+        self._refresher = None
+
     def __call__(self, r: requests.Request):
-        with self.lock:
-            r.headers['Authorization'] = self.get_auth_token()
+        # the snapshot is replaced, never modified, so it may be read without locking
+        token = self._token
+        if time.time() > token.exp_time:
+            with self.lock:
+                token = self._token
+                if time.time() > token.exp_time:
+                    self.get_auth_token()
+                    token = self._token
+        r.headers['Authorization'] = token.header
         return r
 
+    def _set_token(self):
+        """Publishes a new snapshot of the current OAuth data."""
+        self._token = _Token('Bearer ' + self.oauth_data[self.KEYS.ACC_TOKEN], self.exp_time)
+
+    def _oauth_file_mtime(self):
+        try:
+            return os.stat(self.oauth_data_path).st_mtime
+        except OSError:
+            return None
+
+    def _reload_oauth_data(self) -> bool:
+        """Reloads the oauth file if it was modified since it was last read or written.
+
+        :returns: whether the file was reloaded"""
+
+        mtime = self._oauth_file_mtime()
+        if mtime is not None and mtime == self._mtime:
+            return False
+        with open(self.oauth_data_path) as oa:
+            o = oa.read()
+        self.oauth_data = self.validate(o)
+        self._mtime = mtime
+        if self.KEYS.EXP_TIME not in self.oauth_data:
+            self.treat_auth_token(mtime or time.time())
+        return True
+
+    def start_refresher(self, force=False):
+        """Starts a daemon thread that refreshes the token shortly before it expires
+        and picks up tokens written to the oauth file by other instances.
+
+        :param force: start a new thread even if the current one seems to be alive, e.g. in a
+           process forked without Python's knowledge, where the thread did not survive"""
+        if not force and self._refresher and self._refresher.is_alive():
+            return
+        # a thread that is still running stops on the old event
+        self._stop.set()
+        self._stop = Event()
+        self._refresher = Thread(target=_refresh_loop, args=(weakref.ref(self), self._stop),
+                                 name='OAuthRefresher', daemon=True)
+        self._refresher.start()
+
+    def stop_refresher(self):
+        self._stop.set()
+
+    def _refresh_delay(self) -> float:
+        due = max(self._token.exp_time - REFRESH_MARGIN, self._retry_time) - time.time()
+        return min(max(due, 0), WATCH_INTERVAL)
+
+    def _proactive_refresh(self):
+        with self.lock:
+            if self._reload_oauth_data():
+                logger.info('Externally updated token found in oauth file.')
+                self._set_token()
+            if time.time() > self._token.exp_time - REFRESH_MARGIN \
+                    and time.time() > self._retry_time:
+                self.refresh_auth_token()
+                self._set_token()
+
     @property
     def exp_time(self):
         return self.oauth_data[self.KEYS.EXP_TIME]
@@ -92,11 +197,14 @@ class OAuthHandler(AuthBase):
             logger.critical('Local OAuth data file "%s" is invalid. '
                             'Please fix or delete it.' % self.oauth_data_path)
             raise
+        self._mtime = self._oauth_file_mtime()
         if self.KEYS.EXP_TIME not in self.oauth_data:
             self.treat_auth_token(self.init_time)
             self.write_oauth_data()
         else:
             self.get_auth_token(reload=False)
+        self._set_token()
+        self.start_refresher()
 
     def get_auth_token(self, reload=True) -> str:
         """Gets current access token, refreshes if necessary.
@@ -109,14 +217,13 @@ class OAuthHandler(AuthBase):
 
             # if multiple instances are running, check for updated file
             if reload:
-                with open(self.oauth_data_path) as oa:
-                    o = oa.read()
-                self.oauth_data = self.validate(o)
+                self._reload_oauth_data()
 
             if time.time() > self.exp_time:
                 self.refresh_auth_token()
             else:
                 logger.info('Externally updated token found in oauth file.')
+            self._set_token()
         return "Bearer " + self.oauth_data[self.KEYS.ACC_TOKEN]
 
     def write_oauth_data(self):
@@ -138,6 +245,7 @@ class OAuthHandler(AuthBase):
             os.remove(rm_nm)
         except OSError:
             pass
+        self._mtime = self._oauth_file_mtime()
 
     def refresh_auth_token(self):
         """Fetches a new access token using the refresh token."""
@@ -10,7 +10,7 @@ from acdcli.utils.conf import get_conf
 
 from .cursors import *
 from .format import FormatterMixin
-from .query import QueryMixin
+from .query import QueryMixin, PathCache
 from .schema import SchemaMixin
 from .sync import SyncMixin
 
@@ -24,6 +24,7 @@ _SETTINGS_FILENAME = 'cache.ini'
 _def_conf = configparser.ConfigParser()
 _def_conf['sqlite'] = dict(filename='nodes.db', busy_timeout=30000, journal_mode='wal')
 _def_conf['blacklist'] = dict(folders=[])
+_def_conf['paths'] = dict(cache_size=10000)
 
 
 
@@ -56,6 +57,7 @@ class NodeCache(SchemaMixin, QueryMixin, SyncMixin, FormatterMixin):
 
         self.db_path = os.path.join(cache_path, self._conf['sqlite']['filename'])
         self.tl = local()
+        self.path_cache = PathCache(self._conf.getint('paths', 'cache_size'))
 
         self.integrity_check(check)
         try:
@@ -8,6 +8,7 @@ import sys
 import datetime
 
 from .cursors import cursor
+from .query import parent_path
 
 try:
     colors = filter(None, os.environ.get('LS_COLORS', '').split(':'))
@@ -171,9 +172,14 @@ class FormatterMixin(object):
         for node in nodes:
             yield node.id
 
+    def _first_path(self, node) -> str:
+        if node.path:
+            return parent_path(node.path)
+        return self.first_path(node.id)
+
     def long_id_format(self, nodes) -> 'Generator[str]':
         for node in nodes:
-            path = self.first_path(node.id)
+            path = self._first_path(node)
             yield '[{}] [{}] {}{}'.format(
                 nor_fmt % node.id,
                 color_status(node.status),
@@ -183,4 +189,4 @@ class FormatterMixin(object):
 
     def path_format(self, nodes):
         for node in nodes:
-            yield self.first_path(node.id) + node.name
+            yield self._first_path(node) + node.name
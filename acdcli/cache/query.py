@@ -1,11 +1,30 @@
 import logging
-from datetime import datetime
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
 from .cursors import cursor
+from .sync import GENERATION_KEY, gen_slice, placeholders
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
 logger = logging.getLogger(__name__)
 
 
+_EPOCH = datetime(1970, 1, 1)
+
+
 def datetime_from_string(dt: str) -> datetime:
+    """Parses dates as stored by sqlite3, i.e. 'YYYY-MM-DD HH:MM:SS[.ffffff]+00:00'."""
+    try:
+        return datetime(int(dt[0:4]), int(dt[5:7]), int(dt[8:10]),
+                        int(dt[11:13]), int(dt[14:16]), int(dt[17:19]),
+                        int(dt[20:26]) if dt[19] == '.' else 0)
+    except (ValueError, IndexError):
+        pass
     try:
         dt = datetime.strptime(dt, '%Y-%m-%d %H:%M:%S.%f+00:00')
     except ValueError:
@@ -13,6 +32,33 @@ def datetime_from_string(dt: str) -> datetime:
     return dt
 
 
+def regex_literals(regex: str, min_length=3) -> 'List[str]':
+    """Extracts the runs of ASCII characters that every match of *regex* must contain literally.
+
+    :param min_length: minimum length of a run"""
+    try:
+        ops = sre_parse.parse(regex)
+    except (re.error, RecursionError):
+        return []
+
+    literals = []
+    run = ''
+    for op, av in list(ops) + [(None, None)]:
+        if op == sre_parse.LITERAL and av < 128 and chr(av) not in '%_':
+            run += chr(av)
+            continue
+        if len(run) >= min_length:
+            literals.append(run)
+        run = ''
+    return literals
+
+
+def parent_path(path: str) -> str:
+    """Returns the path of the parent folder of *path* including a trailing slash,
+    e.g. '/foo/' for '/foo/bar'."""
+    return path[:path.rindex('/') + 1]
+
+
 CONFLICTING_NODE_SQL = """SELECT n.*, f.* FROM nodes n
                   JOIN parentage p ON n.id = p.child
                   LEFT OUTER JOIN files f ON n.id = f.id
@@ -53,21 +99,37 @@ NODE_BY_ID_SQL = """SELECT n.*, f.* FROM nodes n LEFT OUTER JOIN files f ON n.id
 
 USAGE_SQL = 'SELECT SUM(size) FROM files'
 
-FIND_BY_NAME_SQL = """SELECT n.*, f.* FROM nodes n
+FIND_BY_NAME_SQL = """SELECT n.*, f.*, pt.path FROM nodes n
                       LEFT OUTER JOIN files f ON n.id = f.id
-                      WHERE n.name LIKE ?
-                      ORDER BY n.name"""
+                      LEFT OUTER JOIN paths pt ON n.id = pt.id
+                      WHERE n.name LIKE ?"""
 
-FIND_BY_REGEX_SQL = """SELECT n.*, f.* FROM nodes n
+FIND_BY_REGEX_SQL = """SELECT n.*, f.*, pt.path FROM nodes n
                       LEFT OUTER JOIN files f ON n.id = f.id
-                      WHERE n.name REGEXP ?
-                      ORDER BY n.name"""
+                      LEFT OUTER JOIN paths pt ON n.id = pt.id
+                      WHERE n.name REGEXP ?"""
+
+FIND_FTS_SQL = """SELECT n.*, f.*, pt.path FROM nodes_fts s
+                  JOIN nodes n ON n.rowid = s.rowid
+                  LEFT OUTER JOIN files f ON n.id = f.id
+                  LEFT OUTER JOIN paths pt ON n.id = pt.id
+                  WHERE %s"""
+"""query using the trigram index; LIKE patterns need at least three characters to use it"""
 
-FIND_BY_MD5_SQL = """SELECT n.*, f.* FROM nodes n
+FIND_BY_MD5_SQL = """SELECT n.*, f.*, pt.path FROM nodes n
                       LEFT OUTER JOIN files f ON n.id = f.id
+                      LEFT OUTER JOIN paths pt ON n.id = pt.id
                       WHERE f.md5 == (?)
                       ORDER BY n.name"""
 
+FIND_BY_PATH_PREFIX_SQL = """SELECT n.*, f.*, pt.path FROM paths pt
+                             JOIN nodes n ON n.id = pt.id
+                             LEFT OUTER JOIN files f ON n.id = f.id
+                             WHERE pt.path > ? AND pt.path < ?
+                             ORDER BY pt.path"""
+
+PATH_SQL = 'SELECT path FROM paths WHERE id = (?)'
+
 FIND_FIRST_PARENT_SQL = """SELECT n.* FROM nodes n
                         JOIN parentage p ON n.id = p.parent
                         WHERE p.child = (?)
@@ -80,6 +142,9 @@ FILE_SIZE_EXISTS_SQL = """SELECT COUNT(*) FROM files f
 
 
 class Node(object):
+    __slots__ = ('id', 'type', 'name', 'description', 'cre', 'mod', 'updated', 'status',
+                 'md5', 'size', 'path', '_created', '_modified', '_ctime', '_mtime')
+
     def __init__(self, row):
         self.id = row['id']
         self.type = row['type']
@@ -89,6 +154,10 @@ class Node(object):
         self.mod = row['modified']
         self.updated = row['updated']
         self.status = row['status']
+        self._created = None
+        self._modified = None
+        self._ctime = None
+        self._mtime = None
 
         try:
             self.md5 = row['md5']
@@ -98,6 +167,10 @@ class Node(object):
             self.size = row['size']
         except IndexError:
             self.size = 0
+        try:
+            self.path = row['path']
+        except IndexError:
+            self.path = None
 
     def __lt__(self, other):
         return self.name < other.name
@@ -125,12 +198,32 @@ class Node(object):
         return self.status == 'TRASH'
 
     @property
-    def created(self):
-        return datetime_from_string(self.cre)
+    def created(self) -> datetime:
+        """creation date in UTC, parsed on first access"""
+        if self._created is None:
+            self._created = datetime_from_string(self.cre)
+        return self._created
+
+    @property
+    def modified(self) -> datetime:
+        """modification date in UTC, parsed on first access"""
+        if self._modified is None:
+            self._modified = datetime_from_string(self.mod)
+        return self._modified
+
+    @property
+    def ctime(self) -> float:
+        """creation date as Unix timestamp"""
+        if self._ctime is None:
+            self._ctime = (self.created - _EPOCH) / timedelta(seconds=1)
+        return self._ctime
 
     @property
-    def modified(self):
-        return datetime_from_string(self.mod)
+    def mtime(self) -> float:
+        """modification date as Unix timestamp"""
+        if self._mtime is None:
+            self._mtime = (self.modified - _EPOCH) / timedelta(seconds=1)
+        return self._mtime
 
     @property
     def simple_name(self):
@@ -139,7 +232,128 @@ class Node(object):
         return (self.name if self.name else '') + '/'
 
 
+class PathCache(object):
+    """Thread-safe LRU cache of resolved paths. Each entry stores the resolved node (or ``None``
+    for paths that do not exist) along with the IDs of the nodes on its path, so that entries
+    can be invalidated by the IDs of changed nodes and their parents.
+
+    Modifications invalidate entries after their transaction has committed. A lookup that read
+    the nodes before the commit must therefore not add its result after the invalidation; puts
+    carry the :attr:`epoch` at which the lookup started and are dropped if entries were
+    invalidated since."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys_by_id = {}
+        self._lock = Lock()
+        self.generation = None
+        """token of the last modification of the nodes this cache is consistent with"""
+        self.epoch = 0
+        """number of invalidations, to be read before querying the nodes that are put"""
+
+    def get(self, key, count=True) -> 'Tuple[Union[Node|None], List[str]]|None':
+        """:returns: tuple of node and path IDs if *key* is cached, ``None`` otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+            if count:
+                if entry:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            return entry
+
+    def put(self, key, node: 'Union[Node|None]', ids: list, epoch: int):
+        """:param epoch: value of :attr:`epoch` before *node* was queried"""
+        if self.size <= 0:
+            return
+        with self._lock:
+            if epoch != self.epoch:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = node, ids
+            for id in ids:
+                self._keys_by_id.setdefault(id, set()).add(key)
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, ids = self._entries.pop(key)
+        for id in ids:
+            keys = self._keys_by_id.get(id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_id[id]
+
+    def invalidate(self, ids):
+        """Removes all entries whose path contains any of the node IDs in *ids*."""
+        with self._lock:
+            self.epoch += 1
+            for id in ids:
+                for key in list(self._keys_by_id.get(id, ())):
+                    self._remove(key)
+
+    def invalidate_children(self, children):
+        """Removes the entries of the paths that a new or renamed child may affect, i.e. those
+        that resolve the child's name directly within its parent folder.
+
+        :param children: iterable of (parent ID, child name) tuples"""
+        with self._lock:
+            self.epoch += 1
+            for parent_id, name in children:
+                for key in list(self._keys_by_id.get(parent_id, ())):
+                    node, ids = self._entries[key]
+                    # negative entries end with the folder the lookup failed in
+                    parent = ids[-1] if node is None else ids[-2] if len(ids) > 1 else None
+                    if parent == parent_id and key[0].rsplit('/', 1)[-1] == name:
+                        self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.epoch += 1
+            self._entries.clear()
+            self._keys_by_id.clear()
+
+    def advance(self, old: str, new: str):
+        """Sets the generation token to *new*, clearing the cache first unless the cache
+        is consistent with generation *old*."""
+        with self._lock:
+            if old != self.generation:
+                self.epoch += 1
+                self._entries.clear()
+                self._keys_by_id.clear()
+            self.generation = new
+
+    def info(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+
 class QueryMixin(object):
+    def _check_path_cache(self):
+        """Clears the path cache if the nodes were modified by another process since this thread
+        last checked. Modifications made by this process invalidate the affected entries
+        themselves and leave the cache intact."""
+        with cursor(self._conn) as c:
+            c.execute('PRAGMA data_version')
+            version = c.fetchone()[0]
+            if getattr(self.tl, 'data_version', None) == version:
+                return
+            c.execute('SELECT value FROM metadata WHERE key = ?', [GENERATION_KEY])
+            r = c.fetchone()
+        generation = r[0] if r else None
+        self.path_cache.advance(generation, generation)
+        self.tl.data_version = version
+
+    def path_cache_info(self) -> dict:
+        """:returns: hit and miss counts and the current number of entries of the path cache"""
+        return self.path_cache.info()
+
     def get_node(self, id) -> 'Union[Node|None]':
         with cursor(self._conn) as c:
             c.execute(NODE_BY_ID_SQL, [id])
@@ -150,6 +364,17 @@ class QueryMixin(object):
     def get_root_node(self):
         return self.get_node(self.root_id)
 
+    def get_modified_dates(self, ids: list) -> 'Dict[str, str]':
+        """:returns: dict of node ID -> modification date as stored in the database
+           for each of the given nodes that is cached"""
+        dates = {}
+        with cursor(self._conn) as c:
+            for slice_ in gen_slice(ids):
+                c.execute('SELECT id, modified FROM nodes WHERE id IN %s'
+                          % placeholders(slice_), slice_)
+                dates.update(c.fetchall())
+        return dates
+
     def get_conflicting_node(self, name: str, parent_id: str):
         """Finds conflicting node in folder specified by *parent_id*, if one exists."""
         with cursor(self._conn) as c:
@@ -160,31 +385,56 @@ class QueryMixin(object):
 
     def resolve(self, path: str, trash=False) -> 'Union[Node|None]':
         segments = list(filter(bool, path.split('/')))
+        if not self.root_id:
+            return
+
+        self._check_path_cache()
+        epoch = self.path_cache.epoch
+        entry = self.path_cache.get(('/' + '/'.join(segments), trash))
+        if entry:
+            return entry[0]
+
         if not segments:
-            if not self.root_id:
-                return
             with cursor(self._conn) as c:
                 c.execute(NODE_BY_ID_SQL, [self.root_id])
                 r = c.fetchone()
-                return Node(r)
+            r = Node(r) if r else None
+            self.path_cache.put(('/', trash), r, [self.root_id], epoch)
+            return r
+
+        # continue from the longest cached parent folder
+        parent, ids, start = self.root_id, [self.root_id], 0
+        for i in range(len(segments) - 1, 0, -1):
+            entry = self.path_cache.get(('/' + '/'.join(segments[:i]), trash), count=False)
+            if entry:
+                node, ids = entry
+                if not node or not node.is_folder:
+                    return
+                parent, start = node.id, i
+                break
 
-        parent = self.root_id
-        for i, segment in enumerate(segments):
+        for i, segment in enumerate(segments[start:], start):
             with cursor(self._conn) as c:
                 c.execute(CHILD_OF_SQL, [segment, parent])
                 r = c.fetchone()
                 r2 = c.fetchone()
 
+            key = ('/' + '/'.join(segments[:i + 1]), trash)
             if not r:
+                self.path_cache.put(key, None, ids, epoch)
                 return
             r = Node(r)
 
             if not r.is_available:
                 if not trash:
+                    self.path_cache.put(key, None, ids, epoch)
                     return
                 if r2:
                     logger.debug('None-unique trash name "%s" in %s.' % (segment, parent))
+                    self.path_cache.put(key, None, ids, epoch)
                     return
+            ids = ids + [r.id]
+            self.path_cache.put(key, r, ids, epoch)
             if i + 1 == len(segments):
                 return r
             if r.is_folder:
@@ -193,6 +443,40 @@ class QueryMixin(object):
             else:
                 return
 
+    def resolve_children(self, path: str) -> 'Tuple[Union[Node|None], List[Node]]':
+        """Resolves the folder at *path* and lists its available children in a single query.
+        As the children are likely to be resolved next (e.g. when listing a folder), their
+        paths are added to the path cache, up to half of its size.
+
+        :returns: the node at *path* and, if it is a folder, its available children"""
+
+        self._check_path_cache()
+        epoch = self.path_cache.epoch
+        node = self.resolve(path)
+        if not node or not node.is_folder:
+            return node, []
+
+        children = []
+        with cursor(self._conn) as c:
+            c.execute(CHILDREN_SQL, [node.id])
+            r = c.fetchone()
+            while r:
+                r = Node(r)
+                if r.is_available:
+                    children.append(r)
+                r = c.fetchone()
+
+        segments = list(filter(bool, path.split('/')))
+        entry = self.path_cache.get(('/' + '/'.join(segments), False), count=False)
+        if entry:
+            ids = entry[1]
+            prefix = '/' + '/'.join(segments + [''])
+            for child in children[:self.path_cache.size // 2]:
+                self.path_cache.put((prefix + child.name, False), child, ids + [child.id],
+                                    epoch)
+
+        return node, children
+
     def childrens_names(self, folder_id) -> 'List[str]':
         with cursor(self._conn) as c:
             c.execute(CHILDRENS_NAMES_SQL, [folder_id])
@@ -273,8 +557,16 @@ class QueryMixin(object):
         return folders, files
 
     def first_path(self, node_id: str) -> str:
+        """:returns: path of the first parent folder of a node, with a trailing slash"""
         if node_id == self.root_id:
             return '/'
+        with cursor(self._conn) as c:
+            c.execute(PATH_SQL, (node_id,))
+            r = c.fetchone()
+        if r and r['path']:
+            return parent_path(r['path'])
+
+        # path not materialized, e.g. if the node is not connected to the root node
         with cursor(self._conn) as c:
             c.execute(FIND_FIRST_PARENT_SQL, (node_id,))
             r = c.fetchone()
@@ -283,36 +575,61 @@ class QueryMixin(object):
             return node.simple_name
         return self.first_path(node.id) + node.name + '/'
 
-    def find_by_name(self, name: str) -> 'List[Node]':
-        nodes = []
+    def _iter_nodes(self, sql: str, params: list) -> 'Generator[Node]':
         with cursor(self._conn) as c:
-            c.execute(FIND_BY_NAME_SQL, ['%' + name + '%'])
+            c.execute(sql, params)
             r = c.fetchone()
             while r:
-                nodes.append(Node(r))
+                yield Node(r)
                 r = c.fetchone()
-        return nodes
 
-    def find_by_md5(self, md5) -> 'List[Node]':
+    def _find(self, sql: str, params: list, limit: int = None) -> 'Generator[Node]':
+        """Runs a find query. Without a limit, the nodes are sorted by name; with a limit,
+        they are unsorted, so that they are yielded as soon as they are found instead of once
+        the whole table was scanned."""
+        if limit is None:
+            return self._iter_nodes(sql + ' ORDER BY n.name', params)
+        return self._iter_nodes(sql + ' LIMIT ?', params + [limit])
+
+    def find_by_name(self, name: str, limit: int = None) -> 'Generator[Node]':
+        """Finds nodes whose name contains *name*. Uses the full-text index if possible."""
+        if self.fts and len(name) >= 3:
+            return self._find(FIND_FTS_SQL % 's.name LIKE ?', ['%' + name + '%'], limit)
+        return self._find(FIND_BY_NAME_SQL, ['%' + name + '%'], limit)
+
+    def find_by_path_prefix(self, path: str) -> 'List[Node]':
+        """Finds all nodes below the folder at *path* (excluding the folder itself)."""
+        prefix = path.rstrip('/') + '/'
         nodes = []
         with cursor(self._conn) as c:
-            c.execute(FIND_BY_MD5_SQL, (md5,))
+            # all paths p with prefix < p < prefix with its last char incremented
+            c.execute(FIND_BY_PATH_PREFIX_SQL, (prefix, prefix[:-1] + chr(ord('/') + 1)))
             r = c.fetchone()
             while r:
                 nodes.append(Node(r))
                 r = c.fetchone()
         return nodes
 
-    def find_by_regex(self, regex) -> 'List[Node]':
+    def find_by_md5(self, md5) -> 'List[Node]':
         nodes = []
         with cursor(self._conn) as c:
-            c.execute(FIND_BY_REGEX_SQL, (regex,))
+            c.execute(FIND_BY_MD5_SQL, (md5,))
             r = c.fetchone()
             while r:
                 nodes.append(Node(r))
                 r = c.fetchone()
         return nodes
 
+    def find_by_regex(self, regex: str, limit: int = None) -> 'Generator[Node]':
+        """Finds nodes whose name matches *regex* (case-insensitively). If possible,
+        the full-text index is used to prefilter the names by literal parts of the regex."""
+        literals = regex_literals(regex) if self.fts else []
+        if literals:
+            where = ' AND '.join(['s.name LIKE ?'] * len(literals) + ['n.name REGEXP ?'])
+            return self._find(FIND_FTS_SQL % where,
+                              ['%' + l + '%' for l in literals] + [regex], limit)
+        return self._find(FIND_BY_REGEX_SQL, [regex], limit)
+
     def file_size_exists(self, size) -> bool:
         with cursor(self._conn) as c:
             c.execute(FILE_SIZE_EXISTS_SQL, [size])
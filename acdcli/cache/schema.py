@@ -52,13 +52,55 @@ _CREATION_SCRIPT = """
         FOREIGN KEY(child) REFERENCES nodes (id)
     );
 
+    CREATE TABLE paths (
+        id VARCHAR(50) NOT NULL,
+        path VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(id) REFERENCES nodes (id)
+    );
+
     CREATE INDEX ix_parentage_child ON parentage(child);
     CREATE INDEX ix_nodes_names ON nodes(name);
-    PRAGMA user_version = 3;
+    CREATE INDEX ix_paths_path ON paths(path);
+    PRAGMA user_version = 4;
     """
 
+FIRST_PARENT_SQL = """SELECT pp.parent FROM parentage pp
+                       JOIN nodes pn ON pn.id = pp.parent
+                       WHERE pp.child = n.id
+                       ORDER BY pn.status, pn.id LIMIT 1"""
+"""subquery selecting the parent of node 'n' that is used for its materialized path"""
+
+SUBTREE_PATHS_SQL = """WITH RECURSIVE tree(id, path) AS (
+                           %s
+                           UNION ALL
+                           SELECT n.id, rtrim(tree.path, '/') || '/' || n.name FROM tree
+                           JOIN parentage p ON p.parent = tree.id
+                           JOIN nodes n ON n.id = p.child
+                           WHERE p.parent = (""" + FIRST_PARENT_SQL + """))
+                       INSERT OR REPLACE INTO paths SELECT id, path FROM tree"""
+"""recomputes the paths of all descendants of the nodes selected by the
+(id, path) query that is to be inserted"""
+
+REBUILD_PATHS_SQL = SUBTREE_PATHS_SQL % \
+                    'SELECT id, "/" FROM nodes WHERE name IS NULL AND type == "folder"'
+
+# virtual tables are dropped first as dropping them also drops their shadow tables
 _GEN_DROP_TABLES_SQL = \
-    'SELECT "DROP TABLE " || name || ";" FROM sqlite_master WHERE type == "table"'
+    'SELECT "DROP TABLE IF EXISTS " || name || ";" FROM sqlite_master WHERE type == "table" ' \
+    'ORDER BY sql LIKE "CREATE VIRTUAL TABLE%" DESC'
+
+_CREATE_FTS_SQL = 'CREATE VIRTUAL TABLE nodes_fts USING fts5(name, tokenize="trigram")'
+"""optional trigram index of node names, requires SQLite >= 3.34 with FTS5"""
+
+REBUILD_FTS_SQL = 'INSERT INTO nodes_fts(rowid, name) SELECT rowid, name FROM nodes ' \
+                  'WHERE name IS NOT NULL'
+
+_PROBE_FTS_SQL = 'CREATE VIRTUAL TABLE temp.fts_probe USING fts5(name, tokenize="trigram")'
+"""tests whether the SQLite library supports the trigram index"""
+
+_FTS_OUTDATED_KEY = 'fts_outdated'
+"""metadata key set while the index is not updated by a library that does not support it"""
 
 _migrations = []
 """list of all schema migrations"""
@@ -101,8 +143,20 @@ def _2_to_3(conn):
     conn.commit()
 
 
+@_migration
+def _3_to_4(conn):
+    conn.executescript(
+        'CREATE TABLE IF NOT EXISTS paths (id VARCHAR(50) NOT NULL, path VARCHAR, '
+        'PRIMARY KEY (id), FOREIGN KEY(id) REFERENCES nodes (id));'
+        'CREATE INDEX IF NOT EXISTS ix_paths_path ON paths(path);'
+    )
+    conn.execute(REBUILD_PATHS_SQL)
+    conn.execute('PRAGMA user_version = 4;')
+    conn.commit()
+
+
 class SchemaMixin(object):
-    _DB_SCHEMA_VER = 3
+    _DB_SCHEMA_VER = 4
 
     def init(self):
         try:
@@ -119,7 +173,44 @@ class SchemaMixin(object):
         if self._DB_SCHEMA_VER > ver:
             self._migrate(ver)
 
-        self.KeyValueStorage = _KeyValueStorage(self._conn)
+        self._init_fts()
+        self.KeyValueStorage = _KeyValueStorage(self)
+
+    def _init_fts(self):
+        """Creates and populates the full-text index of node names if it does not exist and
+        the SQLite library supports it. Sets :attr:`fts` accordingly.
+
+        An existing index is not updated if the library does not support it, e.g. if the cache
+        was created by another build; it is then marked as outdated and rebuilt once the
+        library supports it again."""
+        with cursor(self._conn) as c:
+            c.execute('SELECT COUNT(*) FROM sqlite_master WHERE name == "nodes_fts"')
+            exists = bool(c.fetchone()[0])
+        try:
+            with mod_cursor(self._conn) as c:
+                c.execute(_PROBE_FTS_SQL)
+                c.execute('DROP TABLE temp.fts_probe')
+        except OperationalError as e:
+            logger.info('Full-text search index unavailable: %s.' % e)
+            self.fts = False
+            if exists:
+                with mod_cursor(self._conn) as c:
+                    c.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+                              [_FTS_OUTDATED_KEY, '1'])
+            return
+
+        with mod_cursor(self._conn) as c:
+            if not exists:
+                c.execute(_CREATE_FTS_SQL)
+                c.execute(REBUILD_FTS_SQL)
+            else:
+                c.execute('SELECT COUNT(*) FROM metadata WHERE key == ?', [_FTS_OUTDATED_KEY])
+                if c.fetchone()[0]:
+                    logger.info('Rebuilding outdated full-text search index.')
+                    c.execute('DELETE FROM nodes_fts')
+                    c.execute(REBUILD_FTS_SQL)
+                    c.execute('DELETE FROM metadata WHERE key == ?', [_FTS_OUTDATED_KEY])
+        self.fts = True
 
     def create_tables(self):
         self._conn.executescript(_CREATION_SCRIPT)
@@ -144,13 +235,19 @@ class SchemaMixin(object):
             for drop in drop_sql:
                 c.execute(drop)
         self._conn.commit()
+        self.path_cache.clear()
         logger.info('Dropped all tables.')
         return True
 
 
 class _KeyValueStorage(object):
-    def __init__(self, conn):
-        self.conn = conn
+    def __init__(self, cache):
+        self.cache = cache
+
+    @property
+    def conn(self):
+        # the cache's connection is thread-local
+        return self.cache._conn
 
     def __getitem__(self, key: str):
         with cursor(self.conn) as c:
@@ -3,13 +3,53 @@ Syncs Amazon Node API objects with SQLite database.
 """
 
 import logging
+import re
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
 from itertools import islice
-from .cursors import mod_cursor
+from .cursors import cursor, mod_cursor
+from .schema import REBUILD_FTS_SQL, REBUILD_PATHS_SQL, SUBTREE_PATHS_SQL
 import dateutil.parser as iso_date
 
 logger = logging.getLogger(__name__)
 
+_INSERT_NODE_SQL = 'INSERT OR REPLACE INTO nodes ' \
+                   '(id, type, name, description, created, modified, updated, status) ' \
+                   'VALUES (?, "%s", ?, ?, ?, ?, ?, ?)'
+
+_DELETE_FTS_SQL = 'DELETE FROM nodes_fts WHERE rowid IN (SELECT rowid FROM nodes WHERE id IN %s)'
+_INSERT_FTS_SQL = 'INSERT INTO nodes_fts(rowid, name) SELECT rowid, name FROM nodes ' \
+                  'WHERE id IN %s AND name IS NOT NULL'
+
+GENERATION_KEY = 'generation'
+"""metadata key of the token that is replaced by each modification of the nodes"""
+
+_SECONDARY_INDEXES = [('ix_parentage_child', 'parentage(child)'), ('ix_nodes_names', 'nodes(name)'),
+                      ('ix_paths_path', 'paths(path)')]
+"""indexes that are dropped during bulk insertion"""
+
+_ISO_DATE_RE = re.compile(r'(\d{4}-\d\d-\d\d)T(\d\d:\d\d:\d\d)(?:\.(\d{1,6}))?Z$')
+
+
+def iso_to_db_date(date: str) -> str:
+    """Converts an ISO 8601 UTC date as returned by the API, e.g. '2015-01-01T12:00:00.123Z',
+    into the format sqlite3 stores timezone-aware datetimes in without creating a
+    datetime object. Other dates are parsed using dateutil."""
+    m = _ISO_DATE_RE.match(date)
+    if not m:
+        return str(iso_date.parse(date))
+    day, time, frac = m.groups()
+    if frac and int(frac):
+        return '%s %s.%s+00:00' % (day, time, frac.ljust(6, '0'))
+    return '%s %s+00:00' % (day, time)
+
+
+def _node_row(node: dict, updated: datetime) -> tuple:
+    return (node['id'], node.get('name'), node.get('description'),
+            iso_to_db_date(node['createdDate']), iso_to_db_date(node['modifiedDate']),
+            updated, node['status'])
+
 
 # prevent sqlite3 from throwing too many arguments errors (#145)
 def gen_slice(list_, length=100):
@@ -38,18 +78,29 @@ class SyncMixin(object):
 
         for slice_ in gen_slice(purged):
             with mod_cursor(self._conn) as c:
+                if self.fts:
+                    c.execute(_DELETE_FTS_SQL % placeholders(slice_), slice_)
                 c.execute('DELETE FROM nodes WHERE id IN %s' % placeholders(slice_), slice_)
                 c.execute('DELETE FROM files WHERE id IN %s' % placeholders(slice_), slice_)
                 c.execute('DELETE FROM parentage WHERE parent IN %s' % placeholders(slice_), slice_)
                 c.execute('DELETE FROM parentage WHERE child IN %s' % placeholders(slice_), slice_)
                 c.execute('DELETE FROM labels WHERE id IN %s' % placeholders(slice_), slice_)
+                c.execute('DELETE FROM paths WHERE id IN %s' % placeholders(slice_), slice_)
+                generation = self._advance_generation(c)
+            self.path_cache.advance(*generation)
+            self.path_cache.invalidate(slice_)
 
         logger.info('Purged %i node(s).' % len(purged))
 
     def insert_nodes(self, nodes: list, partial=True):
-        """Inserts mixed list of files and folders into cache."""
-        files = []
+        """Inserts mixed list of files and folders into cache in a single transaction.
+        The rows are converted in one pass and written using :meth:`executemany`.
+        Sets the 'updated' column to the current date."""
+        updated = datetime.utcnow()
         folders = []
+        files = []
+        contents = []
+        parentage = []
         for node in nodes:
             if node['status'] == 'PENDING':
                 continue
@@ -58,88 +109,180 @@ class SyncMixin(object):
                 if not 'name' in node or not node['name']:
                     logger.warning('Skipping file %s because its name is empty.' % node['id'])
                     continue
-                files.append(node)
+                props = node.get('contentProperties', {})
+                files.append(_node_row(node, updated))
+                contents.append((node['id'], props.get('md5', 'd41d8cd98f00b204e9800998ecf8427e'),
+                                 props.get('size', 0)))
             elif kind == 'FOLDER':
                 if (not 'name' in node or not node['name']) \
                 and (not 'isRoot' in node or not node['isRoot']):
                     logger.warning('Skipping non-root folder %s because its name is empty.'
                                    % node['id'])
                     continue
-                folders.append(node)
-            elif kind != 'ASSET':
-                logger.warning('Cannot insert unknown node type "%s".' % kind)
-        self.insert_folders(folders)
-        self.insert_files(files)
-
-        self.insert_parentage(files + folders, partial)
+                folders.append(_node_row(node, updated))
+            else:
+                if kind != 'ASSET':
+                    logger.warning('Cannot insert unknown node type "%s".' % kind)
+                continue
+            parentage.extend((p, node['id']) for p in node['parents'])
 
-    def insert_node(self, node: dict):
-        """Inserts single file or folder into cache."""
-        if not node:
+        if not folders and not files:
             return
-        self.insert_nodes([node])
 
-    def insert_folders(self, folders: list):
-        """ Inserts list of folders into cache. Sets 'update' column to current date.
+        ids = [row[0] for row in folders + files]
+        fts = self.fts and not getattr(self.tl, 'bulk', False)
+        with mod_cursor(self._conn) as c:
+            # replaced rows get a new rowid, which keys the full-text index
+            if fts:
+                for slice_ in gen_slice(ids):
+                    c.execute(_DELETE_FTS_SQL % placeholders(slice_), slice_)
+            c.executemany(_INSERT_NODE_SQL % 'folder', folders)
+            c.executemany(_INSERT_NODE_SQL % 'file', files)
+            if fts:
+                for slice_ in gen_slice(ids):
+                    c.execute(_INSERT_FTS_SQL % placeholders(slice_), slice_)
+            c.executemany('INSERT OR REPLACE INTO files (id, md5, size) VALUES (?, ?, ?)',
+                          contents)
 
-        :param folders: list of raw dict-type folders"""
+            if partial:
+                for slice_ in gen_slice(ids):
+                    c.execute('DELETE FROM parentage WHERE child IN %s' % placeholders(slice_),
+                              slice_)
+            c.executemany('INSERT OR IGNORE INTO parentage VALUES (?, ?)', parentage)
 
-        if not folders:
-            return
+            if not getattr(self.tl, 'bulk', False):
+                self._update_paths(c, [(row[0], row[1]) for row in folders],
+                                   [(row[0], row[1]) for row in files])
+            generation = self._advance_generation(c)
 
-        with mod_cursor(self._conn) as c:
-            for f in folders:
-                c.execute(
-                    'INSERT OR REPLACE INTO nodes '
-                    '(id, type, name, description, created, modified, updated, status) '
-                    'VALUES (?, "folder", ?, ?, ?, ?, ?, ?)',
-                    [f['id'], f.get('name'), f.get('description'),
-                     iso_date.parse(f['createdDate']), iso_date.parse(f['modifiedDate']),
-                     datetime.utcnow(),
-                     f['status']
-                     ]
-                )
-
-        logger.info('Inserted/updated %d folder(s).' % len(folders))
-
-    def insert_files(self, files: list):
-        if not files:
-            return
+        self.path_cache.advance(*generation)
+        # moved nodes may still be cached under their old path, new ones may be cached as missing
+        self.path_cache.invalidate(ids)
+        names = dict((row[0], row[1]) for row in folders + files)
+        self.path_cache.invalidate_children(set((p, names[c]) for p, c in parentage))
 
+        logger.info('Inserted/updated %d folder(s) and %d file(s).' % (len(folders), len(files)))
+
+    def _advance_generation(self, c) -> 'Tuple[str|None, str]':
+        """Replaces the generation token within the modifying transaction. Once the transaction
+        has committed, the tokens are to be passed to :meth:`PathCache.advance`, which clears
+        the path cache if the previous token is not the one it knows, i.e. if another process
+        has modified the nodes in the meantime.
+
+        :param c: cursor of the modifying transaction, which already holds the write lock
+        :returns: previous and new token"""
+        c.execute('SELECT value FROM metadata WHERE key = ?', [GENERATION_KEY])
+        r = c.fetchone()
+        token = uuid.uuid4().hex
+        c.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?)', [GENERATION_KEY, token])
+        return r[0] if r else None, token
+
+    def _update_paths(self, c, folders: list, files: list):
+        """Updates the materialized paths of the inserted nodes and, if a folder's path
+        changed, those of its descendants.
+
+        :param c: cursor of the inserting transaction
+        :param folders: list of (id, name) tuples
+        :param files: list of (id, name) tuples"""
+
+        names = dict(folders + files)
+        ids = list(names)
+        first_parents = {}
+        old_paths = {}
+        for slice_ in gen_slice(ids):
+            c.execute('SELECT p.child, p.parent FROM parentage p JOIN nodes n ON n.id = p.parent '
+                      'WHERE p.child IN %s ORDER BY p.child, n.status DESC, n.id DESC'
+                      % placeholders(slice_), slice_)
+            # rows are in reverse order of preference, the last one wins
+            first_parents.update(c.fetchall())
+            c.execute('SELECT id, path FROM paths WHERE id IN %s' % placeholders(slice_), slice_)
+            old_paths.update(c.fetchall())
+
+        outer = list(set(first_parents.values()) - names.keys())
+        parent_paths = {}
+        for slice_ in gen_slice(outer):
+            c.execute('SELECT id, path FROM paths WHERE id IN %s' % placeholders(slice_), slice_)
+            parent_paths.update(c.fetchall())
+
+        paths = {}
+
+        def path_of(id, depth=0):
+            if id in paths:
+                return paths[id]
+            parent = first_parents.get(id)
+            if parent is None:
+                path = '/' if names[id] is None else None
+            elif parent in names and depth < len(names):
+                path = path_of(parent, depth + 1)
+            else:
+                path = parent_paths.get(parent)
+            if path is not None and parent is not None:
+                path = path.rstrip('/') + '/' + names[id]
+            paths[id] = path
+            return path
+
+        for id in ids:
+            path_of(id)
+
+        c.executemany('INSERT OR REPLACE INTO paths VALUES (?, ?)',
+                      [(id, path) for id, path in paths.items() if path is not None])
+        orphans = [id for id, path in paths.items() if path is None]
+        for slice_ in gen_slice(orphans):
+            c.execute('DELETE FROM paths WHERE id IN %s' % placeholders(slice_), slice_)
+
+        # includes new folders, as their children may have been inserted before them
+        moved = [id for id, _ in folders
+                 if paths[id] is not None and old_paths.get(id) != paths[id]]
+        # the paths of children that were inserted along with their parent are up to date
+        seeds = set()
+        for slice_ in gen_slice(moved):
+            c.execute('SELECT parent, child FROM parentage WHERE parent IN %s'
+                      % placeholders(slice_), slice_)
+            seeds.update(parent for parent, child in c.fetchall() if child not in names)
+        for slice_ in gen_slice(list(seeds)):
+            c.execute(SUBTREE_PATHS_SQL % ('SELECT id, path FROM paths WHERE id IN %s'
+                                           % placeholders(slice_)), slice_)
+
+    def rebuild_paths(self):
+        """Recreates the materialized paths of all nodes."""
         with mod_cursor(self._conn) as c:
-            for f in files:
-                c.execute('INSERT OR REPLACE INTO nodes '
-                          '(id, type, name, description, created, modified, updated, status)'
-                          'VALUES (?, "file", ?, ?, ?, ?, ?, ?)',
-                          [f['id'], f.get('name'), f.get('description'),
-                           iso_date.parse(f['createdDate']), iso_date.parse(f['modifiedDate']),
-                           datetime.utcnow(),
-                           f['status']
-                           ]
-                          )
-                c.execute('INSERT OR REPLACE INTO files (id, md5, size) VALUES (?, ?, ?)',
-                          [f['id'],
-                           f.get('contentProperties', {}).get('md5',
-                                                              'd41d8cd98f00b204e9800998ecf8427e'),
-                           f.get('contentProperties', {}).get('size', 0)
-                           ]
-                          )
-
-        logger.info('Inserted/updated %d file(s).' % len(files))
-
-    def insert_parentage(self, nodes: list, partial=True):
-        if not nodes:
+            c.execute('DELETE FROM paths')
+            c.execute(REBUILD_PATHS_SQL)
+            generation = self._advance_generation(c)
+        self.path_cache.advance(*generation)
+
+    def insert_node(self, node: dict):
+        """Inserts single file or folder into cache."""
+        if not node:
             return
+        self.insert_nodes([node])
 
-        if partial:
-            with mod_cursor(self._conn) as c:
-                for slice_ in gen_slice(nodes):
-                    c.execute('DELETE FROM parentage WHERE child IN %s' % placeholders(slice_),
-                              [n['id'] for n in slice_])
+    @contextmanager
+    def bulk_insert(self):
+        """Context manager for large insertions, e.g. full syncs. Disables synchronous writes,
+        drops the secondary indexes and suspends path materialization and full-text indexing;
+        indexes and paths are rebuilt on exit."""
 
+        with cursor(self._conn) as c:
+            c.execute('PRAGMA synchronous')
+            synchronous = c.fetchone()[0]
+        bulk = getattr(self.tl, 'bulk', False)
+        self._execute_pragma('synchronous', 'OFF')
         with mod_cursor(self._conn) as c:
-            for n in nodes:
-                for p in n['parents']:
-                    c.execute('INSERT OR IGNORE INTO parentage VALUES (?, ?)', [p, n['id']])
-
-        logger.info('Parented %d node(s).' % len(nodes))
+            for name, _ in _SECONDARY_INDEXES:
+                c.execute('DROP INDEX IF EXISTS %s' % name)
+        self.tl.bulk = True
+        try:
+            yield
+        finally:
+            self.tl.bulk = bulk
+            logger.info('Rebuilding indexes.')
+            with mod_cursor(self._conn) as c:
+                for name, on in _SECONDARY_INDEXES:
+                    c.execute('CREATE INDEX IF NOT EXISTS %s ON %s' % (name, on))
+            self.rebuild_paths()
+            if self.fts:
+                with mod_cursor(self._conn) as c:
+                    c.execute('DELETE FROM nodes_fts')
+                    c.execute(REBUILD_FTS_SQL)
+            self._execute_pragma('synchronous', synchronous)
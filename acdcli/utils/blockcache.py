@@ -0,0 +1,137 @@
+"""Persistent cache of file blocks"""
+
+import logging
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+_BLOCK_NAME_RE = re.compile(r'^([\w-]+)\.(\w+)\.(\d+)$')
+
+
+class BlockCache(object):
+    """Thread-safe on-disk cache of file blocks with least recently used eviction.
+    Each block is stored as a file named after the node ID, the MD5 hash of the node's content
+    and the block index, so that blocks of outdated content are never served. The recency of
+    use is persisted via the files' modification times."""
+
+    def __init__(self, path: str, max_size: int):
+        """:param path: directory the blocks are stored in, created if necessary
+        :param max_size: maximum total size of the stored blocks in bytes"""
+
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        """map block file name -> size, least recently used first"""
+        self._names_by_id = {}
+        self._lock = Lock()
+
+        os.makedirs(path, exist_ok=True)
+        entries = []
+        for name in os.listdir(path):
+            fn = os.path.join(path, name)
+            if not _BLOCK_NAME_RE.match(name):
+                # left over by an interrupted write
+                if name.startswith('.tmp'):
+                    self._remove_file(fn)
+                continue
+            st = os.stat(fn)
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._add(name, size)
+        self._evict()
+        logger.info('Block cache holds %i blocks (%i bytes).' % (len(self._blocks), self.size))
+
+    @staticmethod
+    def _name(id_: str, md5: str, index: int) -> str:
+        return '%s.%s.%i' % (id_, md5, index)
+
+    @staticmethod
+    def _remove_file(fn: str):
+        try:
+            os.remove(fn)
+        except OSError:
+            pass
+
+    def _add(self, name: str, size: int):
+        self._blocks[name] = size
+        self.size += size
+        self._names_by_id.setdefault(name.split('.', 1)[0], set()).add(name)
+
+    def _remove(self, name: str):
+        self.size -= self._blocks.pop(name)
+        id_ = name.split('.', 1)[0]
+        names = self._names_by_id[id_]
+        names.discard(name)
+        if not names:
+            del self._names_by_id[id_]
+        self._remove_file(os.path.join(self.path, name))
+
+    def _evict(self):
+        while self.size > self.max_size and self._blocks:
+            self._remove(next(iter(self._blocks)))
+
+    def get(self, id_: str, md5: str, index: int) -> 'Union[bytes, None]':
+        """:returns: the block's content or ``None`` if it is not cached"""
+
+        name = self._name(id_, md5, index)
+        with self._lock:
+            if name not in self._blocks:
+                self.misses += 1
+                return
+            self._blocks.move_to_end(name)
+            self.hits += 1
+        fn = os.path.join(self.path, name)
+        try:
+            with open(fn, 'rb') as f:
+                data = f.read()
+            os.utime(fn)
+        except OSError as e:
+            logger.warning('Error reading cached block "%s": %s' % (name, e))
+            with self._lock:
+                if name in self._blocks:
+                    self._remove(name)
+            return
+        return data
+
+    def put(self, id_: str, md5: str, index: int, data: bytes):
+        """Stores a block, evicting the least recently used blocks if necessary."""
+
+        if not md5 or len(data) > self.max_size:
+            return
+        name = self._name(id_, md5, index)
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(prefix='.tmp', dir=self.path)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.path, name))
+        except OSError as e:
+            logger.warning('Error caching block "%s": %s' % (name, e))
+            if tmp:
+                self._remove_file(tmp)
+            return
+        with self._lock:
+            if name in self._blocks:
+                self.size -= self._blocks.pop(name)
+            self._add(name, len(data))
+            self._evict()
+
+    def invalidate(self, id_: str, md5: str = None):
+        """Removes the blocks of a node whose content hash differs from *md5*
+        (all of the node's blocks if *md5* is ``None``)."""
+
+        with self._lock:
+            for name in list(self._names_by_id.get(id_, ())):
+                if md5 is None or name.split('.')[1] != md5:
+                    self._remove(name)
+
+    def info(self) -> dict:
+        """:returns: hit and miss counts, the number and total size of the cached blocks"""
+        return dict(hits=self.hits, misses=self.misses, blocks=len(self._blocks), size=self.size)
@@ -2,6 +2,7 @@ import time
 import sys
 from math import floor, log10
 from collections import deque
+from threading import Lock
 
 
 class FileProgress(object):
@@ -23,10 +24,13 @@ class FileProgress(object):
 
 
 class MultiProgress(object):
-    """Container that accumulates multiple FileProgress objects"""
+    """Container that accumulates multiple FileProgress objects.
+    Finished progresses are only kept as accumulated totals."""
 
     def __init__(self):
-        self._progresses = []
+        self._progresses = set()
+        self._lock = Lock()
+        self._finished = dict(total=0, current=0, items=0, complete=0, failed=0)
         self._last_inv = None
         self._last_prog = 0
         self._last_speeds = deque([0] * 10, 10)
@@ -34,18 +38,38 @@ class MultiProgress(object):
     def end(self):
         self.print_progress()
         print()
-        failed = sum(1 for s in self._progresses if s.status)
+        with self._lock:
+            failed = self._finished['failed'] + sum(1 for s in self._progresses if s.status)
         if failed:
             print('%d file(s) failed.' % failed)
 
     def add(self, progress: FileProgress):
-        self._progresses.append(progress)
+        with self._lock:
+            self._progresses.add(progress)
+
+    def finish(self, progress: FileProgress):
+        """Accumulates and drops a progress that will not change anymore."""
+        with self._lock:
+            if progress not in self._progresses:
+                return
+            self._progresses.remove(progress)
+            fin = self._finished
+            fin['total'] += progress.total
+            fin['current'] += progress.current
+            fin['items'] += 1
+            if progress.total <= progress.current:
+                fin['complete'] += 1
+            if progress.status:
+                fin['failed'] += 1
 
     def print_progress(self):
-        total = 0
-        current = 0
-        complete = 0
-        for p in self._progresses:
+        with self._lock:
+            progresses = list(self._progresses)
+            fin = dict(self._finished)
+        total = fin['total']
+        current = fin['current']
+        complete = fin['complete']
+        for p in progresses:
             total += p.total
             current += p.current
             if p.total <= p.current:
@@ -53,7 +77,7 @@ class MultiProgress(object):
 
         if current > total:
             total = current
-        self._print(total, current, len(self._progresses), complete)
+        self._print(total, current, fin['items'] + len(progresses), complete)
 
     def _print(self, total_sz: int, current_sz: int, total_items: int, done: int):
         """Prints a line that includes a progress bar, total and current transfer size,
@@ -76,7 +100,7 @@ class MultiProgress(object):
         percentage = round(rate * 100, ndigits=2) if rate <= 1 else 100
         completed = "#" * int(percentage / 4)
         spaces = " " * (25 - len(completed))
-        item_width = floor(log10(total_items))
+        item_width = floor(log10(total_items)) if total_items else 0
         sys.stdout.write('[%s%s] %s%% of %s  %s/%d %s  %s\x1b[K\r'
                          % (completed, spaces, ('%3.1f' % percentage).rjust(5),
                             (file_size_str(total_sz)).rjust(7),
@@ -1,28 +1,74 @@
 import time
 import logging
-import queue
-from threading import Thread, Event, Lock
+import heapq
+from threading import Thread, Condition
 
 from . import progress
 
 _logger = logging.getLogger(__name__)
 
 
+def largest_first(size: int, seq: int):
+    """Scheduling policy that runs the jobs for the largest files first."""
+    return -size, seq
+
+
+def in_order(size: int, seq: int):
+    """Scheduling policy that runs the jobs in the order they were added."""
+    return seq
+
+
+POLICIES = {'largest': largest_first, 'fifo': in_order}
+
+
 class QueuedLoader(object):
-    """Multi-threaded loader intended for file transfer jobs."""
+    """Multi-threaded loader intended for file transfer jobs.
+
+    Jobs are split into a lane of small and a lane of large files, each ordered by the
+    scheduling policy. A quarter of the workers (at least one) prefer the large lane, the
+    others the small lane; a worker whose lane is empty takes jobs from the other lane.
+    Jobs that are to be retried are requeued after a delay, so that they do not block a worker.
+
+    Jobs may be added while the workers run, e.g. by a producer traversing a directory tree.
+    If the number of queued jobs is bounded, adding a job waits until there is room, so that
+    the policy orders the queued jobs only."""
 
     MAX_NUM_WORKERS = 8
     MAX_RETRIES = 4
     REFRESH_PROGRESS_INT = 0.3
-
-    def __init__(self, workers=1, print_progress=True, max_retries=0):
-        self.workers = min(abs(workers), self.MAX_NUM_WORKERS)
-        self.q = queue.Queue()
+    LARGE_FILE_SIZE = 100 * 1024 ** 2
+    RETRY_DELAY = 5
+
+    def __init__(self, workers=1, print_progress=True, max_retries=0,
+                 max_workers=MAX_NUM_WORKERS, policy=largest_first,
+                 large_file_size=LARGE_FILE_SIZE, retry_delay=RETRY_DELAY, max_queued=0):
+        """:param max_workers: maximum number of workers
+        :param policy: function of a job's file size and sequence number that returns the
+           job's priority, lower values are run first
+        :param large_file_size: minimum file size of the jobs in the large lane [bytes]
+        :param retry_delay: delay before a failed job is retried [seconds]
+        :param max_queued: maximum number of queued jobs, 0 for no limit"""
+
+        self.workers = max(1, min(abs(workers), max_workers))
         self.halt = False
         self.exit_stat = 0
-        self.stat_lock = Lock()
         self.print_progress = print_progress
         self.retries = min(abs(max_retries), self.MAX_RETRIES)
+        self.policy = policy
+        self.large_file_size = large_file_size
+        self.retry_delay = retry_delay
+        self.max_queued = max_queued
+
+        self.cond = Condition()
+        self.lanes = ([], [])
+        """heaps of (priority, sequence number, tries, job) of small and large files"""
+        self.delayed = []
+        """heap of (due time, sequence number, tries, job) of the jobs to be retried"""
+        self.seq = 0
+        self.unfinished = 0
+        """number of jobs that are queued, delayed or running"""
+        self.producing = False
+        """whether the producer may add jobs"""
 
         self.mp = progress.MultiProgress()
 
@@ -32,35 +78,107 @@ class QueuedLoader(object):
             time.sleep(self.REFRESH_PROGRESS_INT)
         self.mp.end()
 
+    def _push(self, tries: int, job):
+        """Queues a job into its lane. Must be called holding the condition."""
+
+        h = job.keywords.get('pg_handler')
+        size = h.total if h else 0
+        lane = self.lanes[size >= self.large_file_size]
+        heapq.heappush(lane, (self.policy(size, self.seq), self.seq, tries, job))
+        self.seq += 1
+        self.cond.notify_all()
+
+    def _next(self, lane: int) -> 'Union[tuple, None]':
+        """Waits for the next due job, preferring the given lane.
+
+        :returns: (tries, job) or ``None`` if the loader halted"""
+
+        with self.cond:
+            while not self.halt:
+                now = time.time()
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, _, tries, job = heapq.heappop(self.delayed)
+                    self._push(tries, job)
+
+                for l in (self.lanes[lane], self.lanes[not lane]):
+                    if l:
+                        _, _, tries, job = heapq.heappop(l)
+                        # wake a producer waiting for room
+                        self.cond.notify_all()
+                        return tries, job
+
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                self.cond.wait(timeout)
+
     def _worker_task(self, num: int):
+        lane = int(num < max(1, self.workers // 4))
         while True:
-            try_ = 0
-            f = self.q.get()
-            while try_ <= self.retries:
-                rr = f()
-                if not rr.retry:
-                    break
-                try_ += 1
-
-            with self.stat_lock:
+            next_ = self._next(lane)
+            if not next_:
+                return
+            tries, job = next_
+            rr = job()
+
+            with self.cond:
+                if rr.retry and tries < self.retries:
+                    heapq.heappush(self.delayed,
+                                   (time.time() + self.retry_delay, self.seq, tries + 1, job))
+                    self.seq += 1
+                    self.cond.notify_all()
+                    continue
                 self.exit_stat |= rr.ret_val
-            self.q.task_done()
+                self.unfinished -= 1
+                self.cond.notify_all()
+            self.mp.finish(job.keywords.get('pg_handler'))
+
+    def _queued(self) -> int:
+        return len(self.lanes[0]) + len(self.lanes[1])
+
+    def add_job(self, job):
+        """Queues a job, waiting while the queue is full.
+
+        :param job: partial that returns a RetryRetVal and has a pg_handler kwarg"""
+
+        self.mp.add(job.keywords.get('pg_handler'))
+        with self.cond:
+            self.cond.wait_for(lambda: not self.max_queued or self._queued() < self.max_queued)
+            self.unfinished += 1
+            self._push(0, job)
 
     def add_jobs(self, jobs: list):
         """:param jobs: list of partials that return a RetryRetVal and have a pg_handler kwarg"""
         for job in jobs:
-            h = job.keywords.get('pg_handler')
-            self.mp.add(h)
-            self.q.put(job)
-
-    def start(self) -> int:
+            self.add_job(job)
+
+    def _produce(self, producer: 'Callable'):
+        ret_val = 1
+        try:
+            ret_val = producer() or 0
+        except:
+            _logger.exception('Creating jobs failed.')
+        finally:
+            with self.cond:
+                self.exit_stat |= ret_val
+                self.producing = False
+                self.cond.notify_all()
+
+    def start(self, producer: 'Callable' = None) -> int:
         """Starts worker threads and, if applicable, progress printer thread.
+
+        :param producer: function that adds jobs while the workers run, e.g. using
+           :meth:`add_job`, and returns a return value
         :returns: accumulated return value"""
 
-        _logger.info('%d jobs in queue.' % self.q.qsize())
+        _logger.info('%d jobs in queue.' % self.unfinished)
+
+        if producer:
+            self.producing = True
+            t = Thread(target=self._produce, args=(producer,), name='producer')
+            t.daemon = True
+            t.start()
 
         p = None
-        print_progress = self.print_progress and self.q.qsize() > 0
+        print_progress = self.print_progress and (self.unfinished > 0 or producer)
         if print_progress:
             p = Thread(target=self._print_prog)
             p.daemon = True
@@ -71,8 +189,10 @@ class QueuedLoader(object):
             t.daemon = True
             t.start()
 
-        self.q.join()
-        self.halt = True
+        with self.cond:
+            self.cond.wait_for(lambda: not self.unfinished and not self.producing)
+            self.halt = True
+            self.cond.notify_all()
         if p:
             p.join()
 
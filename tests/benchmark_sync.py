@@ -0,0 +1,47 @@
+"""Benchmark of bulk node insertion into the cache.
+Run as ``python -m tests.benchmark_sync [node count]``."""
+
+import sys
+import tempfile
+import time
+
+from acdcli.cache import db
+from .test_helper import gen_folder, gen_file
+
+
+def gen_changeset(count: int) -> list:
+    root = gen_folder()
+    folders = [root]
+    for _ in range(count // 10):
+        folders.append(gen_folder(folders))
+    files = [gen_file(folders) for _ in range(count - len(folders))]
+    return folders + files
+
+
+def benchmark(count: int, bulk: bool) -> float:
+    """:returns: inserted rows per second"""
+    with tempfile.TemporaryDirectory() as path:
+        cache = db.NodeCache(path)
+        nodes = gen_changeset(count)
+
+        start = time.time()
+        if bulk:
+            with cache.bulk_insert():
+                cache.insert_nodes(nodes, partial=False)
+        else:
+            cache.insert_nodes(nodes, partial=False)
+        elapsed = time.time() - start
+
+        assert cache.get_node_count() == count
+        return count / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6
+    for bulk in (False, True):
+        print('%s insertion of %i nodes: %.0f rows/s'
+              % ('bulk' if bulk else 'regular', count, benchmark(count, bulk)))
+
+
+if __name__ == '__main__':
+    main()
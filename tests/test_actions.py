@@ -3,6 +3,7 @@ from mock import patch, mock_open, MagicMock, sentinel
 import os
 import sys
 import json
+import re
 import httpretty
 
 import acd_cli
@@ -76,6 +77,88 @@ class ActionTestCase(unittest.TestCase):
         self.assertEqual(run_main(), None)
         self.assertEqual(len(print_.mock_calls), 100)
 
+    # sync actions
+
+    @httpretty.activate
+    @patch('sys.stdout.write')
+    def testOldSync(self, print_):
+        root = gen_folder()
+        folders = [root] + [gen_folder([root]) for _ in range(3)]
+        files = [gen_file(folders) for _ in range(450)]
+        listings = {'kind:FOLDER': [n for n in folders if n['status'] == 'AVAILABLE'],
+                    'status:TRASH AND kind:FOLDER': [n for n in folders if n['status'] == 'TRASH'],
+                    'kind:FILE': [n for n in files if n['status'] == 'AVAILABLE'],
+                    'status:TRASH AND kind:FILE': [n for n in files if n['status'] == 'TRASH']}
+
+        def serve_page(request, uri, headers):
+            nodes = listings[request.querystring['filters'][0]]
+            start = int(request.querystring.get('startToken', ['0'])[0])
+            page = {'data': nodes[start:start + 200], 'count': len(nodes)}
+            if start + 200 < len(nodes):
+                page['nextToken'] = str(start + 200)
+            return [200, headers, json.dumps(page)]
+
+        httpretty.register_uri(httpretty.GET,
+                               'https://cdws.us-east-1.amazonaws.com/drive/v1/nodes',
+                               body=serve_page)
+        sys.argv.append('old-sync')
+        self.assertEqual(run_main(), None)
+        cache = db.NodeCache(cache_path)
+        self.assertEqual(cache.get_node_count(), len(folders) + len(files))
+        self.assertEqual(cache.get_root_node().id, root['id'])
+
+    @httpretty.activate
+    @patch('sys.stdout.write')
+    def testPartialSyncRecursive(self, print_):
+        root = gen_folder()
+        a, b = gen_folder([root]), gen_folder([root])
+        a1 = gen_folder([a])
+        for folder in (a, b, a1):
+            folder['status'] = 'AVAILABLE'
+            folder['parents'] = [root['id'] if folder is not a1 else a['id']]
+        children = {root['id']: [a, b], a['id']: [a1] + [gen_file([a]) for _ in range(3)],
+                    b['id']: [gen_file([b]) for _ in range(2)], a1['id']: []}
+        listed = []
+
+        def serve_children(request, uri, headers):
+            folder_id = uri.split('/')[-2]
+            listed.append(folder_id)
+            return [200, headers, json.dumps({'data': children[folder_id],
+                                              'count': len(children[folder_id])})]
+
+        url = 'https://cdws.us-east-1.amazonaws.com/drive/v1/nodes/'
+        httpretty.register_uri(httpretty.GET, url + root['id'], body=json.dumps(root))
+        httpretty.register_uri(httpretty.GET, re.compile(re.escape(url) + r'[^/]+/children'),
+                               body=serve_children)
+        self.cache.insert_nodes([root])
+
+        sys.argv.extend(['psync', '-r', '-x', '3', '/'])
+        self.assertEqual(run_main(), None)
+        self.assertEqual(sorted(listed), sorted(children))
+        self.assertEqual(db.NodeCache(cache_path).get_node_count(), 9)
+
+        b['modifiedDate'] = '2016-01-01T00:00:00.000Z'
+        del listed[:]
+        reload(acd_cli)
+        sys.argv = [acd_cli._app_name, '-nw', 'psync', '-r', '-u', '/']
+        self.assertEqual(run_main(), None)
+        self.assertEqual(sorted(listed), sorted([root['id'], b['id']]))
+
+    def testAutosyncStats(self):
+        stop = acd_cli.Event()
+        stats = {}
+
+        def sync(full, stats):
+            stats['nodes'] += 3
+            stop.set()
+            return acd_cli.ERROR_RETVAL
+
+        with patch('acd_cli.sync_node_list', side_effect=sync):
+            acd_cli.autosync(1, stop=stop, stats=stats)
+        self.assertEqual(stats['interval'], acd_cli.MIN_SYNC_INTERVAL)
+        self.assertEqual((stats['syncs'], stats['failed'], stats['nodes']), (1, 1, 3))
+        self.assertGreaterEqual(stats['total_duration'], stats['last_duration'])
+
     # find actions
 
     # transfer actions
@@ -6,6 +6,7 @@ from mock import patch, mock_open, MagicMock
 import logging
 import os
 import json
+import tempfile
 import time
 
 import acdcli.api.oauth as oauth
@@ -23,7 +24,7 @@ path = os.path.join(os.path.dirname(__file__), 'dummy_files')
 class APITestCase(unittest.TestCase):
     def setUp(self):
         self.acd = ACDClient(path)
-        self.acd.BOReq._wait = lambda: None
+        self.acd.BOReq._wait = lambda *args: None
 
     def testMetadataUrl(self):
         self.assertEqual(self.acd.metadata_url, 'https://cdws.us-east-1.amazonaws.com/drive/v1/')
@@ -81,6 +82,69 @@ class APITestCase(unittest.TestCase):
         httpretty.register_uri(httpretty.GET, self.acd.metadata_url + 'account/usage', body='{}')
         self.assertEqual(str(self.acd.get_account_usage()), '')
 
+    #
+    # connections
+    #
+
+    @httpretty.activate
+    def testConnectionPools(self):
+        httpretty.register_uri(httpretty.GET, self.acd.metadata_url + 'account/usage', body='{}')
+        for _ in range(3):
+            self.acd.get_account_usage()
+        stats = self.acd.BOReq.connection_stats()
+        self.assertEqual(stats[self.acd.metadata_url]['requests'], 3)
+        self.assertEqual(stats[self.acd.content_url]['requests'], 0)
+
+    def testThreadSessions(self):
+        from threading import Thread
+        self.acd.BOReq.thread_sessions = True
+        sessions = []
+        t = Thread(target=lambda: sessions.append(self.acd.BOReq._session))
+        t.start()
+        t.join()
+        self.assertIsNot(sessions[0], self.acd.BOReq._session)
+        self.assertIs(self.acd.BOReq._session, self.acd.BOReq._session)
+
+    @httpretty.activate
+    def testBackoffPerEndpoint(self):
+        node_id = gen_rand_id()
+        httpretty.register_uri(httpretty.GET, self.acd.metadata_url + 'nodes/' + node_id,
+                               status=500)
+        httpretty.register_uri(httpretty.GET, self.acd.metadata_url + 'account/usage',
+                               status=503)
+        httpretty.register_uri(httpretty.GET, self.acd.content_url + 'nodes/' + node_id,
+                               body='{}')
+
+        with self.assertRaises(RequestError):
+            self.acd.get_metadata(node_id)
+        with self.assertRaises(RequestError):
+            self.acd.get_account_usage()
+        stats = self.acd.BOReq.backoff_stats()
+        self.assertEqual(stats['metadata']['failed_nodes'], {node_id: 1})
+        self.assertEqual(stats['metadata']['retries'], 1)
+        self.assertEqual(stats['metadata']['rate'], 16)
+        self.assertEqual(stats['metadata']['throttled'], 1)
+        self.assertEqual(stats['content']['retries'], 0)
+        self.assertIsNone(stats['content']['rate'])
+
+        self.acd.BOReq.get(self.acd.content_url + 'nodes/' + node_id)
+        self.assertEqual(self.acd.BOReq.backoff_stats()['content']['failed_nodes'], {})
+
+    def testAdaptiveRate(self):
+        from acdcli.api.backoff_req import _Endpoint
+        e = _Endpoint('test', max_rate=0, throttled_rate=4, min_rate=1)
+        self.assertEqual(e.reserve(), 0)
+        e.failed(None, throttled=True)
+        self.assertEqual(e.rate, 4)
+        self.assertGreater(e.reserve(), 0)
+        e.failed(None, throttled=True)
+        e.failed(None, throttled=True)
+        e.failed(None, throttled=True)
+        self.assertEqual(e.rate, 1)
+        while e.rate:
+            e.succeeded(None)
+        self.assertEqual(e.reserve(), 0)
+
     #
     # metadata
     #
@@ -123,6 +187,217 @@ class APITestCase(unittest.TestCase):
             tmp = self.acd.get_changes()
             [cs for cs in self.acd._iter_changes_lines(tmp)]
 
+    @httpretty.activate
+    def testStreamedChanges(self):
+        httpretty.register_uri(httpretty.POST, self.acd.metadata_url + 'changes',
+                               body='{"checkpoint": "foo", "reset": true, '
+                                    '"nodes": [ {"kind": "FILE", "status": "TRASH"}, '
+                                    '{"id": "bar", "status": "PURGED"}, '
+                                    '{"kind": "FOLDER", "status": "AVAILABLE"} ], '
+                                    '"statusCode": 200}\n'
+                                    '{"checkpoint": "baz", "reset": false, "nodes": [], '
+                                    '"statusCode": 200}\n'
+                                    '{"end": true}')
+        self.acd._conf['changes']['batch_size'] = '2'
+        changesets = [c for c in self.acd.iter_changes()]
+        self.assertEqual([len(c.nodes) for c in changesets], [1, 1, 0])
+        self.assertEqual(changesets[0].purged_nodes, ['bar'])
+        self.assertEqual([c.checkpoint for c in changesets], [None, 'foo', 'baz'])
+        self.assertEqual([c.reset for c in changesets], [True, False, False])
+
+    def testChangesStreamChunks(self):
+        page = b'{"nodes": [{"name": "\xc3\xa4", "status": "AVAILABLE"}, ' \
+               b'{"size": 12345, "status": "AVAILABLE"}], "statusCode": 200, ' \
+               b'"reset": true, "checkpoint": "foo"}\n{"end": true}\n'
+        chunks = (page[i:i + 1] for i in range(len(page)))
+        changesets = [c for c in self.acd._iter_changes_stream(chunks, 10)]
+        self.assertEqual(len(changesets), 1)
+        self.assertEqual(changesets[0].nodes, [{'name': '\xe4', 'status': 'AVAILABLE'},
+                                               {'size': 12345, 'status': 'AVAILABLE'}])
+        self.assertTrue(changesets[0].reset)
+        self.assertEqual(changesets[0].checkpoint, 'foo')
+
+    @httpretty.activate
+    def testStreamedChangesCorruptJSON(self):
+        httpretty.register_uri(httpretty.POST, self.acd.metadata_url + 'changes',
+                               body='{"checkpoint": "foo", "reset": true, "nodes": [{"status": ')
+        with self.assertRaises(RequestError):
+            [cs for cs in self.acd.iter_changes()]
+
+    def _register_node_pages(self, listings: dict):
+        """:param listings: filter -> list of pages"""
+        def serve_page(request, uri, headers):
+            pages = listings[request.querystring['filters'][0]]
+            i = int(request.querystring.get('startToken', ['0'])[0])
+            page = {'data': pages[i], 'count': sum(len(p) for p in pages)}
+            if i + 1 < len(pages):
+                page['nextToken'] = str(i + 1)
+            return [200, headers, json.dumps(page)]
+
+        httpretty.register_uri(httpretty.GET, self.acd.metadata_url + 'nodes', body=serve_page)
+
+    @httpretty.activate
+    def testIterNodePages(self):
+        listings = {'kind:FOLDER': [[{'id': 'a'}, {'id': 'b'}], [{'id': 'c'}]],
+                    'kind:FILE': [[{'id': 'd'}], [{'id': 'e'}], [{'id': 'f'}]],
+                    'kind:ASSET': [[]]}
+        self._register_node_pages(listings)
+        self.acd._conf['changes']['page_queue_size'] = '1'
+
+        pages = [p for p in self.acd.iter_node_pages(*listings)]
+        self.assertEqual(len(pages), 6)
+        self.assertEqual(sorted(n['id'] for p in pages for n in p), list('abcdef'))
+        self.assertEqual(len(self.acd.get_file_list()), 3)
+
+    @httpretty.activate
+    def testIterNodePagesError(self):
+        httpretty.register_uri(httpretty.GET, self.acd.metadata_url + 'nodes', status=400)
+        with self.assertRaises(RequestError):
+            [p for p in self.acd.iter_node_pages('kind:FOLDER', 'kind:FILE')]
+
+    #
+    # content
+    #
+
+    def _register_ranged_content(self, node_id: str, content: bytes, served: list = None):
+        def serve_range(request, uri, headers):
+            start, end = request.headers['Range'][len('bytes='):].split('-')
+            if int(start) >= len(content):
+                return [416, headers, b'']
+            body = content[int(start):int(end) + 1]
+            if served is not None:
+                served.append(len(body))
+            headers['content-length'] = str(len(body))
+            return [206, headers, body]
+
+        httpretty.register_uri(httpretty.GET, self.acd.content_url + 'nodes/' + node_id + '/content',
+                               body=serve_range)
+
+    @httpretty.activate
+    def testSegmentedDownload(self):
+        import hashlib
+        import tempfile
+
+        content = os.urandom(100000)
+        node_id = gen_rand_id()
+        self._register_ranged_content(node_id, content)
+        self.acd._conf['transfer']['dl_min_segment_size'] = '1000'
+        self.acd._conf['transfer']['fs_chunk_size'] = '4096'
+
+        hasher = hashlib.md5()
+        with tempfile.TemporaryDirectory() as dir_:
+            self.acd.download_file(node_id, 'file', dir_, length=len(content), segments=7,
+                                   write_callbacks=[hasher.update])
+            with open(os.path.join(dir_, 'file'), 'rb') as f:
+                self.assertEqual(f.read(), content)
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(content).hexdigest())
+
+    @httpretty.activate
+    def testJournaledResume(self):
+        import hashlib
+        import tempfile
+        from acdcli.api.content import _RangeMap, PARTIAL_SUFFIX, JOURNAL_SUFFIX
+
+        content = os.urandom(90000)
+        node_id = gen_rand_id()
+        served = []
+        self._register_ranged_content(node_id, content, served)
+
+        hasher = hashlib.md5()
+        with tempfile.TemporaryDirectory() as dir_:
+            path = os.path.join(dir_, 'file')
+            with open(path + PARTIAL_SUFFIX, 'wb') as f:
+                f.write(content[:30000] + bytes(30000) + content[60000:])
+            _RangeMap([(0, 30000), (60000, 90000)]).save(path + JOURNAL_SUFFIX,
+                                                         node_id, len(content))
+
+            self.acd.download_file(node_id, 'file', dir_, length=len(content),
+                                   write_callbacks=[hasher.update])
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+            self.assertFalse(os.path.exists(path + JOURNAL_SUFFIX))
+        self.assertEqual(sum(served), 30000)
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(content).hexdigest())
+
+    @httpretty.activate
+    def testUnknownLengthResume(self):
+        import hashlib
+        import tempfile
+        from acdcli.api.content import PARTIAL_SUFFIX
+
+        content = os.urandom(50000)
+        node_id = gen_rand_id()
+        served = []
+        self._register_ranged_content(node_id, content, served)
+        self.acd._conf['transfer']['fs_chunk_size'] = '4096'
+
+        hasher = hashlib.md5()
+        with tempfile.TemporaryDirectory() as dir_:
+            path = os.path.join(dir_, 'file')
+            with open(path + PARTIAL_SUFFIX, 'wb') as f:
+                f.write(content[:20000])
+
+            self.acd.download_file(node_id, 'file', dir_, write_callbacks=[hasher.update])
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+        self.assertEqual(sum(served), 50000 - 20000 + 4096 + 1)
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(content).hexdigest())
+
+    def testRangeMap(self):
+        from acdcli.api.content import _RangeMap
+
+        m = _RangeMap([(10, 20), (30, 40)])
+        self.assertEqual(m.gaps(50), [(0, 10), (20, 30), (40, 50)])
+        m.add(15, 35)
+        self.assertEqual(m.gaps(50), [(0, 10), (40, 50)])
+        self.assertEqual(m.end_of(12), 40)
+        self.assertEqual(m.end_of(5), 5)
+        m.add(0, 10)
+        m.add(40, 50)
+        self.assertEqual(m.gaps(50), [])
+        self.assertEqual(m.size(), 50)
+
+    @httpretty.activate
+    def testPipelinedUpload(self):
+        import hashlib
+        import tempfile
+        from acdcli.utils.hashing import IncrementalHasher
+
+        content = os.urandom(300000)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+
+        received = []
+
+        def receive(request, uri, headers):
+            received.append(request.body)
+            return 201, headers, json.dumps({'id': gen_rand_id()})
+
+        httpretty.register_uri(httpretty.POST, self.acd.content_url + 'nodes', body=receive)
+
+        hasher = IncrementalHasher()
+        self.acd._conf['transfer']['ul_buffers'] = '2'
+        self.acd.upload_file(f.name, read_callbacks=[hasher.update])
+        self.assertEqual(hasher.get_result(), hashlib.md5(content).hexdigest())
+        self.assertIn(content, received[0])
+
+    def testPipelinedReaderCallbackError(self):
+        import tempfile
+        from acdcli.api.content import _PipelinedReader
+
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(os.urandom(10000))
+        self.addCleanup(os.remove, f.name)
+
+        def fail(chunk):
+            raise ValueError
+
+        r = _PipelinedReader(f.name, 4096, 2, [fail])
+        with self.assertRaises(ValueError):
+            r.read(4096)
+        r.close()
+
     #
     # oauth
     #
@@ -140,8 +415,8 @@ class APITestCase(unittest.TestCase):
         exp_token = {'access_token': '', 'expires_in': 3600, 'exp_time': 0.0, 'refresh_token': ''}
 
         mock_file = mock_open(read_data=json.dumps(exp_token))
-        os.path.isfile = MagicMock()
-        with patch('builtins.open', mock_file, create=True):
+        with patch('os.path.isfile', MagicMock()), \
+                patch('builtins.open', mock_file, create=True):
             with patch('os.fsync', MagicMock):
                 with patch('os.rename', MagicMock):
                     h = oauth.AppspotOAuthHandler('')
@@ -151,6 +426,58 @@ class APITestCase(unittest.TestCase):
         self.assertGreater(h.oauth_data[oauth.OAuthHandler.KEYS.EXP_TIME], time.time())
         mock_file().write.assert_any_call(str(h.oauth_data[oauth.AppspotOAuthHandler.KEYS.EXP_TIME]))
 
+    @httpretty.activate
+    def testOAuthProactiveRefresh(self):
+        httpretty.register_uri(httpretty.POST, oauth.AppspotOAuthHandler.APPSPOT_URL,
+                               body=json.dumps(self.dummy_token))
+        expiring = dict(self.dummy_token, access_token='old', exp_time=time.time() + 30)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            oauth_path = os.path.join(tmp, oauth.OAuthHandler.OAUTH_DATA_FILE)
+            with open(oauth_path, 'w') as f:
+                json.dump(expiring, f)
+            h = oauth.AppspotOAuthHandler(tmp)
+            h.stop_refresher()
+
+            r = MagicMock(headers={})
+            h(r)
+            self.assertEqual(r.headers['Authorization'], 'Bearer old')
+            self.assertEqual(h._refresh_delay(), 0)
+
+            h._proactive_refresh()
+            h(r)
+            self.assertEqual(r.headers['Authorization'], 'Bearer foo')
+            self.assertGreater(h._refresh_delay(), 0)
+            with open(oauth_path) as f:
+                self.assertEqual(json.load(f)['access_token'], 'foo')
+
+            # another instance updates the oauth file
+            with open(oauth_path, 'w') as f:
+                json.dump(dict(self.dummy_token, access_token='baz'), f)
+            os.utime(oauth_path, (time.time() + 10, time.time() + 10))
+            h._proactive_refresh()
+            h(r)
+            self.assertEqual(r.headers['Authorization'], 'Bearer baz')
+
+    def testOAuthRefresherForcedRestart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, oauth.OAuthHandler.OAUTH_DATA_FILE), 'w') as f:
+                json.dump(dict(self.dummy_token, exp_time=time.time() + 3600), f)
+            h = oauth.AppspotOAuthHandler(tmp)
+            old, old_stop = h._refresher, h._stop
+
+            h.start_refresher()
+            self.assertIs(h._refresher, old)
+
+            # after a fork, the thread is gone but its Thread object looks alive
+            h.start_refresher(force=True)
+            self.assertIsNot(h._refresher, old)
+            self.assertTrue(old_stop.is_set())
+            self.assertTrue(h._refresher.is_alive())
+            h.stop_refresher()
+            h._refresher.join(1)
+            self.assertFalse(h._refresher.is_alive())
+
     def testOAuthLocalRefresh(self):
         # TODO: find out how to mock multiple files
         pass
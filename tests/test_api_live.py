@@ -49,7 +49,7 @@ print(sys.argv)
 class APILiveTestCase(unittest.TestCase):
     def setUp(self):
         self.acd_client = client.ACDClient(path)
-        self.acd_client.BOReq._wait = lambda: None
+        self.acd_client.BOReq._wait = lambda *args: None
         self.assertTrue(os.path.isfile(os.path.join(path, 'oauth_data')))
         self.assertTrue(os.path.isfile(os.path.join(path, 'endpoint_data')))
 
@@ -62,7 +62,7 @@ class APILiveTestCase(unittest.TestCase):
 
     def test_back_off_error(self):
         self.acd_client.BOReq.get(self.acd_client.content_url)
-        self.assertEqual(self.acd_client.BOReq._BackOffRequest__retries, 1)
+        self.assertEqual(self.acd_client.BOReq.backoff_stats()['content']['retries'], 1)
 
     #
     # account.py
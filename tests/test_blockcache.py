@@ -0,0 +1,63 @@
+import os
+import tempfile
+import time
+import unittest
+
+from acdcli.utils.blockcache import BlockCache
+from .test_helper import gen_rand_id, gen_rand_md5
+
+
+class BlockCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = self.dir.name
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testGetPut(self):
+        cache = BlockCache(self.path, 1024)
+        id_, md5 = gen_rand_id(), gen_rand_md5()
+        self.assertIsNone(cache.get(id_, md5, 0))
+        cache.put(id_, md5, 0, b'foo')
+        self.assertEqual(cache.get(id_, md5, 0), b'foo')
+        self.assertIsNone(cache.get(id_, md5, 1))
+        self.assertIsNone(cache.get(id_, gen_rand_md5(), 0))
+        self.assertEqual(cache.info(), dict(hits=1, misses=3, blocks=1, size=3))
+
+    def testEviction(self):
+        cache = BlockCache(self.path, 300)
+        id_, md5 = gen_rand_id(), gen_rand_md5()
+        for i in range(3):
+            cache.put(id_, md5, i, bytes(100))
+        cache.get(id_, md5, 0)
+        cache.put(id_, md5, 3, bytes(100))
+        self.assertIsNone(cache.get(id_, md5, 1))
+        for i in (0, 2, 3):
+            self.assertIsNotNone(cache.get(id_, md5, i))
+        self.assertEqual(len(os.listdir(self.path)), 3)
+
+    def testInvalidate(self):
+        cache = BlockCache(self.path, 1024)
+        id_, old, new = gen_rand_id(), gen_rand_md5(), gen_rand_md5()
+        cache.put(id_, old, 0, b'foo')
+        cache.put(id_, new, 0, b'bar')
+        cache.invalidate(id_, new)
+        self.assertIsNone(cache.get(id_, old, 0))
+        self.assertEqual(cache.get(id_, new, 0), b'bar')
+        cache.invalidate(id_)
+        self.assertEqual(cache.info()['size'], 0)
+        self.assertEqual(os.listdir(self.path), [])
+
+    def testPersistence(self):
+        cache = BlockCache(self.path, 200)
+        id_, md5 = gen_rand_id(), gen_rand_md5()
+        cache.put(id_, md5, 0, bytes(100))
+        cache.put(id_, md5, 1, bytes(100))
+        os.utime(os.path.join(self.path, '%s.%s.0' % (id_, md5)), (time.time() + 10,) * 2)
+
+        cache = BlockCache(self.path, 200)
+        self.assertEqual(cache.info()['blocks'], 2)
+        cache.put(id_, md5, 2, bytes(100))
+        self.assertIsNone(cache.get(id_, md5, 1))
+        self.assertIsNotNone(cache.get(id_, md5, 0))
@@ -1,5 +1,6 @@
 import unittest
 import os
+from threading import Thread
 
 from acdcli.cache import db, schema
 from .test_helper import gen_file, gen_folder, gen_bunch_of_nodes
@@ -97,3 +98,249 @@ class CacheTestCase(unittest.TestCase):
         self.cache.insert_nodes(folders + files)
         ttlsz = sum(f['contentProperties']['size'] for f in files)
         self.assertEqual(self.cache.calculate_usage(), ttlsz)
+
+    def testISODateConversion(self):
+        from acdcli.cache.sync import iso_to_db_date
+        import dateutil.parser as iso_date
+
+        for date in ['2015-01-01T00:00:00.00Z', '2015-01-01T00:00:00Z',
+                     '2015-07-19T12:34:56.789Z', '2015-07-19T12:34:56.000001Z',
+                     '2015-07-19T12:34:56+00:00']:
+            self.assertEqual(iso_to_db_date(date), str(iso_date.parse(date)))
+
+    def testBulkInsert(self):
+        folders, files = gen_bunch_of_nodes(50)
+        with self.cache.bulk_insert():
+            self.cache.insert_nodes(folders + files, partial=False)
+        self.assertEqual(self.cache.get_node_count(), 50)
+        self.assertEqual(self.cache.get_node(files[0]['id']).name, files[0]['name'])
+
+        with db.cursor(self.cache._conn) as c:
+            c.execute('PRAGMA synchronous')
+            self.assertEqual(c.fetchone()[0], 2)
+            c.execute('SELECT name FROM sqlite_master WHERE type="index" AND name LIKE "ix_%"')
+            self.assertEqual(len(c.fetchall()), 3)
+        self.assertEqual(self.cache.first_path(files[0]['id'])[0], '/')
+
+    def testResolve(self):
+        root = gen_folder()
+        folder = gen_folder([root])
+        folder['status'] = 'AVAILABLE'
+        file = gen_file([folder])
+        file['status'] = 'AVAILABLE'
+        self.cache.insert_nodes([root, folder, file])
+        self.cache = db.NodeCache(self.path)
+
+        path = '/%s/%s' % (folder['name'], file['name'])
+        self.assertEqual(self.cache.resolve(path).id, file['id'])
+        self.assertEqual(self.cache.resolve(path).id, file['id'])
+        self.assertIsNone(self.cache.resolve('/foo'))
+        self.assertIsNone(self.cache.resolve('/foo'))
+        self.assertEqual(self.cache.path_cache_info()['hits'], 2)
+
+        file['parents'] = [root['id']]
+        self.cache.insert_node(file)
+        self.assertIsNone(self.cache.resolve(path))
+        self.assertEqual(self.cache.resolve('/' + file['name']).id, file['id'])
+
+        new = gen_folder([root])
+        new['name'] = 'foo'
+        new['status'] = 'AVAILABLE'
+        self.cache.insert_node(new)
+        self.assertEqual(self.cache.resolve('/foo').id, new['id'])
+
+    def testResolveExternalChange(self):
+        root = gen_folder()
+        self.cache.insert_node(root)
+        self.cache = db.NodeCache(self.path)
+        self.assertIsNone(self.cache.resolve('/foo'))
+
+        folder = gen_folder([root])
+        folder['name'] = 'foo'
+        folder['status'] = 'AVAILABLE'
+        other = db.NodeCache(self.path)
+        other.insert_node(folder)
+        self.assertEqual(self.cache.resolve('/foo').id, folder['id'])
+
+    def testResolveConcurrentChange(self):
+        root = gen_folder()
+        folder, other = gen_folder([root]), gen_folder([root])
+        folder['status'] = other['status'] = 'AVAILABLE'
+        self.cache.insert_nodes([root, folder, other])
+        self.cache = db.NodeCache(self.path)
+        path = '/' + folder['name']
+        self.assertIsNone(self.cache.resolve('/foo'))
+        self.assertEqual(self.cache.resolve(path).id, folder['id'])
+        self.assertEqual(self.cache.resolve('/' + other['name']).id, other['id'])
+
+        # a modification by another thread of this process only invalidates the affected entries
+        folder['name'] = 'foo'
+        t = Thread(target=self.cache.insert_node, args=(folder,))
+        t.start()
+        t.join()
+        self.assertEqual(self.cache.resolve('/foo').id, folder['id'])
+        self.assertIsNone(self.cache.resolve(path))
+        self.assertEqual(self.cache.path_cache_info()['hits'], 0)
+        self.assertEqual(self.cache.resolve('/' + other['name']).id, other['id'])
+        self.assertEqual(self.cache.path_cache_info()['hits'], 1)
+
+    def testResolveStalePut(self):
+        root = gen_folder()
+        folder = gen_folder([root])
+        folder['status'] = 'AVAILABLE'
+        self.cache.insert_nodes([root, folder])
+        self.cache = db.NodeCache(self.path)
+        self.cache.resolve('/')
+        path = '/' + folder['name']
+
+        # another thread commits a rename after the lookup read the folder but before it is put
+        put = self.cache.path_cache.put
+
+        def put_after_rename(*args):
+            folder['name'] = 'foo'
+            t = Thread(target=self.cache.insert_node, args=(folder,))
+            t.start()
+            t.join()
+            put(*args)
+
+        self.cache.path_cache.put = put_after_rename
+        self.assertEqual(self.cache.resolve(path).id, folder['id'])
+        self.cache.path_cache.put = put
+        self.assertIsNone(self.cache.resolve(path))
+        self.assertEqual(self.cache.resolve('/foo').id, folder['id'])
+
+    def _gen_tree(self):
+        root = gen_folder()
+        folder = gen_folder([root])
+        subfolder = gen_folder([folder])
+        file = gen_file([subfolder])
+        return root, folder, subfolder, file
+
+    def testFirstPath(self):
+        root, folder, subfolder, file = self._gen_tree()
+        self.cache.insert_nodes([root, folder, subfolder, file])
+        self.assertEqual(self.cache.first_path(file['id']),
+                         '/%s/%s/' % (folder['name'], subfolder['name']))
+
+        folder['name'] = 'foo'
+        self.cache.insert_node(folder)
+        self.assertEqual(self.cache.first_path(file['id']), '/foo/%s/' % subfolder['name'])
+
+        subfolder['parents'] = [root['id']]
+        self.cache.insert_node(subfolder)
+        self.assertEqual(self.cache.first_path(file['id']), '/%s/' % subfolder['name'])
+        nodes = self.cache.find_by_path_prefix('/' + subfolder['name'])
+        self.assertEqual([n.id for n in nodes], [file['id']])
+        self.assertEqual(self.cache.find_by_path_prefix('/foo'), [])
+
+    def testFirstPathUnorderedInsertion(self):
+        root, folder, subfolder, file = self._gen_tree()
+        self.cache.insert_nodes([root])
+        self.cache.insert_nodes([file])
+        self.cache.insert_nodes([subfolder])
+        self.cache.insert_nodes([folder])
+        self.assertEqual(self.cache.first_path(file['id']),
+                         '/%s/%s/' % (folder['name'], subfolder['name']))
+        self.assertEqual(len(self.cache.find_by_path_prefix('/')), 3)
+
+    def testPathMigration(self):
+        root, folder, subfolder, file = self._gen_tree()
+        self.cache.insert_nodes([root, folder, subfolder, file])
+        self.cache._conn.executescript('DROP TABLE paths; PRAGMA user_version = 3;')
+        self.cache = db.NodeCache(self.path)
+        self.assertEqual(self.cache.find_by_path_prefix('/%s/%s' % (folder['name'],
+                                                                    subfolder['name']))[0].id,
+                         file['id'])
+
+    def testFind(self):
+        root = gen_folder()
+        files = [gen_file([root]) for _ in range(3)]
+        files[0]['name'] = 'Foobar.txt'
+        files[1]['name'] = 'foo.jpg'
+        files[2]['name'] = 'bar.jpg'
+        self.cache.insert_nodes([root] + files)
+        files[2]['name'] = 'baz.png'
+        self.cache.insert_node(files[2])
+        self.assertTrue(self.cache.fts)
+
+        for fts in (True, False):
+            self.cache.fts = fts
+            self.assertEqual([n.name for n in self.cache.find_by_name('foo')],
+                             ['Foobar.txt', 'foo.jpg'])
+            self.assertEqual(len(list(self.cache.find_by_name('fo'))), 2)
+            self.assertEqual(len(list(self.cache.find_by_name('foo', limit=1))), 1)
+            self.assertEqual([n.name for n in self.cache.find_by_name('bar')], ['Foobar.txt'])
+            self.assertEqual([n.name for n in self.cache.find_by_regex(r'foo.*\.(jpg|txt)$')],
+                             ['Foobar.txt', 'foo.jpg'])
+            self.assertEqual([n.name for n in self.cache.find_by_regex('baz')], ['baz.png'])
+
+        self.cache.remove_purged([files[0]['id']])
+        self.cache.fts = True
+        self.assertEqual([n.name for n in self.cache.find_by_name('foo')], ['foo.jpg'])
+
+        self.cache.drop_all()
+        self.cache.init()
+        self.assertEqual(list(self.cache.find_by_name('foo')), [])
+
+    def testFtsUnavailable(self):
+        root = gen_folder()
+        file = gen_file([root])
+        file['name'] = 'foo.jpg'
+        self.cache.insert_nodes([root, file])
+        self.assertTrue(self.cache.fts)
+
+        # another SQLite build without FTS5 opens the cache
+        probe = schema._PROBE_FTS_SQL
+        schema._PROBE_FTS_SQL = 'CREATE VIRTUAL TABLE temp.fts_probe USING nofts(name)'
+        try:
+            self.cache.init()
+        finally:
+            schema._PROBE_FTS_SQL = probe
+        self.assertFalse(self.cache.fts)
+        file['name'] = 'bar.jpg'
+        self.cache.insert_node(file)
+        self.assertEqual([n.name for n in self.cache.find_by_name('bar')], ['bar.jpg'])
+
+        # the outdated index is rebuilt
+        self.cache.init()
+        self.assertTrue(self.cache.fts)
+        self.assertEqual([n.name for n in self.cache.find_by_name('bar')], ['bar.jpg'])
+        self.assertEqual(list(self.cache.find_by_name('foo')), [])
+        self.assertIsNone(self.cache.KeyValueStorage.get(schema._FTS_OUTDATED_KEY))
+
+    def testRegexLiterals(self):
+        from acdcli.cache.query import regex_literals
+        self.assertEqual(regex_literals(r'^IMG_\d+\.jpe?g$'), ['IMG', '.jp'])
+        self.assertEqual(regex_literals('foo.*bar'), ['foo', 'bar'])
+        self.assertEqual(regex_literals('foo|bar'), [])
+
+    def testNodeDates(self):
+        from datetime import datetime
+        folder = gen_folder()
+        folder['createdDate'] = '2015-07-19T12:34:56.789Z'
+        self.cache.insert_node(folder)
+        n = self.cache.get_node(folder['id'])
+        self.assertEqual(n.created, datetime(2015, 7, 19, 12, 34, 56, 789000))
+        self.assertEqual(n.modified, datetime(2015, 1, 1))
+        self.assertEqual(n.ctime, 1437309296.789)
+        self.assertEqual(n.mtime, 1420070400.0)
+        self.assertFalse(hasattr(n, '__dict__'))
+
+    def testResolveChildren(self):
+        root = gen_folder()
+        folder = gen_folder([root])
+        folder['status'] = 'AVAILABLE'
+        files = [gen_file([folder]) for _ in range(10)]
+        self.cache.insert_nodes([root, folder] + files)
+        self.cache = db.NodeCache(self.path)
+
+        node, children = self.cache.resolve_children('/' + folder['name'])
+        self.assertEqual(node.id, folder['id'])
+        available = [f for f in files if f['status'] == 'AVAILABLE']
+        self.assertEqual(len(children), len(available))
+
+        misses = self.cache.path_cache_info()['misses']
+        for f in available:
+            self.assertEqual(self.cache.resolve('/%s/%s' % (folder['name'], f['name'])).id,
+                             f['id'])
+        self.assertEqual(self.cache.path_cache_info()['misses'], misses)
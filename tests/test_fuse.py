@@ -0,0 +1,512 @@
+"""Isolated FUSE proxy unit tests."""
+
+import errno
+import os
+import tempfile
+import unittest
+from concurrent.futures import Future
+from threading import Event, Lock, Thread
+from types import SimpleNamespace
+
+from acdcli.acd_fuse import FuseOSError, ReadProxy, WriteProxy, WriteBackProxy
+from acdcli.api.common import RequestError
+
+from .test_helper import gen_rand_id
+
+content = bytes(range(256)) * 40
+
+
+class Response(object):
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+        self.headers = {'content-length': str(len(data))}
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        while self.pos < len(self.data):
+            b = self.data[self.pos:self.pos + chunk_size]
+            self.pos += len(b)
+            yield b
+
+    def close(self):
+        self.closed = True
+
+
+class Client(object):
+    """Fake ACDClient serving ranges of :data:`content` and recording the requests."""
+
+    def __init__(self):
+        self.requests = []
+        self.lock = Lock()
+
+    def _request(self, offset, length) -> bytes:
+        with self.lock:
+            self.requests.append((offset, length))
+        return content[offset:offset + length]
+
+    def response_chunk(self, id_, offset, length, **kwargs):
+        return Response(self._request(offset, length))
+
+    def download_chunk(self, id_, offset, length, **kwargs):
+        return self._request(offset, length)
+
+
+class Executor(object):
+    """Executor running the submitted functions right away."""
+
+    def submit(self, fn, *args, **kwargs):
+        f = Future()
+        try:
+            f.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            f.set_exception(e)
+        return f
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ReadAheadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.id = gen_rand_id()
+        self.source = ReadProxy.BlockSource(self.client, 1, 100, 4, Executor(), None)
+        self.file = ReadProxy.ReadFile(10, 1, self.source, min_range=150, max_range=400)
+
+    def read(self, offset, length) -> bytes:
+        return self.file.get(self.client, self.id, None, offset, length, len(content))
+
+    def testWindow(self):
+        windows = []
+        for offset in range(0, 1000, 50):
+            self.assertEqual(self.read(offset, 50), content[offset:offset + 50])
+            windows.append(self.file.window)
+        self.assertEqual(windows[:6], [0, 1, 1, 2, 2, 4])
+        self.assertEqual(max(windows), 4)
+
+        # random access
+        self.read(5000, 50)
+        self.assertEqual(self.file.window, 2)
+        self.assertEqual(self.file.streak, 0)
+        self.assertEqual(list(self.file.blocks), [])
+
+    def testNoOverlap(self):
+        for offset in range(0, len(content), 50):
+            self.assertEqual(self.read(offset, 50), content[offset:offset + 50])
+
+        # every byte is requested exactly once
+        pos = 0
+        for offset, length in sorted(self.client.requests):
+            self.assertEqual(offset, pos)
+            pos += length
+        self.assertEqual(pos, len(content))
+
+        # the first chunk ends at a block boundary
+        self.assertEqual(self.client.requests[0], (0, 200))
+
+    def testDisabled(self):
+        rp = ReadProxy(self.client, 10, 1, readahead_max_blocks=0, min_range=100)
+        self.assertIsNone(rp.blocks.executor)
+        for offset in range(0, 1000, 50):
+            rp.get(self.id, None, offset, 50, len(content))
+        self.assertEqual(rp.files[self.id].window, 0)
+        self.assertEqual(rp.info()['consumed'], 1000)
+
+
+class StreamChunkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.chunk = ReadProxy.StreamChunk(self.client, gen_rand_id(), 0, 1000,
+                                           seek_back=100, skip_ahead=200)
+
+    def testSequential(self):
+        self.assertEqual(self.chunk.end, 999)
+        for offset in range(0, 1000, 100):
+            self.assertTrue(self.chunk.has_byte_range(offset, 100))
+            self.assertEqual(self.chunk.get(offset, 100), content[offset:offset + 100])
+        self.assertFalse(self.chunk.has_byte_range(1000, 1))
+        self.assertEqual(len(self.client.requests), 1)
+
+    def testSeekBack(self):
+        self.chunk.get(0, 150)
+        self.assertEqual(len(self.chunk.ring), 100)
+        self.assertFalse(self.chunk.has_byte_range(49, 10))
+        self.assertTrue(self.chunk.has_byte_range(50, 10))
+        self.assertEqual(self.chunk.get(50, 10), content[50:60])
+        # partially from the ring buffer
+        self.assertEqual(self.chunk.get(120, 60), content[120:180])
+        self.assertEqual(self.chunk.offset, 180)
+
+    def testSkipAhead(self):
+        self.chunk.get(0, 10)
+        self.assertFalse(self.chunk.has_byte_range(211, 10))
+        self.assertTrue(self.chunk.has_byte_range(210, 10))
+        self.assertEqual(self.chunk.get(210, 10), content[210:220])
+        # the skipped bytes are kept for backward seeks
+        self.assertEqual(self.chunk.get(150, 10), content[150:160])
+        self.assertFalse(self.chunk.has_byte_range(995, 10))
+        self.assertEqual(len(self.client.requests), 1)
+
+    def testNoSeekBack(self):
+        chunk = ReadProxy.StreamChunk(self.client, gen_rand_id(), 100, 100)
+        chunk.get(100, 10)
+        self.assertFalse(chunk.has_byte_range(105, 1))
+        self.assertFalse(chunk.has_byte_range(111, 1))
+        self.assertTrue(chunk.has_byte_range(110, 90))
+
+
+class RangeSizeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.id = gen_rand_id()
+        self.rp = ReadProxy(self.client, 10, 1, readahead_max_blocks=0,
+                            min_range=100, max_range=400)
+
+    def read(self, offset, length) -> bytes:
+        return self.rp.get(self.id, None, offset, length, len(content))
+
+    def testSequential(self):
+        for offset in range(0, 2000, 100):
+            self.assertEqual(self.read(offset, 100), content[offset:offset + 100])
+        # doubled each time a chunk is exhausted, up to the maximum
+        self.assertEqual(self.client.requests,
+                         [(0, 100), (100, 200), (300, 400), (700, 400), (1100, 400),
+                          (1500, 400), (1900, 400)])
+        self.assertEqual(self.rp.info(), dict(requests=7, requested=2300, consumed=2000))
+
+    def testRandom(self):
+        self.read(0, 100)
+        self.read(100, 100)
+        self.read(5000, 10)
+        self.read(8000, 200)
+        self.assertEqual(self.client.requests, [(0, 100), (100, 200), (5000, 100), (8000, 200)])
+
+    def testMinimum(self):
+        rp = ReadProxy(self.client, 10, 1, readahead_max_blocks=0,
+                       min_range=100, max_range=50)
+        self.assertEqual(rp.files[self.id].max_range, 100)
+
+
+class Cache(object):
+    def __init__(self):
+        self.nodes = []
+
+    def insert_node(self, node: dict):
+        self.nodes.append(node)
+
+
+class WriteBackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'staging')
+        self.uploads = []
+        self.callbacks = []
+        self.client = SimpleNamespace(overwrite_stream=self.overwrite_stream,
+                                      chunked_download=self.chunked_download)
+        self.cache = Cache()
+        self.wp = WriteBackProxy(self.client, self.cache, self.path, 2, self.callbacks.append)
+        self.node = SimpleNamespace(id=gen_rand_id(), size=0)
+
+    def tearDown(self):
+        self.wp.shutdown()
+        self.dir.cleanup()
+
+    def overwrite_stream(self, stream, node_id) -> dict:
+        self.uploads.append((node_id, stream.read()))
+        return dict(id=node_id)
+
+    def chunked_download(self, node_id, fo, length=None):
+        fo.write(content[:length])
+
+    def testUpload(self):
+        self.wp.open(self.node.id, 1)
+        self.wp.write(self.node, 1, 0, b'foo')
+        self.wp.write(self.node, 1, 6, b'bar')
+        self.assertEqual(self.wp.size(self.node.id), 9)
+        self.assertEqual(self.wp.read(self.node.id, 0, 9), b'foo\0\0\0bar')
+        self.assertEqual(self.uploads, [])
+
+        self.wp.release(1)
+        self.wp.shutdown()
+        self.assertEqual(self.uploads, [(self.node.id, b'foo\0\0\0bar')])
+        self.assertEqual(self.cache.nodes, [dict(id=self.node.id)])
+        self.assertEqual(self.callbacks, [self.node.id])
+        self.assertIsNone(self.wp.size(self.node.id))
+        self.assertEqual(os.listdir(self.path), [])
+
+    def testStageContent(self):
+        node = SimpleNamespace(id=gen_rand_id(), size=1000)
+        self.wp.open(node.id, 1)
+        self.wp.write(node, 1, 10, b'foo')
+        self.assertEqual(self.wp.read(node.id, 0, 20), content[:10] + b'foo' + content[13:20])
+        self.assertEqual(self.wp.size(node.id), 1000)
+
+    def testTruncate(self):
+        node = SimpleNamespace(id=gen_rand_id(), size=1000)
+        self.wp.open(node.id, 1)
+        self.wp.truncate(node, 100)
+        self.assertEqual(self.wp.size(node.id), 100)
+        # not uploaded while opened for writing
+        self.assertFalse(self.wp.files[node.id].scheduled)
+
+        self.wp.release(1)
+        self.wp.truncate(node, 10)
+        self.wp.shutdown()
+        self.assertEqual(self.uploads[-1], (node.id, content[:10]))
+
+    def testReupload(self):
+        started, resume, done = Event(), Event(), Event()
+
+        def overwrite_stream(stream, node_id):
+            started.set()
+            resume.wait(5)
+            r = self.overwrite_stream(stream, node_id)
+            if len(self.uploads) == 2:
+                done.set()
+            return r
+
+        self.client.overwrite_stream = overwrite_stream
+        self.wp.write(self.node, 1, 0, b'foo')
+        self.wp.release(1)
+        self.assertTrue(started.wait(5))
+
+        # modified while being uploaded
+        self.wp.write(self.node, 2, 3, b'bar')
+        self.wp.release(2)
+        resume.set()
+        self.assertTrue(done.wait(5))
+        self.wp.shutdown()
+        self.assertEqual(self.uploads[-1], (self.node.id, b'foobar'))
+        self.assertIsNone(self.wp.size(self.node.id))
+
+    def testUploadError(self):
+        def overwrite_stream(stream, node_id):
+            raise ValueError
+
+        self.client.overwrite_stream = overwrite_stream
+        self.wp.write(self.node, 1, 0, b'foo')
+        self.wp.release(1)
+        self.wp.executor.shutdown(wait=True)
+        f = self.wp.files[self.node.id]
+        # kept for the next release or mount
+        self.assertFalse(f.scheduled)
+        self.assertEqual(self.wp.read(self.node.id, 0, 3), b'foo')
+
+    def testResume(self):
+        self.wp.write(self.node, 1, 0, b'foo')
+        os.close(self.wp.files[self.node.id].fd)
+        open(os.path.join(self.path, '.tmp123'), 'wb').close()
+
+        wp = WriteBackProxy(self.client, self.cache, self.path, 1)
+        self.assertEqual(wp.files, {})
+        wp.resume()
+        wp.shutdown()
+        self.assertEqual(self.uploads, [(self.node.id, b'foo')])
+        self.assertEqual(os.listdir(self.path), [])
+
+    def testDiscard(self):
+        self.wp.write(self.node, 1, 0, b'foo')
+        self.wp.discard(self.node.id)
+        self.wp.release(1)
+        self.wp.shutdown()
+        self.assertEqual(self.uploads, [])
+        self.assertEqual(os.listdir(self.path), [])
+
+
+class WriteStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stream = WriteProxy.WriteStream(2, 1)
+
+    def start(self, target, *args) -> Thread:
+        t = Thread(target=target, args=args, daemon=True)
+        t.start()
+        return t
+
+    def testRead(self):
+        read = []
+        t = self.start(lambda: read.append(self.stream.read()))
+        t.join(0.1)
+        self.assertTrue(t.is_alive())
+        self.stream.write(b'foo')
+        t.join(1)
+        self.assertEqual(read, [b'foo'])
+
+        t = self.start(lambda: read.append(self.stream.read()))
+        self.start(self.stream.close)
+        t.join(1)
+        self.assertEqual(read, [b'foo', b''])
+        self.stream.finish()
+
+    def testBufferFull(self):
+        self.stream.started = True
+        self.stream.write(b'foo')
+        self.stream.write(b'bar')
+        t = self.start(self.stream.write, b'baz')
+        t.join(0.1)
+        self.assertTrue(t.is_alive())
+        self.assertEqual(self.stream.read(), b'foobar')
+        t.join(1)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(self.stream.offset, 9)
+
+    def testWriteTimeout(self):
+        self.stream.timeout = 0.1
+        self.stream.started = True
+        self.stream.write(b'foo')
+        self.stream.write(b'bar')
+        with self.assertRaises(FuseOSError) as cm:
+            self.stream.write(b'baz')
+        self.assertEqual(cm.exception.errno, errno.ETIMEDOUT)
+
+    def testFlush(self):
+        self.stream.write(b'foo')
+        t = self.start(self.stream.flush)
+        t.join(0.1)
+        self.assertTrue(t.is_alive())
+        self.stream.read()
+        t.join(1)
+        self.assertFalse(t.is_alive())
+
+    def testClose(self):
+        errors = []
+
+        def close():
+            try:
+                self.stream.close()
+            except FuseOSError as e:
+                errors.append(e.errno)
+
+        t = self.start(close)
+        t.join(0.1)
+        self.assertTrue(t.is_alive())
+        self.assertEqual(self.stream.read(), b'')
+        self.stream.finish()
+        t.join(1)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(errors, [])
+
+        self.stream = WriteProxy.WriteStream(2, 1)
+        t = self.start(close)
+        t.join(0.1)
+        self.stream.fail()
+        t.join(1)
+        self.assertEqual(errors, [errno.EREMOTEIO])
+
+    def testFail(self):
+        errors = []
+
+        def read():
+            try:
+                self.stream.read()
+            except IOError as e:
+                errors.append(e.errno)
+
+        t = self.start(read)
+        self.stream.fail()
+        t.join(1)
+        self.assertEqual(errors, [errno.EIO])
+        with self.assertRaises(FuseOSError):
+            self.stream.write(b'foo')
+
+
+class PendingFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.errors = []
+        self.uploads = []
+        self.attempted = Event()
+        self.client = SimpleNamespace(upload_stream=self.upload_stream)
+        self.cache = Cache()
+        self.wp = WriteProxy(self.client, self.cache, 8, 1, small_file_size=10, create_threads=2)
+        self.wp.RETRY_DELAY = 0.05
+
+    def tearDown(self):
+        self.wp.shutdown()
+
+    def upload_stream(self, stream, name, parent_id) -> dict:
+        self.attempted.set()
+        if self.errors:
+            raise self.errors.pop(0)
+        self.uploads.append((name, parent_id, stream.read()))
+        return dict(id=gen_rand_id(), name=name)
+
+    def create(self, path, data: bytes, fh=1) -> WriteProxy.PendingFile:
+        node = self.wp.create(path, 'parent', fh)
+        self.wp.write(node, fh, 0, data)
+        return node
+
+    def testCreate(self):
+        node = self.create('/dir/foo', b'foo')
+        self.assertIsNone(node.id)
+        self.assertEqual(node.size, 3)
+        self.assertEqual(node.read(1, 5), b'oo')
+        self.assertEqual(self.wp.pending_children('/dir'), [node])
+        self.assertEqual(self.wp.pending_children('/'), [])
+        self.wp.flush(1)
+        self.assertEqual(self.uploads, [])
+
+        self.wp.release(1)
+        self.wp.wait_created('/dir/foo', 5)
+        self.assertEqual(self.uploads, [('foo', 'parent', b'foo')])
+        self.assertIsNotNone(node.id)
+        self.assertEqual(self.cache.nodes[0]['id'], node.id)
+        self.assertEqual(self.wp.pending, {})
+
+    def testStream(self):
+        node = self.create('/foo', b'0123456789')
+        self.wp.write(node, 1, 10, b'abc')
+        with self.assertRaises(FuseOSError):
+            node.read(0, 1)
+        self.wp.release(1)
+        self.assertEqual(self.uploads, [('foo', 'parent', b'0123456789abc')])
+        self.assertTrue(node.created.is_set())
+
+    def testRetry(self):
+        self.errors = [RequestError(500, ''), IOError()]
+        node = self.create('/foo', b'foo')
+        self.wp.release(1)
+        self.wp.wait_created('/foo', 5)
+        self.assertEqual(self.uploads, [('foo', 'parent', b'foo')])
+        self.assertIsNotNone(node.id)
+        self.assertEqual(self.wp.failed, {})
+
+    def testFinalFailure(self):
+        self.errors = [RequestError(RequestError.codes.CONFLICT, '')]
+        node = self.create('/foo', b'foo')
+        self.wp.release(1)
+        self.wp.wait_created('/foo', 5)
+        self.assertIsNone(node.id)
+        self.assertTrue(node.stream.error)
+        self.assertEqual(self.wp.pending, {})
+        self.assertEqual(self.wp.failed, {})
+
+    def testCacheFailure(self):
+        def insert_node(node):
+            raise ValueError
+
+        self.cache.insert_node = insert_node
+        node = self.create('/foo', b'foo')
+        self.wp.release(1)
+        self.wp.wait_created('/foo', 5)
+        # created remotely, so it is not created again
+        self.assertIsNotNone(node.id)
+        self.assertEqual(len(self.uploads), 1)
+        self.assertEqual(self.wp.failed, {})
+
+    def testShutdown(self):
+        self.wp.RETRY_DELAY = 100
+        self.errors = [RequestError(500, '')]
+        node = self.create('/foo', b'foo')
+        self.wp.release(1)
+        self.assertTrue(self.attempted.wait(5))
+        self.wp.shutdown()
+        self.assertEqual(self.uploads, [('foo', 'parent', b'foo')])
+        self.assertTrue(node.created.is_set())
+        self.assertEqual(self.wp.failed, {})
+
+    def testWaitTimeout(self):
+        self.create('/foo', b'foo')
+        with self.assertRaises(FuseOSError) as cm:
+            self.wp.wait_created('/foo', 0.1)
+        self.assertEqual(cm.exception.errno, errno.EBUSY)
+        self.wp.release(1)
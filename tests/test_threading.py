@@ -0,0 +1,63 @@
+import unittest
+from functools import partial
+from threading import Lock
+
+from acd_cli import RetryRetVal
+from acdcli.utils.progress import FileProgress
+from acdcli.utils.threading import QueuedLoader, in_order
+
+
+class QueuedLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.order = []
+        self.lock = Lock()
+
+    def job(self, name, fails=0, pg_handler=None):
+        with self.lock:
+            self.order.append(name)
+            retry = self.order.count(name) <= fails
+        return RetryRetVal(1 if retry else 0, retry)
+
+    def jobs(self, sizes: dict, fails=None) -> list:
+        fails = fails or {}
+        return [partial(self.job, name, fails.get(name, 0), pg_handler=FileProgress(size))
+                for name, size in sizes.items()]
+
+    def testLargestFirst(self):
+        ql = QueuedLoader(print_progress=False, large_file_size=100)
+        ql.add_jobs(self.jobs(dict(a=10, b=500, c=50, d=100)))
+        self.assertEqual(ql.start(), 0)
+        self.assertEqual(self.order, ['b', 'd', 'c', 'a'])
+
+    def testInOrder(self):
+        ql = QueuedLoader(print_progress=False, policy=in_order)
+        ql.add_jobs(self.jobs(dict(a=10, b=500, c=50)))
+        ql.start()
+        self.assertEqual(self.order, ['a', 'b', 'c'])
+
+    def testWorkerLimit(self):
+        self.assertEqual(QueuedLoader(16, print_progress=False).workers,
+                         QueuedLoader.MAX_NUM_WORKERS)
+        self.assertEqual(QueuedLoader(16, print_progress=False, max_workers=32).workers, 16)
+
+    def testDelayedRetry(self):
+        ql = QueuedLoader(print_progress=False, max_retries=2, policy=in_order, retry_delay=0.2)
+        ql.add_jobs(self.jobs(dict(a=1, b=1, c=1), fails=dict(a=1, b=5)))
+        self.assertEqual(ql.start(), 1)
+        # the failed job does not block the worker
+        self.assertEqual(self.order[:4], ['a', 'b', 'c', 'a'])
+        self.assertEqual(self.order.count('b'), 3)
+
+    def testProducer(self):
+        ql = QueuedLoader(2, print_progress=False, max_queued=2)
+        queued = []
+
+        def produce():
+            for job in self.jobs({str(i): i for i in range(20)}):
+                ql.add_job(job)
+                queued.append(ql._queued())
+            return 2
+
+        self.assertEqual(ql.start(produce), 2)
+        self.assertEqual(sorted(self.order, key=int), [str(i) for i in range(20)])
+        self.assertLessEqual(max(queued), 2)